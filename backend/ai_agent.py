@@ -37,14 +37,17 @@ def summarize_data(df: pd.DataFrame) -> str:
     
     # Status breakdown
     if 'status' in df.columns:
-        status_counts = df['status'].value_counts().to_dict()
+        # Categorical columns also count categories with no rows left after filtering
+        status_counts = df['status'].value_counts()
+        status_counts = status_counts[status_counts > 0].to_dict()
         status_summary = ", ".join([f"{k}: {v}" for k, v in status_counts.items()])
     else:
         status_summary = "N/A"
 
     # Type breakdown (Top 5)
     if 'tipo_solicitacao' in df.columns:
-        type_counts = df['tipo_solicitacao'].value_counts().head(5).to_dict()
+        type_counts = df['tipo_solicitacao'].value_counts()
+        type_counts = type_counts[type_counts > 0].head(5).to_dict()
         type_summary = ", ".join([f"{k}: {v}" for k, v in type_counts.items()])
     else:
         type_summary = "N/A"
@@ -9,6 +9,10 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-prod")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 # 24 hours
 
+# Single-purpose token for the /upload/events query string (it ends up in access logs)
+EVENTS_TOKEN_SCOPE = "upload-events"
+EVENTS_TOKEN_EXPIRE_MINUTES = 5
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def verify_password(plain_password, hashed_password):
@@ -28,6 +32,9 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_events_token(sub: str):
+    return create_access_token({"sub": sub, "scope": EVENTS_TOKEN_SCOPE}, timedelta(minutes=EVENTS_TOKEN_EXPIRE_MINUTES))
+
 def decode_access_token(token: str) -> Optional[dict]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -0,0 +1,289 @@
+"""
+export_jobs.py
+Background export jobs and the on-disk cache of their result files.
+
+A large /export-excel or /export keeps an HTTP worker busy for the whole
+generation and can be cut by proxy timeouts. Export jobs decouple the two:
+  - POST /export/jobs records an ExportJob row and queues it on a fair
+    per-user queue (ingest_queue.FairJobQueue, EXPORT_MAX_CONCURRENCY
+    threads); GET /export/jobs/{id} polls it, .../download serves the file
+  - The worker writes the file with process_export.write_file into
+    EXPORT_CACHE_DIR, reporting the rows written as it goes
+  - Result files are named after (user, dataset version and revision,
+    format, FilterSpec key): a repeated identical export is completed at
+    once from the file, and an identical export still running is reused
+  - The cache is bounded by EXPORT_CACHE_MAX_MB and EXPORT_CACHE_MAX_AGE_HOURS:
+    files unused for longer than the max age are removed, then the least
+    recently used ones until the directory fits; a download touches the file
+  - /clear and user deletion remove the user's files right away
+  - A job whose dataset changed after it was submitted (a new upload
+    replaced the version, or a diff upload or /clear bumped the revision)
+    fails instead of exporting mixed or vanished rows under a stale cache
+    key; jobs still waiting in this process's queue are never expired
+"""
+
+import os
+import time
+import hashlib
+import logging
+import tempfile
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, engine
+from models import ExportJob, Process, User
+import ingest_queue
+import process_export
+import process_query
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CACHE_DIR = os.getenv(
+    "EXPORT_CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), "data", "export_cache")
+)
+
+try:
+    EXPORT_CACHE_MAX_BYTES = int(os.getenv("EXPORT_CACHE_MAX_MB", "500")) * 1024 * 1024
+except ValueError:
+    EXPORT_CACHE_MAX_BYTES = 500 * 1024 * 1024
+
+try:
+    EXPORT_CACHE_MAX_AGE = float(os.getenv("EXPORT_CACHE_MAX_AGE_HOURS", "24")) * 3600
+except ValueError:
+    EXPORT_CACHE_MAX_AGE = 24 * 3600
+
+try:
+    EXPORT_MAX_CONCURRENCY = max(1, int(os.getenv("EXPORT_MAX_CONCURRENCY", "1")))
+except ValueError:
+    EXPORT_MAX_CONCURRENCY = 1
+
+EXPORT_JOB_HISTORY = 20
+
+# Queued/processing jobs without an update for this long belong to a process that died
+EXPORT_JOB_STALE_SECONDS = 900
+
+# Minimum interval between progress writes of one job
+PROGRESS_MIN_INTERVAL = 1.0
+
+JOB_FORMATS = ("xlsx",) + tuple(process_export.EXPORT_FORMATS)
+ACTIVE_STATUSES = ("queued", "processing")
+
+DATASET_CHANGED = "Os dados foram alterados por um novo upload. Exporte novamente."
+
+queue = ingest_queue.FairJobQueue(EXPORT_MAX_CONCURRENCY, name="export")
+
+
+def cache_key(user_id: int, dataset_version: int, revision: int, fmt: str, filters: process_query.FilterSpec) -> str:
+    """Result file name of an export."""
+    params = repr((dataset_version, revision, fmt, filters.key()))
+    return f"{user_id}-{hashlib.sha256(params.encode()).hexdigest()[:40]}"
+
+
+def artifact_path(job: ExportJob) -> str:
+    return os.path.join(EXPORT_CACHE_DIR, f"{job.cache_key}.{process_export.file_extension(job.format)}")
+
+
+def cached_artifact(job: ExportJob) -> Optional[str]:
+    """Path of the job's result file if it is still cached (and mark it used)."""
+    path = artifact_path(job)
+    try:
+        if time.time() - os.stat(path).st_mtime > EXPORT_CACHE_MAX_AGE:
+            os.remove(path)
+            return None
+        os.utime(path)  # LRU: mark as recently used
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def _expire_stale(db: Session, job: Optional[ExportJob]) -> Optional[ExportJob]:
+    if (
+        job and job.status in ACTIVE_STATUSES
+        and job.updated_at < datetime.utcnow() - timedelta(seconds=EXPORT_JOB_STALE_SECONDS)
+        # Waiting behind other exports (or running) in this process: not abandoned
+        and queue.position(job.user_id) is None
+    ):
+        logger.warning(f"Export job {job.id} of user {job.user_id} stopped reporting progress; marking it as failed.")
+        job.status = "error"
+        job.error = "Interrompido"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+    return job
+
+
+def get_job(db: Session, user_id: int, job_id: int) -> Optional[ExportJob]:
+    """The user's export job `job_id`, with an abandoned job marked as failed."""
+    job = db.query(ExportJob).filter(ExportJob.id == job_id, ExportJob.user_id == user_id).first()
+    return _expire_stale(db, job)
+
+
+def submit(db: Session, user, fmt: str, filters: process_query.FilterSpec) -> ExportJob:
+    """
+    Export job for the user's live dataset with these filters (commits):
+    completed right away from a cached file, the identical job already
+    running, or a new queued job.
+    """
+    version = user.active_dataset_version or 0
+    revision = user.dataset_revision or 0
+    key = cache_key(user.id, version, revision, fmt, filters)
+
+    same = db.query(ExportJob).filter(
+        ExportJob.user_id == user.id, ExportJob.cache_key == key, ExportJob.format == fmt
+    ).order_by(ExportJob.id.desc())
+    running = _expire_stale(db, same.filter(ExportJob.status.in_(ACTIVE_STATUSES)).first())
+    if running and running.status in ACTIVE_STATUSES:
+        return running
+
+    _prune(db, user.id)
+    now = datetime.utcnow()
+    job = ExportJob(
+        user_id=user.id, format=fmt, filters=filters.params(), dataset_version=version, dataset_revision=revision,
+        cache_key=key, status="queued", rows=0, created_at=now, updated_at=now,
+    )
+    path = cached_artifact(job)
+    if path:
+        previous = same.filter(ExportJob.status == "completed").first()
+        job.status = "completed"
+        job.rows = previous.rows if previous else None
+        job.size = os.path.getsize(path)
+        job.started_at = job.finished_at = now
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    if job.status == "queued":
+        queue.submit(user.id, run_job, job.id)
+    return job
+
+
+def _prune(db: Session, user_id: int) -> None:
+    """Keep the user's last EXPORT_JOB_HISTORY finished jobs (their files stay cached)."""
+    finished = db.query(ExportJob.id).filter(
+        ExportJob.user_id == user_id, ExportJob.status.notin_(ACTIVE_STATUSES)
+    ).order_by(ExportJob.id.desc()).offset(EXPORT_JOB_HISTORY - 1).all()
+    if finished:
+        db.query(ExportJob).filter(ExportJob.id.in_([r.id for r in finished])).delete(synchronize_session=False)
+
+
+def _update(job_id: int, **fields) -> None:
+    """Set columns of the job row in a short transaction of its own."""
+    fields = dict(fields, updated_at=datetime.utcnow())
+    try:
+        with engine.begin() as conn:
+            conn.execute(update(ExportJob.__table__).where(ExportJob.__table__.c.id == job_id).values(**fields))
+    except Exception as e:
+        logger.warning(f"Failed to update export job {job_id}: {e}")
+
+
+def _dataset_unchanged(db: Session, job: ExportJob) -> bool:
+    """True while the user's live dataset is still the one the job was submitted for."""
+    live = db.query(User.active_dataset_version, User.dataset_revision).filter(User.id == job.user_id).first()
+    return live is not None and (live[0] or 0, live[1] or 0) == (job.dataset_version, job.dataset_revision or 0)
+
+
+def run_job(job_id: int) -> None:
+    """Worker entry point: write the job's file into the cache."""
+    db = SessionLocal()
+    tmp_path = None
+    try:
+        job = db.query(ExportJob).filter(ExportJob.id == job_id).first()
+        if job is None or job.status != "queued":
+            return
+        if not _dataset_unchanged(db, job):
+            _update(job_id, status="error", error=DATASET_CHANGED, finished_at=datetime.utcnow())
+            return
+        _update(job_id, status="processing", started_at=datetime.utcnow())
+
+        filters = process_query.FilterSpec(**(job.filters or {}))
+        base_query = db.query(Process).filter(
+            Process.user_id == job.user_id, Process.dataset_version == job.dataset_version
+        )
+
+        def track(rows):
+            last = time.monotonic()
+            for n, row in enumerate(rows, start=1):
+                if n % process_export.EXPORT_BATCH_SIZE == 0 and time.monotonic() - last >= PROGRESS_MIN_INTERVAL:
+                    last = time.monotonic()
+                    _update(job_id, rows=n)
+                yield row
+
+        os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=EXPORT_CACHE_DIR, suffix=".tmp")
+        os.close(fd)
+        written = process_export.write_file(tmp_path, job.format, base_query, filters, track=track)
+        # Replaced or changed by a diff upload while the file was being written
+        if not _dataset_unchanged(db, job):
+            _update(job_id, status="error", error=DATASET_CHANGED, finished_at=datetime.utcnow())
+            return
+        # Atomic, so concurrent downloads never see a partial file
+        path = artifact_path(job)
+        os.replace(tmp_path, path)
+        tmp_path = None
+        _update(job_id, status="completed", rows=written, size=os.path.getsize(path), finished_at=datetime.utcnow())
+        logger.info(f"Export job {job_id} of user {job.user_id} completed: {written} rows as {job.format}.")
+        _evict()
+    except Exception as e:
+        logger.exception(f"Export job {job_id} failed")
+        _update(job_id, status="error", error=str(e), finished_at=datetime.utcnow())
+    finally:
+        if tmp_path:
+            process_export.remove_file(tmp_path)
+        db.close()
+
+
+def job_status(job: ExportJob) -> dict:
+    state = {
+        "job_id": job.id,
+        "status": job.status,
+        "format": job.format,
+        "filters": job.filters or {},
+        "rows": job.rows,
+        "size": job.size,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "download_url": None,
+    }
+    if job.status == "completed":
+        state["download_url"] = f"/export/jobs/{job.id}/download"
+    return state
+
+
+def discard_user(user_id: int) -> int:
+    """Remove the user's cached result files (after /clear or user deletion)."""
+    removed = 0
+    try:
+        names = os.listdir(EXPORT_CACHE_DIR)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        if name.startswith(f"{user_id}-"):
+            process_export.remove_file(os.path.join(EXPORT_CACHE_DIR, name))
+            removed += 1
+    return removed
+
+
+def _evict() -> None:
+    now = time.time()
+    entries = []
+    for name in os.listdir(EXPORT_CACHE_DIR):
+        path = os.path.join(EXPORT_CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if now - st.st_mtime > EXPORT_CACHE_MAX_AGE:
+            # Expired, or a temp file left by a process that died
+            process_export.remove_file(path)
+        elif not name.endswith(".tmp"):
+            entries.append((st.st_mtime, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= EXPORT_CACHE_MAX_BYTES:
+            break
+        process_export.remove_file(path)
+        total -= size
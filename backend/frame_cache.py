@@ -0,0 +1,108 @@
+"""
+frame_cache.py
+Process-local LRU cache of each user's prepared process DataFrame.
+
+The endpoints that still work on a DataFrame (the AI report) used to run a
+full `pd.read_sql` of the user's rows on every request:
+  - Frames are cached per user, tagged with users.dataset_revision; ingest
+    (replace and diff) and /clear bump the revision, so a stale frame is
+    never served and is replaced on the next load
+  - The cache holds at most DATAFRAME_CACHE_MB in total, estimated with
+    DataFrame.memory_usage(deep=True); the least recently used frames are
+    evicted first, and a frame larger than the whole budget is not cached
+  - Hit / miss / eviction counters are exposed by stats() (/admin/cache)
+
+Cached frames are shared between requests: callers must filter into new
+frames and never modify them in place.
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+try:
+    DATAFRAME_CACHE_MB = max(0, int(os.getenv("DATAFRAME_CACHE_MB", "256")))
+except ValueError:
+    DATAFRAME_CACHE_MB = 256
+
+
+def frame_size(df: pd.DataFrame) -> int:
+    """Estimated memory of a DataFrame in bytes (object columns included)."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class FrameCache:
+    """LRU of user_id -> (dataset revision, DataFrame, size) within a byte budget."""
+
+    def __init__(self, max_bytes: int = DATAFRAME_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int, revision: int, loader) -> pd.DataFrame:
+        """The user's frame at `revision`, calling loader() to build it on a miss."""
+        with self._lock:
+            entry = self._frames.get(user_id)
+            if entry is not None and entry[0] == revision:
+                self._frames.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Loaded outside the lock: a slow read must not block other users' hits
+        df = loader()
+        self.put(user_id, revision, df)
+        return df
+
+    def put(self, user_id: int, revision: int, df: pd.DataFrame) -> None:
+        size = frame_size(df)
+        with self._lock:
+            # A concurrent load may already have stored a newer revision; keep the newest
+            current = self._frames.get(user_id)
+            if current is not None and current[0] > revision:
+                return
+            self._drop(user_id)
+            if size > self.max_bytes:
+                return
+            self._frames[user_id] = (revision, df, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                evicted, (_, _, evicted_size) = self._frames.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+                logger.debug(f"Evicted DataFrame of user {evicted} ({evicted_size} bytes)")
+
+    def invalidate(self, user_id: int) -> None:
+        """Drop the user's frame right away (its memory is released before the next load)."""
+        with self._lock:
+            self._drop(user_id)
+
+    def _drop(self, user_id: int) -> None:
+        entry = self._frames.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._frames),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+frames = FrameCache()
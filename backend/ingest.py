@@ -0,0 +1,454 @@
+"""
+ingest.py
+Bulk persistence of parsed process records.
+
+Building one ORM object per record and going through the session's
+unit-of-work dominates the save phase for large uploads. Rows are written
+with SQLAlchemy Core instead, using the fastest path per dialect:
+  - PostgreSQL: COPY ... FROM STDIN (psycopg2 copy_expert)
+  - Others (SQLite): insert().execute with a list of rows (DBAPI executemany)
+
+Versioned datasets:
+  - An upload stages its rows under a new `dataset_version`; readers only
+    see rows matching users.active_dataset_version, so partial uploads are
+    never visible
+  - activate_dataset_version switches the user over in one short UPDATE
+  - users.dataset_revision is bumped on every change of the live dataset
+    (activation, applied diff, /clear); caches of user data key on it
+  - Rows of other versions (the previous dataset, cancelled or crashed
+    uploads) are removed afterwards by discard_inactive_versions
+
+Derived columns (computed once here, so read paths never re-parse strings):
+  - data_abertura_date: the dd/mm/yyyy opening date as a DATE (NULL if invalid)
+  - month_year: "YYYY-MM" of that date
+  - tipo_solicitacao is stored canonicalized (stripped, whitespace collapsed)
+  - search_text: accent-stripped id / contribuinte / tipo for the search
+    index; contribuinte_key / tipo_key: normalized prefix keys for
+    autocomplete (process_search.py)
+
+Per-version aggregates (build_dataset_aggregates), each one INSERT ...
+SELECT ... GROUP BY over the version's rows:
+  - process_stats_cube: counts by month × status × tipo × delayed
+    (read by process_stats.py)
+  - process_suggestions: counts by normalized contribuinte name / tipo for
+    autocomplete (read by process_search.py)
+  - Replace mode builds them for the staged version before activation; diff
+    mode rebuilds them in the transaction that applies the changes.
+    Discarding a version discards its aggregates too
+
+Differential ingest (DiffIngest):
+  - Every row carries a `row_hash` of the fields read from the PDF. The
+    delay columns depend on the current date, not on the upload, so they are
+    left out of the hash and refreshed for the whole version by
+    refresh_delay_columns (one UPDATE per distinct opening date)
+  - The live dataset's (id, row_hash) pairs are compared with the upload,
+    and only added / changed / vanished processes are written, in a single
+    transaction against the active version
+"""
+
+import csv
+import hashlib
+import io
+from datetime import date, datetime
+
+from sqlalchemy import insert, update, select, bindparam, func, literal
+from sqlalchemy.orm import Session
+
+from models import Process, ProcessStatsCube, ProcessSuggestion, User
+from process_pdf import compute_delay
+from process_search import SUGGEST_FIELDS, contribuinte_key, index_new_rows, search_document, tipo_key
+
+# Columns written for every record, in COPY order
+PROCESS_COLUMNS = [
+    "id", "user_id", "dataset_version", "contribuinte", "data_abertura",
+    "data_abertura_date", "month_year", "ano", "status", "setor_atual",
+    "tipo_solicitacao", "dias_atraso_pdf", "dias_atraso_calc", "is_atrasado",
+    "row_hash", "search_text", "contribuinte_key", "tipo_key", "created_at", "updated_at",
+]
+
+# Record fields covered by row_hash (what the PDF says; the delay columns are date-dependent)
+HASHED_FIELDS = [
+    "id", "contribuinte", "data_abertura", "ano", "status", "setor_atual",
+    "tipo_solicitacao", "dias_atraso_pdf",
+]
+
+# Rows per statement when deleting vanished processes by pk
+DELETE_CHUNK_SIZE = 500
+
+# Rows per round trip when backfilling derived columns of existing rows
+BACKFILL_CHUNK_SIZE = 5000
+
+
+def canonical_text(value) -> str:
+    """Strip and collapse internal whitespace ("Tipo  A " -> "Tipo A")."""
+    return " ".join(str(value).split()) if value is not None else ""
+
+
+def opening_date(data_abertura):
+    """Parse a dd/mm/yyyy opening date; None when missing or invalid."""
+    try:
+        return datetime.strptime(data_abertura, "%d/%m/%Y").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def month_of(day: date):
+    return day.strftime("%Y-%m") if day else None
+
+
+def record_hash(item: dict) -> str:
+    """Content hash of a parsed record, used to detect changed processes."""
+    payload = "\x1f".join(str(item[f]) for f in HASHED_FIELDS)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def process_row(item: dict, user_id: int, dataset_version: int = 0, now: datetime = None) -> dict:
+    """Map a parsed record (process_pdf) to a `processes` table row."""
+    now = now or datetime.utcnow()
+    opened = opening_date(item["data_abertura"])
+    row = {
+        "id": item["id"],
+        "user_id": user_id,
+        "dataset_version": dataset_version,
+        "contribuinte": item["contribuinte"],
+        "data_abertura": item["data_abertura"],
+        "data_abertura_date": opened,
+        "month_year": month_of(opened),
+        "ano": item["ano"],
+        "status": item["status"],
+        "setor_atual": item["setor_atual"],
+        "tipo_solicitacao": canonical_text(item["tipo_solicitacao"]),
+        "dias_atraso_pdf": item["dias_atraso_pdf"],
+        "dias_atraso_calc": item["dias_atraso_calc"],
+        "is_atrasado": item["is_atrasado"],
+        "created_at": now,
+        "updated_at": now,
+    }
+    row["row_hash"] = record_hash(row)
+    row["search_text"] = search_document(row["id"], row["contribuinte"], row["tipo_solicitacao"])
+    row["contribuinte_key"] = contribuinte_key(row["contribuinte"])
+    row["tipo_key"] = tipo_key(row["tipo_solicitacao"])
+    return row
+
+
+def next_dataset_version(db: Session, user_id: int) -> int:
+    """Allocate a dataset version above both the active one and any staged rows."""
+    active = db.query(User.active_dataset_version).filter(User.id == user_id).scalar() or 0
+    staged = db.query(func.max(Process.dataset_version)).filter(Process.user_id == user_id).scalar() or 0
+    return max(active, staged) + 1
+
+
+def activate_dataset_version(db: Session, user_id: int, version: int) -> None:
+    """Atomically make `version` the user's live dataset (commits)."""
+    db.query(User).filter(User.id == user_id).update(
+        {User.active_dataset_version: version, User.dataset_revision: _next_revision()},
+        synchronize_session=False,
+    )
+    db.commit()
+
+
+def _next_revision():
+    return func.coalesce(User.dataset_revision, 0) + 1
+
+
+def bump_dataset_revision(db: Session, user_id: int) -> None:
+    """Mark the user's live dataset as changed (no commit)."""
+    db.query(User).filter(User.id == user_id).update(
+        {User.dataset_revision: _next_revision()}, synchronize_session=False
+    )
+
+
+def discard_dataset_version(db: Session, user_id: int, version: int) -> int:
+    """Delete the rows staged under `version` (e.g. a cancelled upload) and commit."""
+    deleted = db.query(Process).filter(
+        Process.user_id == user_id, Process.dataset_version == version
+    ).delete(synchronize_session=False)
+    delete_dataset_aggregates(db, user_id, version=version)
+    db.commit()
+    return deleted
+
+
+def discard_inactive_versions(db: Session, user_id: int) -> int:
+    """Garbage-collect every row of the user that is not in the active dataset and commit."""
+    active = db.query(User.active_dataset_version).filter(User.id == user_id).scalar() or 0
+    deleted = db.query(Process).filter(
+        Process.user_id == user_id, Process.dataset_version != active
+    ).delete(synchronize_session=False)
+    delete_dataset_aggregates(db, user_id, keep_version=active)
+    db.commit()
+    return deleted
+
+
+# Tables aggregated from one (user_id, dataset_version) of processes
+AGGREGATE_TABLES = (ProcessStatsCube, ProcessSuggestion)
+
+
+def delete_dataset_aggregates(db: Session, user_id: int, version: int = None, keep_version: int = None) -> None:
+    """Delete the user's aggregates (of `version`, or of every version but `keep_version`, or all); no commit."""
+    for model in AGGREGATE_TABLES:
+        query = db.query(model).filter(model.user_id == user_id)
+        if version is not None:
+            query = query.filter(model.dataset_version == version)
+        if keep_version is not None:
+            query = query.filter(model.dataset_version != keep_version)
+        query.delete(synchronize_session=False)
+
+
+def build_dataset_aggregates(db: Session, user_id: int, version: int) -> None:
+    """(Re)build every aggregate of one dataset version (no commit)."""
+    delete_dataset_aggregates(db, user_id, version=version)
+    build_stats_cube(db, user_id, version)
+    build_suggestions(db, user_id, version)
+
+
+def build_stats_cube(db: Session, user_id: int, version: int) -> None:
+    """Build the stats cube of one dataset version (no commit; see build_dataset_aggregates)."""
+    dims = [Process.month_year, Process.status, Process.tipo_solicitacao, Process.is_atrasado]
+    counts = (
+        select(literal(user_id), literal(version), *dims, func.count(Process.pk))
+        .where(Process.user_id == user_id, Process.dataset_version == version)
+        .group_by(*dims)
+    )
+    db.execute(insert(ProcessStatsCube.__table__).from_select(
+        ["user_id", "dataset_version", "month_year", "status", "tipo_solicitacao", "is_atrasado", "count"],
+        counts,
+    ))
+
+
+def build_suggestions(db: Session, user_id: int, version: int) -> None:
+    """Build the autocomplete keys of one dataset version (no commit; see build_dataset_aggregates)."""
+    for field, (key_col, value_col, _) in SUGGEST_FIELDS.items():
+        counts = (
+            select(literal(user_id), literal(version), literal(field), key_col, func.min(value_col), func.count(Process.pk))
+            .where(Process.user_id == user_id, Process.dataset_version == version, key_col.isnot(None), key_col != "")
+            .group_by(key_col)
+        )
+        db.execute(insert(ProcessSuggestion.__table__).from_select(
+            ["user_id", "dataset_version", "field", "key", "value", "count"], counts
+        ))
+
+
+def refresh_delay_columns(db: Session, user_id: int, version: int) -> int:
+    """
+    Recompute is_atrasado / dias_atraso_calc of one dataset version as of
+    today (process_pdf.compute_delay), one UPDATE per distinct opening date
+    of the rows that can be delayed; no commit. Returns the rows changed.
+    """
+    table = Process.__table__
+    scope = (table.c.user_id == user_id, table.c.dataset_version == version)
+    days = db.execute(
+        select(table.c.data_abertura_date).distinct()
+        .where(*scope, table.c.status == "ANDAMENTO", table.c.data_abertura_date.isnot(None))
+    ).scalars().all()
+    params = []
+    for day in days:
+        late, delay = compute_delay("ANDAMENTO", datetime.combine(day, datetime.min.time()))
+        params.append({"b_date": day, "b_late": late, "b_delay": delay})
+    if not params:
+        return 0
+    result = db.execute(
+        update(table)
+        .where(
+            *scope, table.c.status == "ANDAMENTO", table.c.data_abertura_date == bindparam("b_date"),
+            (table.c.is_atrasado != bindparam("b_late")) | (table.c.dias_atraso_calc != bindparam("b_delay"))
+            | table.c.is_atrasado.is_(None) | table.c.dias_atraso_calc.is_(None),
+        )
+        .values(is_atrasado=bindparam("b_late"), dias_atraso_calc=bindparam("b_delay")),
+        params,
+    )
+    return max(result.rowcount, 0)
+
+
+def backfill_derived_columns(conn) -> int:
+    """
+    Fill data_abertura_date / month_year and canonicalize tipo_solicitacao for
+    rows written before those columns existed. Only rows without a date are
+    visited, in pk order and in chunks; returns the number of rows updated.
+    """
+    table = Process.__table__
+    stmt = (
+        update(table)
+        .where(table.c.pk == bindparam("b_pk"))
+        .values(
+            data_abertura_date=bindparam("b_date"),
+            month_year=bindparam("b_month"),
+            tipo_solicitacao=bindparam("b_tipo"),
+        )
+    )
+    updated = 0
+    last_pk = 0
+    while True:
+        rows = conn.execute(
+            select(table.c.pk, table.c.data_abertura, table.c.tipo_solicitacao)
+            .where(table.c.data_abertura_date.is_(None), table.c.pk > last_pk)
+            .order_by(table.c.pk)
+            .limit(BACKFILL_CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            return updated
+        last_pk = rows[-1].pk
+
+        params = []
+        for r in rows:
+            opened = opening_date(r.data_abertura)
+            tipo = canonical_text(r.tipo_solicitacao) if r.tipo_solicitacao is not None else None
+            # Rows without a valid date are visited again on every start; skip no-op writes
+            if opened is None and tipo == r.tipo_solicitacao:
+                continue
+            params.append({"b_pk": r.pk, "b_date": opened, "b_month": month_of(opened), "b_tipo": tipo})
+        if params:
+            conn.execute(stmt, params)
+            conn.commit()
+            updated += len(params)
+
+
+def backfill_search_columns(conn) -> int:
+    """
+    Fill search_text / contribuinte_key / tipo_key for rows written before
+    those columns existed (chunked by pk); returns the rows updated.
+    """
+    table = Process.__table__
+    stmt = update(table).where(table.c.pk == bindparam("b_pk")).values(
+        search_text=bindparam("b_text"),
+        contribuinte_key=bindparam("b_contribuinte"),
+        tipo_key=bindparam("b_tipo"),
+    )
+    missing = table.c.search_text.is_(None) | table.c.contribuinte_key.is_(None) | table.c.tipo_key.is_(None)
+    updated = 0
+    while True:
+        rows = conn.execute(
+            select(table.c.pk, table.c.id, table.c.contribuinte, table.c.tipo_solicitacao)
+            .where(missing)
+            .order_by(table.c.pk)
+            .limit(BACKFILL_CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            return updated
+        conn.execute(stmt, [{
+            "b_pk": r.pk,
+            "b_text": search_document(r.id, r.contribuinte, r.tipo_solicitacao),
+            "b_contribuinte": contribuinte_key(r.contribuinte),
+            "b_tipo": tipo_key(r.tipo_solicitacao),
+        } for r in rows])
+        conn.commit()
+        updated += len(rows)
+
+
+def bulk_insert_processes(db: Session, rows: list) -> None:
+    """Insert `rows` (see process_row) in the session's current transaction."""
+    if not rows:
+        return
+    if db.get_bind().dialect.name == "postgresql" and _copy_rows(db, rows):
+        return
+    db.execute(insert(Process.__table__), rows)
+    index_new_rows(db, rows)
+
+
+def _copy_rows(db: Session, rows: list) -> bool:
+    """COPY rows into PostgreSQL. Returns False if the driver has no COPY support."""
+    dbapi_conn = db.connection().connection.dbapi_connection
+    cursor = dbapi_conn.cursor()
+    if not hasattr(cursor, "copy_expert"):
+        cursor.close()
+        return False
+
+    buf = io.StringIO()
+    # QUOTE_NONNUMERIC quotes every string, so "" stays an empty string and
+    # only None (written unquoted and empty) becomes NULL in CSV COPY.
+    writer = csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC, lineterminator="\n")
+    for row in rows:
+        writer.writerow([
+            v.isoformat(sep=" ") if isinstance(v, datetime) else v
+            for v in (row[c] for c in PROCESS_COLUMNS)
+        ])
+    buf.seek(0)
+
+    try:
+        cursor.copy_expert(
+            f"COPY {Process.__tablename__} ({', '.join(PROCESS_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buf,
+        )
+    finally:
+        cursor.close()
+    return True
+
+
+# Columns rewritten for a changed process (the key and created_at are kept)
+_UPDATED_COLUMNS = [
+    c for c in PROCESS_COLUMNS if c not in ("id", "user_id", "dataset_version", "created_at")
+]
+
+
+class DiffIngest:
+    """
+    Upsert an upload into the user's active dataset instead of replacing it.
+
+    Existing rows are matched on the (user_id, dataset_version, id) unique
+    key (uix_process_user_id). Feed every parsed record to add(), then
+    call apply() once: it inserts new processes, updates changed ones and
+    deletes the ones missing from the upload in one transaction.
+    """
+
+    def __init__(self, db: Session, user_id: int):
+        self.db = db
+        self.user_id = user_id
+        self.version = db.query(User.active_dataset_version).filter(User.id == user_id).scalar() or 0
+        rows = db.query(Process.id, Process.pk, Process.row_hash).filter(
+            Process.user_id == user_id, Process.dataset_version == self.version
+        ).all()
+        self.existing = {r.id: (r.pk, r.row_hash) for r in rows}
+        self.seen = set()
+        self.added = {}
+        self.updated = {}
+        self.unchanged = 0
+
+    def add(self, item: dict) -> None:
+        proc_id = item["id"]
+        self.seen.add(proc_id)
+        previous = self.existing.get(proc_id)
+        row = process_row(item, self.user_id, self.version)
+        if previous is None:
+            self.added[proc_id] = row
+        elif previous[1] != row["row_hash"]:
+            # Bind names must differ from column names in UPDATE ... SET
+            params = {f"b_{c}": row[c] for c in _UPDATED_COLUMNS}
+            params["b_pk"] = previous[0]
+            self.updated[proc_id] = params
+        else:
+            self.unchanged += 1
+
+    def summary(self) -> dict:
+        return {
+            "added": len(self.added),
+            "updated": len(self.updated),
+            "removed": len(self.existing.keys() - self.seen),
+            "unchanged": self.unchanged,
+        }
+
+    def apply(self) -> dict:
+        """Write the differences and commit. Returns the change summary."""
+        db = self.db
+        removed = [pk for proc_id, (pk, _) in self.existing.items() if proc_id not in self.seen]
+        try:
+            if self.added:
+                bulk_insert_processes(db, list(self.added.values()))
+            if self.updated:
+                values = {c: bindparam(f"b_{c}") for c in _UPDATED_COLUMNS}
+                db.execute(
+                    update(Process.__table__).where(Process.__table__.c.pk == bindparam("b_pk")).values(values),
+                    list(self.updated.values()),
+                )
+            for start in range(0, len(removed), DELETE_CHUNK_SIZE):
+                db.query(Process).filter(
+                    Process.pk.in_(removed[start:start + DELETE_CHUNK_SIZE])
+                ).delete(synchronize_session=False)
+            # Unchanged rows keep the delay computed at their last upload
+            refreshed = refresh_delay_columns(db, self.user_id, self.version)
+            build_dataset_aggregates(db, self.user_id, self.version)
+            if self.added or self.updated or removed or refreshed:
+                bump_dataset_revision(db, self.user_id)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return self.summary()
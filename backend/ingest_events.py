@@ -0,0 +1,96 @@
+"""
+ingest_events.py
+In-process progress events of ingest jobs, for the /upload/events SSE stream.
+
+JobHandle (ingest_jobs.py) publishes every progress message here before its
+throttled write to the ingest_jobs table, so a stream served by the process
+that runs the job sees each message as soon as extraction_progress or the
+save loop emits it.
+
+Layout:
+  - Per job: a sequence counter, the job's merged state since it started and
+    a ring buffer of the last EVENT_BUFFER_SIZE events (seq, state)
+  - Event ids are "<job_id>:<seq>"; since(job_id, seq) returns the events a
+    client reconnecting with Last-Event-ID missed, or None when they already
+    fell out of the buffer (the client then gets a fresh snapshot)
+  - The last MAX_TRACKED_JOBS jobs are kept; jobs run by another process are
+    unknown here and /upload/events falls back to polling their row
+  - Job ids can be reused once old ingest_jobs rows are deleted: create_job
+    resets the id's buffer, and an event id ahead of the buffer (issued for
+    the earlier job) gets a fresh snapshot instead of a replay
+"""
+
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+
+EVENT_BUFFER_SIZE = 256
+MAX_TRACKED_JOBS = 200
+
+
+class _JobEvents:
+    __slots__ = ("seq", "state", "events")
+
+    def __init__(self):
+        self.seq = 0
+        self.state = {}
+        self.events = deque(maxlen=EVENT_BUFFER_SIZE)
+
+
+_jobs = OrderedDict()
+_lock = threading.Lock()
+
+
+def publish(job_id: int, fields: dict) -> int:
+    """Record a state change of `job_id`. Returns the event's sequence number."""
+    fields = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in fields.items()}
+    with _lock:
+        entry = _jobs.get(job_id)
+        if entry is None:
+            entry = _jobs[job_id] = _JobEvents()
+            while len(_jobs) > MAX_TRACKED_JOBS:
+                _jobs.popitem(last=False)
+        entry.seq += 1
+        entry.state.update(fields)
+        entry.events.append((entry.seq, dict(entry.state)))
+        return entry.seq
+
+
+def reset(job_id: int) -> None:
+    """Forget the events of `job_id` (the id now belongs to a new job)."""
+    with _lock:
+        _jobs.pop(job_id, None)
+
+
+def latest(job_id: int):
+    """(seq, state) of the job's last event, or None if the job is not tracked in this process."""
+    with _lock:
+        entry = _jobs.get(job_id)
+        if entry is None or not entry.seq:
+            return None
+        return entry.seq, dict(entry.state)
+
+
+def since(job_id: int, seq: int):
+    """Events of `job_id` after `seq`, or None if some of them are no longer buffered."""
+    with _lock:
+        entry = _jobs.get(job_id)
+        if entry is None:
+            return None
+        if seq > entry.seq:
+            # Issued for an earlier job with the same id
+            return None
+        if seq == entry.seq:
+            return []
+        if not entry.events or entry.events[0][0] > seq + 1:
+            return None
+        return [(s, state) for s, state in entry.events if s > seq]
+
+
+def parse_event_id(event_id):
+    """Split a "<job_id>:<seq>" event id; returns (None, 0) when it is missing or malformed."""
+    try:
+        job_id, seq = (event_id or "").split(":", 1)
+        return int(job_id), int(seq)
+    except ValueError:
+        return None, 0
@@ -0,0 +1,237 @@
+"""
+ingest_jobs.py
+Durable state of PDF ingest jobs (the `ingest_jobs` table).
+
+Upload status used to live in a module-level dict, so it was lost on restart
+and invisible to other uvicorn workers. Every upload now has an IngestJob row:
+  - The ingest worker writes to it through a JobHandle: short single-row
+    UPDATEs on their own connection, so progress is visible to every process
+    right away, independent of the ingest session's transactions
+  - /upload/status and /upload/cancel read the user's latest job; cancelling
+    sets `cancel_requested`, which the worker polls (throttled) between pages
+  - Jobs still queued/processing without any update for
+    INGEST_JOB_STALE_SECONDS, and no longer held by this process's
+    ingest_queue, belong to a process that died; they are reported (and
+    stored) as failed so the user can upload again. A worker only starts a
+    job whose row is still queued (JobHandle.start), so a job expired while
+    waiting is never run after the user was told to upload again
+  - Only the last INGEST_JOB_HISTORY finished jobs are kept per user
+  - Every change is also published to ingest_events (unthrottled), which
+    feeds the /upload/events stream
+"""
+
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from database import engine
+from models import IngestJob
+import ingest_events
+import ingest_queue
+
+logger = logging.getLogger(__name__)
+
+try:
+    INGEST_JOB_STALE_SECONDS = int(os.getenv("INGEST_JOB_STALE_SECONDS", "900"))
+except ValueError:
+    INGEST_JOB_STALE_SECONDS = 900
+
+INGEST_JOB_HISTORY = 10
+
+# Minimum interval between progress writes and cancel-flag reads of one job
+PROGRESS_MIN_INTERVAL = 0.25
+CANCEL_POLL_INTERVAL = 1.0
+
+ACTIVE_STATUSES = ("queued", "processing")
+
+
+def create_job(db: Session, user_id: int, mode: str = "replace", file_hash: Optional[str] = None) -> IngestJob:
+    """Register a new upload as a queued job (commits) and prune the user's old jobs."""
+    finished = db.query(IngestJob.id).filter(
+        IngestJob.user_id == user_id, IngestJob.status.notin_(ACTIVE_STATUSES)
+    ).order_by(IngestJob.id.desc()).offset(INGEST_JOB_HISTORY - 1).all()
+    if finished:
+        db.query(IngestJob).filter(IngestJob.id.in_([r.id for r in finished])).delete(synchronize_session=False)
+
+    now = datetime.utcnow()
+    job = IngestJob(
+        user_id=user_id, mode=mode, file_hash=file_hash, status="queued",
+        message="Enviando arquivo...", created_at=now, updated_at=now,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    # Ids of deleted jobs are reused (SQLite): drop the events of the previous owner
+    ingest_events.reset(job.id)
+    return job
+
+
+def latest_job(db: Session, user_id: int) -> Optional[IngestJob]:
+    """The user's most recent job, with abandoned jobs marked as failed."""
+    job = db.query(IngestJob).filter(IngestJob.user_id == user_id).order_by(IngestJob.id.desc()).first()
+    if (
+        job and job.status in ACTIVE_STATUSES
+        and job.updated_at < datetime.utcnow() - timedelta(seconds=INGEST_JOB_STALE_SECONDS)
+        # Waiting behind other uploads (or running) in this process: not abandoned
+        and ingest_queue.jobs.position(user_id) is None
+    ):
+        logger.warning(f"Ingest job {job.id} of user {user_id} stopped reporting progress; marking it as failed.")
+        job.status = "error"
+        job.error = "Interrompido"
+        job.message = "Processamento interrompido. Envie o arquivo novamente."
+        job.finished_at = datetime.utcnow()
+        db.commit()
+    return job
+
+
+def active_job(db: Session, user_id: int) -> Optional[IngestJob]:
+    job = latest_job(db, user_id)
+    return job if job and job.status in ACTIVE_STATUSES else None
+
+
+def request_cancel(db: Session, job: IngestJob) -> None:
+    job.cancel_requested = True
+    job.updated_at = datetime.utcnow()
+    db.commit()
+
+
+def mark_cancelled(db: Session, job: IngestJob) -> None:
+    """Finish a job that never started (removed from the queue)."""
+    now = datetime.utcnow()
+    job.status = "error"
+    job.message = "Upload cancelado pelo usuário."
+    job.error = "Cancelado"
+    job.cancel_requested = True
+    job.finished_at = now
+    job.updated_at = now
+    db.commit()
+
+
+def clear_jobs(db: Session, user_id: int) -> int:
+    """Delete the user's finished jobs, so their status goes back to idle (commits)."""
+    deleted = db.query(IngestJob).filter(
+        IngestJob.user_id == user_id, IngestJob.status.notin_(ACTIVE_STATUSES)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+def queue_position(db: Session, job: IngestJob) -> int:
+    """Approximate place of a queued job: queued jobs (of any user) created before it, plus one."""
+    return db.query(IngestJob).filter(
+        IngestJob.status == "queued", IngestJob.id < job.id
+    ).count() + 1
+
+
+def apply_event(state: dict, fields: dict) -> dict:
+    """Merge published job fields (ingest_events) into a job_status() dict."""
+    state = dict(state)
+    for key, value in fields.items():
+        if key == "status":
+            state["status"] = "processing" if value == "queued" else value
+            state["queue_position"] = 0 if value == "processing" else state.get("queue_position") if value == "queued" else None
+        elif key == "cancel_requested":
+            state["should_cancel"] = bool(value)
+        elif key in state or key == "changes":
+            state[key] = value
+    return state
+
+
+def job_status(job: Optional[IngestJob], queue_position: Optional[int] = None) -> dict:
+    """Serialize a job in the /upload/status shape (queued jobs report status "processing")."""
+    if job is None:
+        return {
+            "status": "idle", "message": "", "processed_count": 0, "error": None,
+            "should_cancel": False, "queue_position": None,
+        }
+    state = {
+        "job_id": job.id,
+        "status": "processing" if job.status == "queued" else job.status,
+        "message": job.message or "",
+        "processed_count": job.processed_count or 0,
+        "error": job.error,
+        "should_cancel": bool(job.cancel_requested),
+        "queue_position": queue_position if job.status == "queued" else (0 if job.status == "processing" else None),
+        "progress": job.progress or 0,
+        "pages_current": job.pages_current or 0,
+        "pages_total": job.pages_total or 0,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if job.changes is not None:
+        state["changes"] = job.changes
+    return state
+
+
+class JobHandle:
+    """Write-side API used by the ingest worker for one job."""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self._last_progress = 0.0
+        self._last_cancel_poll = 0.0
+        self._cancelled = False
+
+    def update(self, **fields) -> None:
+        """Set columns of the job row in a short transaction of its own."""
+        ingest_events.publish(self.job_id, fields)
+        self._write(fields)
+
+    def _write(self, fields: dict) -> None:
+        fields = dict(fields, updated_at=datetime.utcnow())
+        try:
+            with engine.begin() as conn:
+                conn.execute(update(IngestJob.__table__).where(IngestJob.__table__.c.id == self.job_id).values(**fields))
+        except Exception as e:
+            logger.warning(f"Failed to update ingest job {self.job_id}: {e}")
+
+    def progress(self, message: str, force: bool = False, **fields) -> None:
+        """Publish a progress message; the row is written at most every PROGRESS_MIN_INTERVAL."""
+        fields["message"] = message
+        ingest_events.publish(self.job_id, fields)
+        now = time.monotonic()
+        if not force and now - self._last_progress < PROGRESS_MIN_INTERVAL:
+            return
+        self._last_progress = now
+        self._write(fields)
+
+    def start(self) -> bool:
+        """Move the job from queued to processing; False if it is no longer queued (expired or cancelled)."""
+        fields = {"status": "processing", "message": "Processando arquivo PDF...", "error": None, "started_at": datetime.utcnow()}
+        table = IngestJob.__table__
+        try:
+            with engine.begin() as conn:
+                claimed = conn.execute(
+                    update(table).where(table.c.id == self.job_id, table.c.status == "queued")
+                    .values(updated_at=datetime.utcnow(), **fields)
+                ).rowcount == 1
+        except Exception as e:
+            logger.warning(f"Failed to start ingest job {self.job_id}: {e}")
+            return False
+        if claimed:
+            ingest_events.publish(self.job_id, fields)
+        return claimed
+
+    def finish(self, status: str, message: str, **fields) -> None:
+        self.update(status=status, message=message, finished_at=datetime.utcnow(), **fields)
+
+    def cancel_requested(self) -> bool:
+        """True once /upload/cancel flagged the job; the row is re-read at most every CANCEL_POLL_INTERVAL."""
+        if self._cancelled:
+            return True
+        now = time.monotonic()
+        if now - self._last_cancel_poll >= CANCEL_POLL_INTERVAL:
+            self._last_cancel_poll = now
+            try:
+                with engine.connect() as conn:
+                    self._cancelled = bool(conn.execute(
+                        select(IngestJob.cancel_requested).where(IngestJob.id == self.job_id)
+                    ).scalar())
+            except Exception as e:
+                logger.warning(f"Failed to read cancel flag of ingest job {self.job_id}: {e}")
+        return self._cancelled
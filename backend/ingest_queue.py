@@ -0,0 +1,162 @@
+"""
+ingest_queue.py
+Bounded, fair executor for PDF ingest jobs.
+
+FastAPI's BackgroundTasks start every upload immediately, so a burst of
+uploads parses and writes all of them at once. Uploads go through this
+queue instead:
+  - At most INGEST_MAX_CONCURRENCY jobs run at the same time (worker threads)
+  - Jobs are queued FIFO per user and dispatched round-robin across users,
+    so one user with many uploads cannot starve the others; a user's next
+    job only starts once their running one has finished, so one user never
+    holds more than one worker
+  - position(user_id) reports where the user's next job stands in the
+    dispatch order, for /upload/status
+  - PDF parsing itself is CPU-bound and holds the GIL; it runs in a single
+    shared process pool (parse_executor), so the total number of parser
+    processes stays at PDF_PARSE_WORKERS however many jobs are running
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from process_pdf import resolve_workers
+
+logger = logging.getLogger(__name__)
+
+try:
+    INGEST_MAX_CONCURRENCY = max(1, int(os.getenv("INGEST_MAX_CONCURRENCY", "2")))
+except ValueError:
+    INGEST_MAX_CONCURRENCY = 2
+
+
+class _Job:
+    __slots__ = ("user_id", "fn", "args", "on_discard")
+
+    def __init__(self, user_id, fn, args, on_discard):
+        self.user_id = user_id
+        self.fn = fn
+        self.args = args
+        self.on_discard = on_discard
+
+
+class FairJobQueue:
+    """Round-robin over per-user FIFO queues, drained by `concurrency` threads."""
+
+    def __init__(self, concurrency: int = INGEST_MAX_CONCURRENCY, name: str = "ingest"):
+        self.concurrency = concurrency
+        self.name = name
+        self._queues = OrderedDict()  # user_id -> deque of _Job, in dispatch order
+        self._running = {}            # user_id -> number of running jobs
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def submit(self, user_id, fn, *args, on_discard=None) -> int:
+        """Queue fn(*args) for `user_id`. Returns the job's position (0 = starts now)."""
+        with self._cond:
+            self._queues.setdefault(user_id, deque()).append(_Job(user_id, fn, args, on_discard))
+            self._start_workers()
+            self._cond.notify()
+            return self._position(user_id)
+
+    def position(self, user_id):
+        """0 if the user has a running job, 1.. for the place of its next queued job, else None."""
+        with self._cond:
+            return self._position(user_id)
+
+    def discard(self, user_id) -> int:
+        """Drop the user's queued (not yet running) jobs, calling their on_discard callbacks."""
+        with self._cond:
+            jobs = self._queues.pop(user_id, None) or ()
+        for job in jobs:
+            if job.on_discard:
+                try:
+                    job.on_discard()
+                except Exception as e:
+                    logger.warning(f"on_discard failed for queued job of user {user_id}: {e}")
+        return len(jobs)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "running": sum(self._running.values()),
+                "queued": sum(len(q) for q in self._queues.values()),
+                "concurrency": self.concurrency,
+            }
+
+    def _position(self, user_id):
+        if self._running.get(user_id):
+            return 0
+        if user_id not in self._queues:
+            return None
+        # Replay the round-robin dispatch over a copy of the queue lengths
+        # (users with a running job are skipped until it finishes)
+        free = self.concurrency - sum(self._running.values())
+        pending = OrderedDict((uid, len(q)) for uid, q in self._queues.items() if not self._running.get(uid))
+        place = 0
+        while pending:
+            uid, left = pending.popitem(last=False)
+            place += 1
+            if uid == user_id:
+                return max(0, place - free)
+            if left > 1:
+                pending[uid] = left - 1
+        return None
+
+    def _ready_user(self):
+        """First user in dispatch order without a running job, or None."""
+        return next((uid for uid in self._queues if not self._running.get(uid)), None)
+
+    def _next_job(self):
+        user_id = self._ready_user()
+        jobs = self._queues[user_id]
+        job = jobs.popleft()
+        if jobs:
+            self._queues.move_to_end(user_id)
+        else:
+            del self._queues[user_id]
+        return job
+
+    def _start_workers(self):
+        while len(self._threads) < self.concurrency:
+            t = threading.Thread(target=self._work, name=f"{self.name}-worker-{len(self._threads)}", daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while self._ready_user() is None:
+                    self._cond.wait()
+                job = self._next_job()
+                self._running[job.user_id] = self._running.get(job.user_id, 0) + 1
+            try:
+                job.fn(*job.args)
+            except Exception:
+                logger.exception(f"{self.name.capitalize()} job for user {job.user_id} failed")
+            finally:
+                with self._cond:
+                    self._running[job.user_id] -= 1
+                    if not self._running[job.user_id]:
+                        del self._running[job.user_id]
+                    # The user's next queued job may start now
+                    self._cond.notify()
+
+
+jobs = FairJobQueue()
+
+_parse_executor = None
+_parse_executor_lock = threading.Lock()
+
+
+def parse_executor() -> ProcessPoolExecutor:
+    """Shared process pool for PDF parsing, created on first use."""
+    global _parse_executor
+    with _parse_executor_lock:
+        # A crashed worker breaks the whole pool; replace it instead of failing every later job
+        if _parse_executor is None or getattr(_parse_executor, "_broken", False):
+            _parse_executor = ProcessPoolExecutor(max_workers=resolve_workers())
+        return _parse_executor
@@ -1,21 +1,36 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Depends, Request
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import uvicorn
-import shutil
+import hashlib
 import os
-import io
 import pandas as pd
-from typing import List, Optional, Dict, Any
+from typing import Optional
 from pydantic import BaseModel
-from process_pdf import parse_pdf
+from process_pdf import iter_parse_pdf
+import parse_cache
+import ingest
+import ingest_queue
+import ingest_jobs
+import ingest_events
+import process_query
+import process_stats
+import process_search
+import process_export
+import export_jobs
+import frame_cache
+import process_frame
+import response_cache
 import tempfile
 import logging
 import traceback
 import json
 import time
+import queue
+import threading
+import asyncio
 from datetime import datetime, timedelta
 
 # Load .env from backend/ directory
@@ -196,6 +211,165 @@ try:
 except Exception:
     pass
 
+# Migrate: versioned datasets (processes.dataset_version + users.active_dataset_version)
+try:
+    from sqlalchemy import text as sa_text
+    with engine.connect() as conn:
+        conn.execute(sa_text("ALTER TABLE users ADD COLUMN active_dataset_version INTEGER DEFAULT 0"))
+        conn.execute(sa_text("UPDATE users SET active_dataset_version = 0 WHERE active_dataset_version IS NULL"))
+        conn.commit()
+except Exception:
+    pass
+
+try:
+    from sqlalchemy import text as sa_text
+    with engine.connect() as conn:
+        conn.execute(sa_text("ALTER TABLE users ADD COLUMN dataset_revision INTEGER DEFAULT 0"))
+        conn.execute(sa_text("UPDATE users SET dataset_revision = 0 WHERE dataset_revision IS NULL"))
+        conn.commit()
+except Exception:
+    pass
+
+try:
+    from sqlalchemy import text as sa_text
+    with engine.connect() as conn:
+        conn.execute(sa_text("ALTER TABLE processes ADD COLUMN dataset_version INTEGER NOT NULL DEFAULT 0"))
+        conn.commit()
+except Exception:
+    pass
+
+try:
+    from sqlalchemy import text as sa_text
+    with engine.connect() as conn:
+        conn.execute(sa_text("ALTER TABLE processes ADD COLUMN row_hash VARCHAR"))
+        conn.commit()
+except Exception:
+    pass
+
+# Migrate: widen the (user_id, id) unique key to (user_id, dataset_version, id) so an
+# upload can stage its rows next to the live dataset
+try:
+    from sqlalchemy import text as sa_text
+    from models import Process
+    with engine.connect() as conn:
+        if engine.dialect.name == "postgresql":
+            cols = conn.execute(sa_text("""
+                SELECT a.attname FROM pg_constraint c
+                JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+                WHERE c.conname = 'uix_process_user_id'
+            """)).fetchall()
+            if cols and "dataset_version" not in [c[0] for c in cols]:
+                conn.execute(sa_text("ALTER TABLE processes DROP CONSTRAINT uix_process_user_id"))
+                conn.execute(sa_text("ALTER TABLE processes ADD CONSTRAINT uix_process_user_id UNIQUE (user_id, dataset_version, id)"))
+                conn.commit()
+        elif engine.dialect.name == "sqlite":
+            unique_keys = []
+            for idx in conn.execute(sa_text("PRAGMA index_list(processes)")).fetchall():
+                if idx[2]:  # unique
+                    unique_keys.append([c[2] for c in conn.execute(sa_text(f"PRAGMA index_info('{idx[1]}')")).fetchall()])
+            if ["user_id", "id"] in unique_keys:
+                # SQLite cannot alter constraints: rebuild the table from the current model
+                old_cols = [c[1] for c in conn.execute(sa_text("PRAGMA table_info(processes)")).fetchall()]
+                conn.execute(sa_text("ALTER TABLE processes RENAME TO processes_old"))
+                for (name,) in conn.execute(sa_text(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'processes_old' AND sql IS NOT NULL"
+                )).fetchall():
+                    conn.execute(sa_text(f'DROP INDEX "{name}"'))
+                Process.__table__.create(conn)
+                common = ", ".join(c.name for c in Process.__table__.columns if c.name in old_cols)
+                conn.execute(sa_text(f"INSERT INTO processes ({common}) SELECT {common} FROM processes_old"))
+                conn.execute(sa_text("DROP TABLE processes_old"))
+                conn.commit()
+except Exception as e:
+    logger.error(f"Failed to migrate processes unique key: {e}")
+
+# Migrate: typed opening date (processes.data_abertura_date + month_year) computed at ingest
+try:
+    from sqlalchemy import text as sa_text
+    with engine.connect() as conn:
+        conn.execute(sa_text("ALTER TABLE processes ADD COLUMN data_abertura_date DATE"))
+        conn.commit()
+except Exception:
+    pass
+
+try:
+    from sqlalchemy import text as sa_text
+    with engine.connect() as conn:
+        conn.execute(sa_text("ALTER TABLE processes ADD COLUMN month_year VARCHAR"))
+        conn.commit()
+except Exception:
+    pass
+
+# Backfill the derived columns (and canonical tipo_solicitacao) of rows ingested before them
+try:
+    import ingest
+    with engine.connect() as conn:
+        backfilled = ingest.backfill_derived_columns(conn)
+        if backfilled:
+            logger.info(f"Backfilled opening dates of {backfilled} processes.")
+except Exception as e:
+    logger.error(f"Failed to backfill processes.data_abertura_date: {e}")
+
+# Migrate: full-text search (processes.search_text + FTS5 / pg_trgm index, see process_search.py)
+try:
+    from sqlalchemy import text as sa_text
+    with engine.connect() as conn:
+        conn.execute(sa_text("ALTER TABLE processes ADD COLUMN search_text TEXT"))
+        conn.commit()
+except Exception:
+    pass
+
+# Migrate: autocomplete keys (bytewise collation on PostgreSQL so prefix ranges are exact)
+try:
+    from sqlalchemy import text as sa_text
+    collate = ' COLLATE "C"' if engine.dialect.name == "postgresql" else ""
+    with engine.connect() as conn:
+        conn.execute(sa_text(f"ALTER TABLE processes ADD COLUMN contribuinte_key VARCHAR{collate}"))
+        conn.commit()
+except Exception:
+    pass
+
+try:
+    from sqlalchemy import text as sa_text
+    collate = ' COLLATE "C"' if engine.dialect.name == "postgresql" else ""
+    with engine.connect() as conn:
+        conn.execute(sa_text(f"ALTER TABLE processes ADD COLUMN tipo_key VARCHAR{collate}"))
+        conn.commit()
+except Exception:
+    pass
+
+try:
+    import process_search
+    with engine.connect() as conn:
+        backfilled = ingest.backfill_search_columns(conn)
+        if backfilled:
+            logger.info(f"Backfilled search text of {backfilled} processes.")
+        process_search.ensure_search_index(conn)
+except Exception as e:
+    logger.error(f"Failed to set up the process search index: {e}")
+
+# Migrate: per-user composite indexes (the columns they cover only exist through the migrations above)
+try:
+    from sqlalchemy import text as sa_text
+    from models import Process
+    with engine.connect() as conn:
+        for index in Process.__table__.indexes:
+            index.create(conn, checkfirst=True)
+        # Superseded by ix_processes_user_date
+        conn.execute(sa_text("DROP INDEX IF EXISTS ix_processes_data_abertura_date"))
+        conn.commit()
+except Exception as e:
+    logger.error(f"Failed to create processes composite indexes: {e}")
+
+# Migrate: dataset revision an export job was submitted for (see export_jobs.py)
+try:
+    from sqlalchemy import text as sa_text
+    with engine.connect() as conn:
+        conn.execute(sa_text("ALTER TABLE export_jobs ADD COLUMN dataset_revision INTEGER DEFAULT 0"))
+        conn.commit()
+except Exception:
+    pass
+
 @app.get("/health")
 def health_check():
     return {"status": "ok", "version": "1.0.0"}
@@ -206,10 +380,14 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     """
     Validate JWT token and return current user.
     """
+    return user_from_token(token, db)
+
+def user_from_token(token: str, db: Session, scope: Optional[str] = None):
+    """User of a JWT; `scope` is the single-purpose scope it must carry (None: a regular access token)."""
     try:
         payload = auth.decode_access_token(token)
-        if payload is None:
-            logger.warning("Token validation failed: decode_access_token returned None")
+        if payload is None or payload.get("scope") != scope:
+            logger.warning("Token validation failed: invalid token or wrong scope")
             raise HTTPException(
                 status_code=401,
                 detail="Could not validate credentials",
@@ -252,6 +430,39 @@ def require_view_permission(user: User, perm_attr: str, detail: str):
     if not bool(getattr(user, perm_attr, True)):
         raise HTTPException(status_code=403, detail=detail)
 
+def user_processes_query(db: Session, user: User):
+    """Query the user's live dataset (rows staged by an upload in progress are excluded)."""
+    from models import Process
+    return db.query(Process).filter(
+        Process.user_id == user.id,
+        Process.dataset_version == (user.active_dataset_version or 0),
+    )
+
+def user_processes_frame(db: Session, user: User) -> pd.DataFrame:
+    """
+    The user's live dataset as a typed DataFrame (categoricals, opening date in
+    'dt'; see process_frame.py), served from frame_cache until the dataset
+    changes. Shared: do not modify in place.
+    """
+    def load():
+        # tipo_solicitacao is stored canonicalized and the opening date typed (see ingest.py)
+        return process_frame.load_processes(user_processes_query(db, user), db.bind)
+    return frame_cache.frames.get(user.id, user.dataset_revision or 0, load)
+
+def process_filters(
+    search: Optional[str] = None,
+    type_filter: Optional[str] = None,
+    status_filter: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    only_delayed: bool = False,
+) -> process_query.FilterSpec:
+    """The process filters of the query string, parsed once per request (400 if invalid)."""
+    try:
+        return process_query.FilterSpec(search, type_filter, status_filter, start_date, end_date, only_delayed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.get("/me")
 def get_me(user: User = Depends(get_current_user)):
     return {
@@ -372,129 +583,240 @@ def change_password(data: PasswordChange, current_user: User = Depends(get_curre
     
     return {"message": "Senha alterada com sucesso."}
 
-# In-memory DB fallback for legacy code (will be removed later)
-# DB: Dict[str, List[Dict[str, Any]]] = {}
-
-
 # Legacy startup/shutdown removed
 # Data persistence is now handled by SQL/SQLite
 
-# Global Upload State - Per User?
-# For simplicity, we keep it global but we could make it per-user too.
-# If multiple users upload simultaneously, this might be race-y for status updates.
-# refactoring to Dict[user_id, status]
-UPLOAD_STATE: Dict[str, Dict[str, Any]] = {}
-
-def get_user_upload_state(user_id: str):
-    return UPLOAD_STATE.setdefault(user_id, {
-        "status": "idle",
-        "message": "",
-        "processed_count": 0,
-        "error": None
-    })
-
-def process_pdf_background(tmp_path: str, user_id: int):
-    """Background task to process PDF without blocking."""
-    global UPLOAD_STATE
-    
+# Upload status lives in the ingest_jobs table (see ingest_jobs.py)
+
+# Records buffered between the PDF extraction thread and the DB writer
+INGEST_QUEUE_SIZE = 2000
+
+def process_pdf_background(job_id: int, tmp_path: str, user_id: int, file_hash: Optional[str] = None, mode: str = "replace"):
+    """Ingest job (run by ingest_queue) that processes a PDF without blocking requests.
+
+    Extraction runs in a producer thread (iter_parse_pdf) feeding a bounded
+    queue, so batches are written to the DB while later pages are still
+    being parsed. Parsing happens in the shared ingest_queue process pool.
+    When `file_hash` is found in parse_cache the records come from the cache
+    and pdfplumber is skipped.
+
+    mode="replace": rows are staged under a new dataset version and only
+    become visible when the whole upload has been saved (see ingest.py), so
+    readers never see a half-ingested dataset and a cancel only discards the
+    staged rows.
+    mode="diff": only added / changed / vanished processes are written to the
+    live dataset, in one transaction at the end (ingest.DiffIngest).
+
+    Status, progress and the cancel flag go through the job's row in
+    ingest_jobs (ingest_jobs.JobHandle).
+    """
     logger.info(f"Starting background processing for {tmp_path} (User: {user_id})")
     
     # We need to manually create a session here since we are in a background thread
     from database import SessionLocal
     db = SessionLocal()
     
-    user_state = get_user_upload_state(str(user_id))
-    user_state["status"] = "processing"
-    user_state["message"] = "Processando arquivo PDF..."
-    user_state["error"] = None
-    
-    try:
-        def extraction_progress(current, total):
-            # Scale extraction progress from 0% to 20% (leaving 80% for saving)
-            # Frontend uses: 10 + Math.round(pct * 0.85)
-            # If we send (20%), Frontend sees 10 + 17 = 27%
-            pct = int((current / total) * 20)
-            user_state["message"] = f"Extraindo dados... Página {current}/{total} ({pct}%)"
+    job = ingest_jobs.JobHandle(job_id)
+
+    BATCH_SIZE = 1000
+    records: queue.Queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+    end_of_stream = object()
+    stop_producer = threading.Event()
+    pages = {"current": 0, "total": 0, "cached": None}  # "cached": parse_cache.CacheReader on a hit
+    saved = 0
+
+    def report_progress(force=False):
+        # Frontend uses: 10 + Math.round(pct * 0.85), parsed from "(NN%)"
+        if pages["cached"]:
+            pct = int(pages["cached"].progress() * 100)
+            message = f"Arquivo já processado, salvando registros... {saved} ({pct}%)"
+        else:
+            pct = int((pages["current"] / pages["total"]) * 100) if pages["total"] else 0
+            message = (
+                f"Extraindo dados... Página {pages['current']}/{pages['total']} "
+                f"- {saved} registros salvos ({pct}%)"
+            )
+        job.progress(
+            message, force=force, progress=pct, processed_count=saved,
+            pages_current=pages["current"], pages_total=pages["total"],
+        )
 
-        user_state["message"] = "Extraindo dados do PDF... (0%)"
+    def extraction_progress(current, total):
+        pages["current"] = current
+        pages["total"] = total
+        report_progress()
 
-        def should_cancel():
-            return user_state.get("should_cancel", False)
+    def should_cancel():
+        return stop_producer.is_set() or job.cancel_requested()
 
-        data = parse_pdf(tmp_path, progress_callback=extraction_progress, cancel_check=should_cancel)
+    def put(item):
+        # Never block forever on a full queue if the writer has given up
+        while not stop_producer.is_set():
+            try:
+                records.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            cached = parse_cache.load(file_hash)
+            if cached is not None:
+                logger.info(f"Parse cache hit for {file_hash}, skipping extraction.")
+                pages["cached"] = cached
+                try:
+                    for chunk in cached:
+                        if not all(put(item) for item in chunk):
+                            break
+                finally:
+                    cached.close()
+                return
 
-        total = len(data)
-        if total == 0:
-            user_state["status"] = "completed"
-            user_state["processed_count"] = 0
-            user_state["message"] = "Nenhum registro encontrado no PDF."
-            return
+            items = iter_parse_pdf(
+                tmp_path, progress_callback=extraction_progress, cancel_check=should_cancel,
+                executor=ingest_queue.parse_executor(),
+            )
+            cache = parse_cache.CacheWriter(file_hash)
+            try:
+                for item in items:
+                    cache.add(item)
+                    if not put(item):
+                        break
+                else:
+                    # Only complete extractions are worth caching
+                    if not should_cancel():
+                        cache.commit()
+            finally:
+                cache.abort()
+        except Exception as e:
+            put(e)
+        finally:
+            put(end_of_stream)
+
+    def cancel():
+        logger.info(f"Upload cancelled by user {user_id}. Discarding staged dataset version {dataset_version}.")
+        db.rollback()
+        if dataset_version is not None:
+            ingest.discard_dataset_version(db, user_id, dataset_version)
+        job.finish("error", "Upload cancelado pelo usuário.", error="Cancelado")
 
-        from models import Process
-        from datetime import datetime
+    dataset_version = None
+    diff = None
+    producer = threading.Thread(target=produce, name=f"pdf-extract-{user_id}", daemon=True)
 
-        BATCH_SIZE = 500
-        
-        # Check cancel BEFORE deleting old records (prevents data loss)
-        if user_state.get("should_cancel"):
-            logger.info(f"Upload cancelled by user {user_id} after extraction.")
-            user_state["status"] = "error"
-            user_state["message"] = "Upload cancelado pelo usuário."
-            user_state["error"] = "Cancelado"
+    try:
+        # Cancelled while still waiting in another worker's queue
+        if job.cancel_requested():
+            cancel()
+            return
+        if not job.start():
+            logger.warning(f"Ingest job {job_id} of user {user_id} is no longer queued; not starting it.")
             return
 
-        # Limpar todos os registros antigos do usuário antes de inserir os novos (Auto-Replace)
-        user_state["message"] = "Limpando registros antigos..."
-        db.query(Process).filter(Process.user_id == user_id).delete()
-        db.commit()
-        
-        for i, item in enumerate(data):
-            if user_state.get("should_cancel"):
-                logger.info(f"Upload cancelled by user {user_id}. Rolling back DB.")
-                db.query(Process).filter(Process.user_id == user_id).delete()
-                db.commit()
-                user_state["status"] = "error"
-                user_state["message"] = "Upload cancelado pelo usuário."
-                user_state["error"] = "Cancelado"
+        # Leftovers of crashed uploads must not collide with the new version
+        ingest.discard_inactive_versions(db, user_id)
+        if mode == "diff":
+            diff = ingest.DiffIngest(db, user_id)
+        else:
+            dataset_version = ingest.next_dataset_version(db, user_id)
+
+        job.progress("Extraindo dados do PDF... (0%)", force=True)
+        producer.start()
+
+        batch = []
+        while True:
+            if job.cancel_requested():
+                cancel()
                 return
 
-            new_process = Process(
-                id=item['id'],
-                user_id=user_id,
-                contribuinte=item['contribuinte'],
-                data_abertura=item['data_abertura'],
-                ano=item['ano'],
-                status=item['status'],
-                setor_atual=item['setor_atual'],
-                tipo_solicitacao=item['tipo_solicitacao'],
-                dias_atraso_pdf=item['dias_atraso_pdf'],
-                dias_atraso_calc=item['dias_atraso_calc'],
-                is_atrasado=item['is_atrasado']
+            try:
+                item = records.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if isinstance(item, Exception):
+                raise item
+
+            if diff is not None:
+                if item is end_of_stream:
+                    break
+                diff.add(item)
+                saved += 1
+                if saved % BATCH_SIZE == 0:
+                    report_progress()
+                continue
+
+            if item is not end_of_stream:
+                batch.append(ingest.process_row(item, user_id, dataset_version))
+
+            # Commit in batches and update progress (staged rows stay invisible to readers)
+            if batch and (len(batch) >= BATCH_SIZE or item is end_of_stream):
+                ingest.bulk_insert_processes(db, batch)
+                db.commit()
+                saved += len(batch)
+                batch = []
+                report_progress()
+
+            if item is end_of_stream:
+                break
+
+        # Extraction may have stopped early because of a cancel request
+        if job.cancel_requested():
+            cancel()
+            return
+
+        if saved == 0:
+            job.finish("completed", "Nenhum registro encontrado no PDF.", processed_count=0, progress=100)
+            return
+
+        if diff is not None:
+            job.progress("Aplicando alterações...", force=True, processed_count=saved)
+            changes = diff.apply()
+            if changes["added"] or changes["updated"] or changes["removed"]:
+                frame_cache.frames.invalidate(user_id)
+            job.finish(
+                "completed",
+                f"Sucesso! {saved} registros extraídos ({changes['added']} novos, "
+                f"{changes['updated']} alterados, {changes['removed']} removidos).",
+                processed_count=saved, progress=100, changes=changes,
             )
-            db.add(new_process)
+            logger.info(f"Background diff processing completed for {user_id}: {changes}")
+            return
 
-            # Commit in batches and update progress
-            if (i + 1) % BATCH_SIZE == 0 or (i + 1) == total:
-                db.commit()
-                # Scale saving progress from 20% to 100%
-                pct = int(20 + ((i + 1) / total) * 80)
-                user_state["message"] = f"Salvando registros... {i + 1}/{total} ({pct}%)"
-                user_state["processed_count"] = i + 1
-
-        user_state["status"] = "completed"
-        user_state["processed_count"] = total
-        user_state["message"] = f"Sucesso! {total} registros extraídos."
-        logger.info(f"Background processing completed for {user_id}. Extracted {total} records.")
+        # Auto-Replace: switch the user to the new dataset (and its aggregates) in one short transaction
+        ingest.build_dataset_aggregates(db, user_id, dataset_version)
+        ingest.activate_dataset_version(db, user_id, dataset_version)
+        frame_cache.frames.invalidate(user_id)
+
+        job.finish("completed", f"Sucesso! {saved} registros extraídos.", processed_count=saved, progress=100)
+        logger.info(f"Background processing completed for {user_id}. Extracted {saved} records.")
+
+        # Readers already see the new dataset; drop the previous one afterwards
+        try:
+            removed = ingest.discard_inactive_versions(db, user_id)
+            logger.info(f"Removed {removed} rows of previous datasets for user {user_id}.")
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Failed to remove previous datasets for user {user_id}: {e}")
         
     except Exception as e:
         logger.error(f"Error in background processing: {e}")
         logger.error(traceback.format_exc())
-        user_state["status"] = "error"
-        user_state["error"] = str(e)
-        user_state["message"] = "Erro ao processar arquivo."
+        db.rollback()
+        if dataset_version is not None:
+            try:
+                ingest.discard_dataset_version(db, user_id, dataset_version)
+            except Exception:
+                db.rollback()
+        job.finish("error", "Erro ao processar arquivo.", error=str(e))
         
     finally:
+        stop_producer.set()
+        if producer.is_alive():
+            producer.join(timeout=5)
         db.close()
+        # Cached /stats and /processes responses of the user are stale once the job ends
+        response_cache.responses.invalidate(user_id)
         # Clean up temp file
         if os.path.exists(tmp_path):
             try:
@@ -512,225 +834,251 @@ async def health_check():
     }
 
 @app.get("/upload/status")
-def get_upload_status(user: User = Depends(get_current_user)):
+def get_upload_status(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get the current status of the PDF processing for the authenticated user."""
     require_view_permission(user, "can_view_processes", "Permissão negada.")
-    state = get_user_upload_state(str(user.id))
+    _, state = upload_state(db, user.id)
     logger.info(f"Checking status for user {user.id}: {state['status']} ({state['processed_count']} processed)")
     return state
 
+def upload_state(db: Session, user_id: int):
+    """The user's latest ingest job and its /upload/status payload."""
+    job = ingest_jobs.latest_job(db, user_id)
+    position = None
+    if job and job.status == "queued":
+        # This process' queue knows the exact place; jobs queued by another worker get an estimate
+        position = ingest_queue.jobs.position(user_id) or ingest_jobs.queue_position(db, job)
+    state = ingest_jobs.job_status(job, position)
+    if position:
+        state["message"] = f"Na fila de processamento (posição {position})..."
+    return job, state
+
+SSE_HEARTBEAT_SECONDS = 15
+SSE_POLL_INTERVAL = 0.25     # in-process event buffer (ingest_events)
+SSE_DB_POLL_INTERVAL = 1.0   # jobs that run in another worker process
+
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+def get_current_user_sse(request: Request, token: Optional[str] = Depends(oauth2_scheme_optional), db: Session = Depends(get_db)):
+    """
+    get_current_user that also accepts ?stream_token=, since EventSource cannot
+    send headers. Query strings end up in proxy and access logs, so only a
+    short-lived token scoped to this stream (POST /upload/events/token) is
+    accepted there, never the bearer access token.
+    """
+    if token:
+        return user_from_token(token, db)
+    stream_token = request.query_params.get("stream_token")
+    if not stream_token:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return user_from_token(stream_token, db, scope=auth.EVENTS_TOKEN_SCOPE)
+
+@app.post("/upload/events/token")
+def upload_events_token(user: User = Depends(get_current_user)):
+    """Short-lived token for the ?stream_token= of /upload/events."""
+    require_view_permission(user, "can_view_processes", "Permissão negada.")
+    return {"stream_token": auth.create_events_token(getattr(user, "username", None) or user.email), "expires_in": auth.EVENTS_TOKEN_EXPIRE_MINUTES * 60}
+
+def sse_event(state: dict, event_id: Optional[str] = None) -> str:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: status\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
+
+@app.get("/upload/events")
+async def upload_events(request: Request, user: User = Depends(get_current_user_sse), db: Session = Depends(get_db)):
+    """Server-Sent Events stream of the upload progress (same payload as /upload/status).
+
+    Authentication and the initial snapshot happen once; afterwards messages
+    are pushed as the ingest worker publishes them (ingest_events), with a
+    heartbeat comment every SSE_HEARTBEAT_SECONDS. Event ids are
+    "<job_id>:<seq>": a client reconnecting with Last-Event-ID receives the
+    events it missed. The stream ends once the job has finished.
+    """
+    require_view_permission(user, "can_view_processes", "Permissão negada.")
+    user_id = user.id
+    job, snapshot = upload_state(db, user_id)
+    job_id = job.id if job else None
+    last_job_id, last_seq = ingest_events.parse_event_id(request.headers.get("last-event-id"))
+    # The stream can stay open for minutes: don't keep a pooled connection checked out
+    db.close()
+
+    def poll_db():
+        from database import SessionLocal
+        session = SessionLocal()
+        try:
+            return upload_state(session, user_id)[1]
+        finally:
+            session.close()
+
+    async def stream():
+        yield f"retry: {int(SSE_POLL_INTERVAL * 4000)}\n\n"
+        if job_id is None:
+            yield sse_event(snapshot)
+            return
+
+        state, seq = snapshot, 0
+        replay = ingest_events.since(job_id, last_seq) if last_job_id == job_id else None
+        if replay:
+            for seq, fields in replay:
+                state = ingest_jobs.apply_event(state, fields)
+                yield sse_event(state, f"{job_id}:{seq}")
+        elif replay is None or not last_seq:
+            latest = ingest_events.latest(job_id)
+            if latest:
+                seq, fields = latest
+                state = ingest_jobs.apply_event(state, fields)
+            yield sse_event(state, f"{job_id}:{seq}")
+        else:
+            seq = last_seq
+
+        last_sent = last_db_poll = time.monotonic()
+        while state["status"] == "processing":
+            if await request.is_disconnected():
+                return
+            await asyncio.sleep(SSE_POLL_INTERVAL)
+            now = time.monotonic()
+
+            events = ingest_events.since(job_id, seq)
+            if events is None and ingest_events.latest(job_id):
+                # Fell behind the ring buffer: skip to the newest state
+                events = [ingest_events.latest(job_id)]
+            if events:
+                for seq, fields in events:
+                    state = ingest_jobs.apply_event(state, fields)
+                yield sse_event(state, f"{job_id}:{seq}")
+                last_sent = now
+            elif events is None and now - last_db_poll >= SSE_DB_POLL_INTERVAL:
+                # Not running in this process (queued, or owned by another worker): read its row
+                last_db_poll = now
+                polled = await asyncio.to_thread(poll_db)
+                if polled.get("job_id") != job_id:
+                    return
+                if polled != state:
+                    state = polled
+                    yield sse_event(state, f"{job_id}:{seq}")
+                    last_sent = now
+
+            if now - last_sent >= SSE_HEARTBEAT_SECONDS:
+                yield ": heartbeat\n\n"
+                last_sent = now
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @app.post("/upload/cancel")
-def cancel_upload(user: User = Depends(get_current_user)):
-    """Set the should_cancel flag for the background process."""
+def cancel_upload(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Flag the user's ingest job as cancelled (the worker stops at the next check)."""
     require_view_permission(user, "can_view_processes", "Permissão negada.")
-    state = get_user_upload_state(str(user.id))
-    if state["status"] == "processing":
-        state["should_cancel"] = True
+    job = ingest_jobs.active_job(db, user.id)
+    if job:
+        # Still waiting in this process' queue: drop the job (and its temp file) right away
+        if ingest_queue.jobs.position(user.id) and ingest_queue.jobs.discard(user.id):
+            ingest_jobs.mark_cancelled(db, job)
+            return {"message": "Upload removido da fila."}
+        ingest_jobs.request_cancel(db, job)
         return {"message": "Cancelamento solicitado."}
     return {"message": "Nenhum upload em andamento."}
 
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 @app.post("/upload")
-async def upload_file(
-    background_tasks: BackgroundTasks, 
+def upload_file(
     file: UploadFile = File(...),
-    user: User = Depends(get_current_user)
+    mode: str = "replace",
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
 ):
     logger.info(f"Received upload request from user {user.id}. Filename: {file.filename}")
     require_view_permission(user, "can_view_processes", "Permissão negada.")
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="File must be a PDF")
+    if mode not in ("replace", "diff"):
+        raise HTTPException(status_code=400, detail="mode deve ser 'replace' ou 'diff'")
     
-    user_state = get_user_upload_state(str(user.id))
-
     # Block concurrent uploads per user
-    if user_state["status"] == "processing":
+    if ingest_jobs.active_job(db, user.id):
          raise HTTPException(status_code=409, detail="Já existe um arquivo sendo processado. Aguarde.")
 
-    # Reset state immediately so polling sees "processing" instead of old "completed"
-    user_state["status"] = "processing"
-    user_state["message"] = "Enviando arquivo..."
-    user_state["processed_count"] = 0
-    user_state["error"] = None
-    user_state["should_cancel"] = False
+    # Create the job immediately so polling sees "processing" instead of old "completed"
+    job = ingest_jobs.create_job(db, user.id, mode)
 
-    # Save to temp file
+    # Save to temp file, hashing the content on the way for parse_cache
+    # (a plain def endpoint: these blocking reads/writes run in the threadpool, not on the event loop)
     try:
+        hasher = hashlib.sha256()
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            shutil.copyfileobj(file.file, tmp)
+            while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+                hasher.update(chunk)
+                tmp.write(chunk)
             tmp_path = tmp.name
+        file_hash = hasher.hexdigest()
     except Exception as e:
+        ingest_jobs.JobHandle(job.id).finish("error", "Erro ao receber arquivo.", error=str(e))
         raise HTTPException(status_code=500, detail=f"Failed to save upload: {e}")
     
-    # Start background task
-    background_tasks.add_task(process_pdf_background, tmp_path, user.id)
-    
-    return {"message": "Upload recebido. Processamento iniciado em segundo plano.", "status": "processing"}
+    # Queue the ingest job (bounded concurrency, fair across users)
+    job.file_hash = file_hash
+    db.commit()
+    position = ingest_queue.jobs.submit(
+        user.id, process_pdf_background, job.id, tmp_path, user.id, file_hash, mode,
+        on_discard=lambda: os.path.exists(tmp_path) and os.remove(tmp_path),
+    )
+    if position:
+        return {"message": "Upload recebido. Aguardando na fila de processamento.", "status": "processing", "queue_position": position}
+
+    return {"message": "Upload recebido. Processamento iniciado em segundo plano.", "status": "processing", "queue_position": 0}
 
 @app.delete("/clear")
 def clear_records(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Clear all process records for the authenticated user."""
     from models import Process
     require_view_permission(user, "can_view_processes", "Permissão negada.")
-    
+
+    # A running upload would activate its staged rows right after the clear
+    if ingest_jobs.active_job(db, user.id):
+        raise HTTPException(status_code=409, detail="Há um arquivo sendo processado. Aguarde ou cancele o envio antes de limpar.")
+
     try:
-        deleted_count = db.query(Process).filter(Process.user_id == user.id).delete()
+        deleted_count = db.query(Process).filter(
+            Process.user_id == user.id, Process.dataset_version == (user.active_dataset_version or 0)
+        ).delete(synchronize_session=False)
+        # Leftovers of crashed uploads (not part of the live dataset, so not counted)
+        db.query(Process).filter(Process.user_id == user.id).delete(synchronize_session=False)
+        ingest.delete_dataset_aggregates(db, user.id)
+        ingest.bump_dataset_revision(db, user.id)
         db.commit()
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to clear records: {e}")
+    frame_cache.frames.invalidate(user.id)
+    response_cache.responses.invalidate(user.id)
+    export_jobs.discard_user(user.id)
     
     # Also reset status
-    if str(user.id) in UPLOAD_STATE:
-        del UPLOAD_STATE[str(user.id)]
-        
+    ingest_jobs.clear_jobs(db, user.id)
+
     return {"message": f"{deleted_count} registros removidos com sucesso.", "cleared": deleted_count}
 
 @app.get("/stats")
 def get_stats(
-    search: Optional[str] = None, 
-    type_filter: Optional[str] = None,
-    status_filter: Optional[str] = None,
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-    only_delayed: bool = False,
+    request: Request,
+    filters: process_query.FilterSpec = Depends(process_filters),
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     require_view_permission(user, "can_view_dashboard", "Permissão negada.")
     try:
-        from models import Process
-        # Optimized: Fetch directly from DB instead of loading all valid users
-        # For complexity analysis, we can use Pandas for aggregation or SQLAlchemy
-        # Given we have existing Pandas logic, let's load user data into DF
-        
-        query = db.query(Process).filter(Process.user_id == user.id)
-        
-        # Read from SQL to Pandas
-        df = pd.read_sql(query.statement, db.bind)
-        
-        if df.empty:
-            return {
-                "total": 0, "encerrados": 0, "andamento": 0, "atrasados": 0,
-                "by_month": [], "by_type": [], 
-                "by_type_delayed": [],
-                "by_type_closed_top": [],
-                "by_type_closed_bottom": [],
-                "all_statuses": [], "all_types": [], "available_months": []
-            }
-        
-        # Normalize Request Type to avoid duplicates (e.g. "Tipo A" vs "Tipo A ")
-        if 'tipo_solicitacao' in df.columns:
-            df['tipo_solicitacao'] = df['tipo_solicitacao'].astype(str).str.strip().str.replace(r'\s+', ' ', regex=True)
-
-        # Pre-process dates if needed
-        if 'data_abertura' in df.columns and not df['data_abertura'].eq("").all():
-            df['dt'] = pd.to_datetime(df['data_abertura'], format='%d/%m/%Y', errors='coerce')
-            df['month_year'] = df['dt'].dt.strftime('%Y-%m')
-
-        # 1. Calculate Options (from Unfiltered Data)
-        all_statuses = sorted(df['status'].dropna().unique().tolist()) if 'status' in df.columns else []
-        all_types = sorted(df['tipo_solicitacao'].dropna().unique().tolist()) if 'tipo_solicitacao' in df.columns else []
-        available_months = sorted(df['month_year'].dropna().unique().tolist()) if 'month_year' in df.columns else []
-
-        # 2. Apply Filters
-        # Search
-        if search:
-            search_lower = search.lower()
-            df = df[
-                df['id'].astype(str).str.contains(search_lower, case=False) |
-                df['contribuinte'].astype(str).str.contains(search_lower, case=False) |
-                df['tipo_solicitacao'].astype(str).str.contains(search_lower, case=False)
-            ]
-
-        # Type Filter
-        if type_filter:
-            types = type_filter.split(',')
-            if 'tipo_solicitacao' in df.columns:
-                df = df[df['tipo_solicitacao'].isin(types)]
-                
-        # Status Filter
-        if status_filter:
-            statuses = status_filter.split(',')
-            if 'status' in df.columns:
-                df = df[df['status'].isin(statuses)]
-
-        # Date Range Filter
-        if start_date:
-            if 'dt' in df.columns:
-                df = df[df['dt'] >= pd.to_datetime(start_date)]
-        if end_date:
-            if 'dt' in df.columns:
-                df = df[df['dt'] <= pd.to_datetime(end_date)]
-
-        # Only Delayed
-        if only_delayed:
-            if 'is_atrasado' in df.columns:
-                df = df[df['is_atrasado'] == True]
-
-        # 3. Calculate KPIs (from Filtered Data)
-        total = len(df)
-        
-        encerrados_mask = df['status'].str.contains('ENCERRAMENTO|DEFERIDO|INDEFERIDO', na=False, case=False) if 'status' in df.columns else pd.Series([False] * len(df))
-        encerrados_count = len(df[encerrados_mask]) if not df.empty else 0
-        
-        andamento_count = len(df[df['status'] == 'ANDAMENTO']) if not df.empty and 'status' in df.columns else 0
-        atrasados_count = len(df[df['is_atrasado'] == True]) if not df.empty and 'is_atrasado' in df.columns else 0
-        
-        # 4. Calculate Charts (from Filtered Data)
-        
-        # Evolution by Month
-        evolution_data = []
-        if not df.empty and 'month_year' in df.columns:
-             evolution = df.groupby('month_year').agg(
-                total=('id', 'count'),
-                encerrados=('status', lambda x: x.str.contains('ENCERRAMENTO|DEFERIDO|INDEFERIDO', na=False, case=False).sum()),
-                andamento=('status', lambda x: (x == 'ANDAMENTO').sum()),
-                atrasados=('is_atrasado', 'sum')
-            ).reset_index().sort_values('month_year')
-             evolution_data = evolution.to_dict('records')
-
-        # Top Types
-        by_type_data = []
-        if not df.empty and 'tipo_solicitacao' in df.columns:
-            by_type = df['tipo_solicitacao'].value_counts().head(10).reset_index()
-            by_type.columns = ['type', 'count']
-            by_type_data = by_type.to_dict('records')
-
-        # Closed by Type (Top and Bottom)
-        by_type_closed_top = []
-        by_type_closed_bottom = []
-        if not df.empty and 'tipo_solicitacao' in df.columns and 'status' in df.columns:
-            closed_df = df[df['status'].str.contains('ENCERRAMENTO|DEFERIDO|INDEFERIDO', na=False, case=False)]
-            if not closed_df.empty:
-                closed_counts = closed_df.groupby('tipo_solicitacao')['id'].count().reset_index().sort_values('id', ascending=False)
-                top_closed = closed_counts.head(10).rename(columns={'tipo_solicitacao': 'type', 'id': 'count'})
-                bottom_closed = closed_counts.sort_values('id', ascending=True).head(10).rename(columns={'tipo_solicitacao': 'type', 'id': 'count'})
-                by_type_closed_top = top_closed.to_dict('records')
-                by_type_closed_bottom = bottom_closed.to_dict('records')
-
-        # Top Delayed Types
-        by_type_delayed_data = []
-        if not df.empty and 'tipo_solicitacao' in df.columns and 'is_atrasado' in df.columns:
-            delayed_df = df[df['is_atrasado'] == True]
-            if not delayed_df.empty:
-                by_type_delayed = delayed_df['tipo_solicitacao'].value_counts().head(10).reset_index()
-                by_type_delayed.columns = ['type', 'count']
-                by_type_delayed_data = by_type_delayed.to_dict('records')
-
-        return {
-            "total": total,
-            "encerrados": encerrados_count,
-            "andamento": andamento_count,
-            "atrasados": atrasados_count,
-            "by_month": evolution_data,
-            "by_type": by_type_data,
-            "by_type_delayed": by_type_delayed_data,
-            "by_type_closed_top": by_type_closed_top,
-            "by_type_closed_bottom": by_type_closed_bottom,
-            "all_statuses": all_statuses,
-            "all_types": all_types,
-            "available_months": available_months
-        }
+        # Aggregated in the database with GROUP BY, from the stats cube when the filters allow (see process_stats.py);
+        # repeated requests are answered from response_cache (ETag / 304)
+        return response_cache.responses.respond(
+            request, "stats", user.id, user.dataset_revision or 0, {},
+            lambda: process_stats.compute_stats(
+                user_processes_query(db, user), filters, cube=(db, user.id, user.active_dataset_version or 0)
+            ),
+            filters=filters,
+        )
     except Exception as e:
         logger.error(f"Error in get_stats: {e}")
         logger.error(traceback.format_exc())
@@ -740,306 +1088,196 @@ def get_stats(
 
 @app.get("/processes")
 def get_processes(
+    request: Request,
     page: int = 1, 
     limit: int = 10, 
-    search: Optional[str] = None, 
-    type_filter: Optional[str] = None,
-    status_filter: Optional[str] = None,
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-    only_delayed: bool = False,
+    filters: process_query.FilterSpec = Depends(process_filters),
+    cursor: Optional[str] = None,
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    from models import Process
+    """Paginated process list.
+
+    Default mode is page/limit with totals. Passing `cursor` (empty for the
+    first page) switches to keyset mode: each response carries an opaque
+    `next_cursor` for the following page (null at the end) and no totals.
+    Responses are cached per dataset revision (ETag / 304, see response_cache.py).
+    """
     require_view_permission(user, "can_view_processes", "Permissão negada.")
-    
-    # Query Database
-    query = db.query(Process).filter(Process.user_id == user.id)
-    df = pd.read_sql(query.statement, db.bind)
+    page = max(page, 1)
+    limit = max(limit, 1)
+    params = dict(cursor=cursor) if cursor is not None else dict(page=page)
+    try:
+        return response_cache.responses.respond(
+            request, "processes", user.id, user.dataset_revision or 0, dict(params, limit=limit),
+            lambda: list_processes(db, user, page, limit, cursor, filters),
+            filters=filters,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def list_processes(db: Session, user: User, page: int, limit: int, cursor: Optional[str],
+                   filters: process_query.FilterSpec) -> dict:
+    """Payload of /processes (ValueError on an invalid cursor)."""
+    only_delayed = filters.only_delayed
+    # Filters, ordering and pagination run in the database (see process_query.py)
+    query = filters.apply(user_processes_query(db, user))
+
+    if cursor is not None:
+        rows, next_cursor = process_query.keyset_page(query, cursor, limit, only_delayed)
+        return {
+            "data": [process_query.process_dict(p) for p in rows],
+            "next_cursor": next_cursor,
+            "limit": limit
+        }
 
-    if df.empty:
+    total_records = process_query.count_processes(query)
+    total_pages = (total_records + limit - 1) // limit
+    if not total_records:
         return {"data": [], "total": 0, "page": page, "pages": 0}
-        
-    # Normalize Request Type to avoid duplicates (e.g. "Tipo A" vs "Tipo A ")
-    if 'tipo_solicitacao' in df.columns:
-        df['tipo_solicitacao'] = df['tipo_solicitacao'].astype(str).str.strip().str.replace(r'\s+', ' ', regex=True)
-
-    # Pre-process dates for filtering
-    if 'data_abertura' in df.columns:
-        df['dt'] = pd.to_datetime(df['data_abertura'], format='%d/%m/%Y', errors='coerce')
-        df['month_year'] = df['dt'].dt.strftime('%Y-%m')
-
-    # Filter
-    # Filter by Date Range
-    if start_date and 'dt' in df.columns:
-        df = df[df['dt'] >= pd.to_datetime(start_date)]
-    if end_date and 'dt' in df.columns:
-        df = df[df['dt'] <= pd.to_datetime(end_date)]
-
-    if status_filter:
-        logger.info(f"DEBUG: RAW status_filter='{status_filter}'")
-        # Support multiple statuses (comma-separated)
-        statuses = [s.strip() for s in status_filter.split(',')]
-        logger.info(f"DEBUG: Filtering by statuses={statuses}")
-        logger.info(f"DEBUG: Available statuses in DF: {df['status'].unique().tolist()}")
-        df = df[df['status'].isin(statuses)]
-
-    if only_delayed:
-        df = df[df['is_atrasado'] == True]
-        
-    if type_filter:
-        types = [t.strip() for t in type_filter.split(',')]
-        df = df[df['tipo_solicitacao'].isin(types)]
 
+    rows = query.order_by(*process_query.process_order(only_delayed)).offset((page - 1) * limit).limit(limit).all()
 
-        
-    if search:
-        search = search.lower()
-        # Search across multiple columns
-        mask = (
-            df['id'].str.lower().str.contains(search) | 
-            df['contribuinte'].str.lower().str.contains(search) |
-            df['tipo_solicitacao'].str.lower().str.contains(search)
-        )
-        df = df[mask]
-    
-    # Conditional sorting:
-    # - If filtering only delayed: sort by delay days (descending - most delayed first)
-    # - Otherwise: sort by opening date (descending - most recent first)
-    if only_delayed:
-        df = df.sort_values('dias_atraso_calc', ascending=False)
-    else:
-        # Sort by opening date (most recent first)
-        df = df.sort_values('dt', ascending=False)
-    
-    # Pagination
-    total_records = len(df)
-    total_pages = (total_records + limit - 1) // limit
-    
-    start = (page - 1) * limit
-    end = start + limit
-    
-    paginated = df.iloc[start:end].to_dict('records')
-    
     return {
-        "data": paginated,
+        "data": [process_query.process_dict(p) for p in rows],
         "total": total_records,
         "page": page,
         "pages": total_pages
     }
 
+@app.get("/processes/suggest")
+def suggest_processes(
+    request: Request,
+    field: str,
+    q: str = "",
+    limit: int = process_search.SUGGEST_LIMIT,
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Autocomplete for the search box: most frequent contribuinte / tipo values starting with `q`."""
+    require_view_permission(user, "can_view_processes", "Permissão negada.")
+    if field not in process_search.SUGGEST_FIELDS:
+        raise HTTPException(status_code=400, detail="Campo inválido. Use 'contribuinte' ou 'tipo'.")
+    limit = min(max(limit, 1), process_search.SUGGEST_MAX_LIMIT)
+    # Index range scan on the normalized prefix key (see process_search.py)
+    return response_cache.responses.respond(
+        request, "suggest", user.id, user.dataset_revision or 0,
+        {"field": field, "q": process_search.normalize_term(q), "limit": limit},
+        lambda: {
+            "field": field,
+            "suggestions": process_search.suggest(
+                user_processes_query(db, user), field, q, limit,
+                index=(db, user.id, user.active_dataset_version or 0),
+            ),
+        },
+    )
+
 @app.get("/export-excel")
 def export_excel(
-    search: Optional[str] = None,
-    type_filter: Optional[str] = None,
-    status_filter: Optional[str] = None,
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-    only_delayed: bool = False,
+    filters: process_query.FilterSpec = Depends(process_filters),
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Export filtered processes to a formatted Excel file."""
-    import xlsxwriter
-    from datetime import datetime
-    from models import Process
+    from starlette.background import BackgroundTask
     require_view_permission(user, "can_view_processes", "Permissão negada.")
 
-    # Query Database
-    query = db.query(Process).filter(Process.user_id == user.id)
-    df = pd.read_sql(query.statement, db.bind)
-
-    if df.empty:
+    base_query = user_processes_query(db, user)
+    if not db.query(base_query.exists()).scalar():
         raise HTTPException(status_code=400, detail="Nenhum dado disponível para exportar.")
 
-    # Normalize Request Type to avoid duplicates (e.g. "Tipo A" vs "Tipo A ")
-    if 'tipo_solicitacao' in df.columns:
-        df['tipo_solicitacao'] = df['tipo_solicitacao'].astype(str).str.strip().str.replace(r'\s+', ' ', regex=True)
-
-    # Pre-process dates
-    if 'data_abertura' in df.columns:
-        df['dt'] = pd.to_datetime(df['data_abertura'], format='%d/%m/%Y', errors='coerce')
-        df['month_year'] = df['dt'].dt.strftime('%Y-%m')
-
-    # Apply filters (same logic as /processes)
-    if start_date and 'dt' in df.columns:
-        df = df[df['dt'] >= pd.to_datetime(start_date)]
-    if end_date and 'dt' in df.columns:
-        df = df[df['dt'] <= pd.to_datetime(end_date)]
-
-    if status_filter:
-        statuses = [s.strip() for s in status_filter.split(',')]
-        df = df[df['status'].isin(statuses)]
-
-    if only_delayed:
-        df = df[df['is_atrasado'] == True]
-
-    if type_filter:
-        types = [t.strip() for t in type_filter.split(',')]
-        df = df[df['tipo_solicitacao'].isin(types)]
-
-    if search:
-        search_lower = search.lower()
-        mask = (
-            df['id'].str.lower().str.contains(search_lower) |
-            df['contribuinte'].str.lower().str.contains(search_lower) |
-            df['tipo_solicitacao'].str.lower().str.contains(search_lower)
-        )
-        df = df[mask]
-
-    # Sort by date (most recent first)
-    if only_delayed and 'dias_atraso_calc' in df.columns:
-        df = df.sort_values('dias_atraso_calc', ascending=False)
-    elif 'dt' in df.columns:
-        df = df.sort_values('dt', ascending=False)
-
-    # Build Excel in memory
-    output = io.BytesIO()
-    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
-    worksheet = workbook.add_worksheet('Processos')
-
-    # --- Formats ---
-    header_fmt = workbook.add_format({
-        'bold': True,
-        'font_color': '#FFFFFF',
-        'bg_color': '#1E3A5F',
-        'border': 1,
-        'border_color': '#B0BEC5',
-        'align': 'center',
-        'valign': 'vcenter',
-        'font_size': 11,
-        'text_wrap': True,
-    })
-    cell_fmt = workbook.add_format({
-        'border': 1,
-        'border_color': '#D0D5DD',
-        'font_size': 10,
-        'valign': 'vcenter',
-    })
-    cell_center_fmt = workbook.add_format({
-        'border': 1,
-        'border_color': '#D0D5DD',
-        'font_size': 10,
-        'align': 'center',
-        'valign': 'vcenter',
-    })
-    cell_right_fmt = workbook.add_format({
-        'border': 1,
-        'border_color': '#D0D5DD',
-        'font_size': 10,
-        'align': 'right',
-        'valign': 'vcenter',
-    })
-    delay_fmt = workbook.add_format({
-        'border': 1,
-        'border_color': '#D0D5DD',
-        'font_size': 10,
-        'align': 'right',
-        'valign': 'vcenter',
-        'bold': True,
-        'font_color': '#DC2626',
-    })
-    # Status formats
-    status_green = workbook.add_format({
-        'border': 1, 'border_color': '#D0D5DD', 'font_size': 10,
-        'align': 'center', 'valign': 'vcenter',
-        'bg_color': '#DCFCE7', 'font_color': '#166534',
-    })
-    status_red = workbook.add_format({
-        'border': 1, 'border_color': '#D0D5DD', 'font_size': 10,
-        'align': 'center', 'valign': 'vcenter',
-        'bg_color': '#FEE2E2', 'font_color': '#991B1B',
-    })
-    status_blue = workbook.add_format({
-        'border': 1, 'border_color': '#D0D5DD', 'font_size': 10,
-        'align': 'center', 'valign': 'vcenter',
-        'bg_color': '#DBEAFE', 'font_color': '#1E40AF',
-    })
-    status_orange = workbook.add_format({
-        'border': 1, 'border_color': '#D0D5DD', 'font_size': 10,
-        'align': 'center', 'valign': 'vcenter',
-        'bg_color': '#FFEDD5', 'font_color': '#9A3412',
-    })
-    status_gray = workbook.add_format({
-        'border': 1, 'border_color': '#D0D5DD', 'font_size': 10,
-        'align': 'center', 'valign': 'vcenter',
-        'bg_color': '#F3F4F6', 'font_color': '#374151',
-    })
-
-    # Title row
-    title_fmt = workbook.add_format({
-        'bold': True, 'font_size': 14, 'font_color': '#1E3A5F',
-    })
-    subtitle_fmt = workbook.add_format({
-        'font_size': 10, 'font_color': '#64748B', 'italic': True,
-    })
-    worksheet.merge_range('A1:F1', 'Report Terra - Processos', title_fmt)
-    export_time = datetime.now().strftime('%d/%m/%Y %H:%M')
-    filters_desc = []
-    if start_date or end_date:
-        filters_desc.append(f"Período: {start_date or 'Início'} a {end_date or 'Fim'}")
-    if status_filter:
-        filters_desc.append(f"Situação: {status_filter}")
-    if type_filter:
-        filters_desc.append(f"Tipo: {type_filter}")
-    if search:
-        filters_desc.append(f"Busca: {search}")
-    if only_delayed:
-        filters_desc.append("Apenas Atrasados")
-    subtitle = f"Exportado em {export_time}"
-    if filters_desc:
-        subtitle += f" | Filtros: {', '.join(filters_desc)}"
-    subtitle += f" | Total: {len(df)} registros"
-    worksheet.merge_range('A2:F2', subtitle, subtitle_fmt)
-
-    # Headers (row 3, index 2)
-    headers = ['Nº Proc. / Ano', 'Contribuinte', 'Data Abertura', 'Situação', 'Tipo de Solicitação', 'Dias Atraso']
-    col_widths = [18, 35, 15, 20, 40, 14]
-    for col, (header, width) in enumerate(zip(headers, col_widths)):
-        worksheet.write(3, col, header, header_fmt)
-        worksheet.set_column(col, col, width)
-
-    # Data rows
-    def get_status_fmt(status_val):
-        if any(s in str(status_val) for s in ['ENCERRAMENTO', 'DEFERIDO']):
-            return status_green
-        if any(s in str(status_val) for s in ['INDEFERIDO', 'CANCELADO']):
-            return status_red
-        if str(status_val) in ['ANDAMENTO', 'EM DILIGENCIA']:
-            return status_blue
-        if str(status_val) in ['RETORNO', 'PENDENCIA', 'SUSPENSO']:
-            return status_orange
-        return status_gray
-
-    for row_idx, (_, row) in enumerate(df.iterrows(), start=4):
-        worksheet.write(row_idx, 0, str(row.get('id', '')), cell_center_fmt)
-        worksheet.write(row_idx, 1, str(row.get('contribuinte', '')), cell_fmt)
-        worksheet.write(row_idx, 2, str(row.get('data_abertura', '')), cell_center_fmt)
-        worksheet.write(row_idx, 3, str(row.get('status', '')), get_status_fmt(row.get('status', '')))
-        worksheet.write(row_idx, 4, str(row.get('tipo_solicitacao', '')), cell_fmt)
-
-        is_delayed = row.get('is_atrasado', False)
-        delay_days = row.get('dias_atraso_calc', 0)
-        if is_delayed and delay_days:
-            worksheet.write(row_idx, 5, f"{delay_days} dias", delay_fmt)
-        else:
-            worksheet.write(row_idx, 5, '-', cell_center_fmt)
-
-    # Freeze header row
-    worksheet.freeze_panes(4, 0)
-    worksheet.set_row(3, 22)
-
-    workbook.close()
-    output.seek(0)
+    # Same filters and order as /processes, streamed from the cursor (see process_export.py)
+    path = process_export.xlsx_export_file(base_query, filters)
 
     filename = f"Report_Terra_Processos_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
+    return FileResponse(
+        path,
+        media_type=process_export.XLSX_MEDIA_TYPE,
+        filename=filename,
+        background=BackgroundTask(process_export.remove_file, path),
+    )
+
+@app.get("/export")
+def export_data(
+    format: str = "csv",
+    filters: process_query.FilterSpec = Depends(process_filters),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Export filtered processes as CSV, NDJSON or Parquet, streamed while the rows are read."""
+    from database import SessionLocal
+    require_view_permission(user, "can_view_processes", "Permissão negada.")
+    if format not in process_export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Formato inválido. Use 'csv', 'ndjson' ou 'parquet'.")
+    if not process_export.format_available(format):
+        raise HTTPException(status_code=501, detail="Exportação Parquet indisponível: instale o pacote pyarrow.")
+
+    # The download can take a while: the stream reads through its own session
+    db.close()
+
+    encode, media_type, extension = process_export.EXPORT_FORMATS[format]
+
+    def stream():
+        session = SessionLocal()
+        try:
+            query = filters.apply(user_processes_query(session, user))
+            rows = process_export.export_rows(query, filters.only_delayed, columns=process_export.DATA_COLUMNS)
+            yield from encode(rows)
+        finally:
+            session.close()
+
+    filename = f"Report_Terra_Processos_{datetime.now().strftime('%Y%m%d_%H%M')}.{extension}"
     return StreamingResponse(
-        output,
-        media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        stream(),
+        media_type=media_type,
         headers={'Content-Disposition': f'attachment; filename="{filename}"'}
     )
 
+@app.post("/export/jobs")
+def create_export_job(
+    format: str = "xlsx",
+    filters: process_query.FilterSpec = Depends(process_filters),
+    user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Queue a background export (same parameters as /export, plus format=xlsx).
+
+    Poll GET /export/jobs/{job_id} until status is "completed", then fetch
+    its download_url. Identical exports of the same dataset are served from
+    the on-disk cache (see export_jobs.py).
+    """
+    require_view_permission(user, "can_view_processes", "Permissão negada.")
+    if format not in export_jobs.JOB_FORMATS:
+        raise HTTPException(status_code=400, detail="Formato inválido. Use 'xlsx', 'csv', 'ndjson' ou 'parquet'.")
+    if format != "xlsx" and not process_export.format_available(format):
+        raise HTTPException(status_code=501, detail="Exportação Parquet indisponível: instale o pacote pyarrow.")
+    job = export_jobs.submit(db, user, format, filters)
+    return export_jobs.job_status(job)
+
+@app.get("/export/jobs/{job_id}")
+def get_export_job(job_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    require_view_permission(user, "can_view_processes", "Permissão negada.")
+    job = export_jobs.get_job(db, user.id, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Exportação não encontrada.")
+    return export_jobs.job_status(job)
+
+@app.get("/export/jobs/{job_id}/download")
+def download_export_job(job_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    require_view_permission(user, "can_view_processes", "Permissão negada.")
+    job = export_jobs.get_job(db, user.id, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Exportação não encontrada.")
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail="A exportação ainda não foi concluída.")
+    path = export_jobs.cached_artifact(job)
+    if not path:
+        raise HTTPException(status_code=410, detail="O arquivo desta exportação expirou. Gere a exportação novamente.")
+    extension = process_export.file_extension(job.format)
+    media_type = process_export.XLSX_MEDIA_TYPE if job.format == "xlsx" else process_export.EXPORT_FORMATS[job.format][1]
+    filename = f"Report_Terra_Processos_{(job.finished_at or datetime.utcnow()).strftime('%Y%m%d_%H%M')}.{extension}"
+    return FileResponse(path, media_type=media_type, filename=filename)
+
 # --- ADMIN ENDPOINTS ---
 
 class UserUpdate(BaseModel):
@@ -1124,7 +1362,7 @@ def admin_deactivate_user(user_id: int, admin: User = Depends(get_admin_user), d
 @app.delete("/admin/users/{user_id}/permanent")
 def admin_delete_user(user_id: int, admin: User = Depends(get_admin_user), db: Session = Depends(get_db)):
     """Exclui permanentemente um usuário e todos os seus dados associados."""
-    from models import UserActivity, Process
+    from models import UserActivity, Process, IngestJob, ExportJob
     from models import Report
     user = db.query(User).filter(User.id == user_id).first()
     if not user:
@@ -1137,10 +1375,21 @@ def admin_delete_user(user_id: int, admin: User = Depends(get_admin_user), db: S
     db.query(UserActivity).filter(UserActivity.user_id == user_id).delete()
     db.query(Report).filter(Report.user_id == user_id).delete()
     db.query(Process).filter(Process.user_id == user_id).delete()
+    ingest.delete_dataset_aggregates(db, user_id)
+    db.query(IngestJob).filter(IngestJob.user_id == user_id).delete()
+    db.query(ExportJob).filter(ExportJob.user_id == user_id).delete()
     db.delete(user)
     db.commit()
+    frame_cache.frames.invalidate(user_id)
+    response_cache.responses.invalidate(user_id)
+    export_jobs.discard_user(user_id)
     return {"message": f"Usuário {email} excluído permanentemente"}
 
+@app.get("/admin/cache")
+def admin_cache_stats(admin: User = Depends(get_admin_user)):
+    """Contadores dos caches em memória (acertos, falhas, bytes ocupados)."""
+    return {"dataframes": frame_cache.frames.stats(), "responses": response_cache.responses.stats()}
+
 # --- ADMIN AUDIT ENDPOINTS ---
 
 @app.get("/admin/audit/summary")
@@ -1212,7 +1461,8 @@ def admin_audit_users(admin: User = Depends(get_admin_user), db: Session = Depen
         ).scalar() or 0
 
         process_count = db.query(func.count(Process.id)).filter(
-            Process.user_id == u.id
+            Process.user_id == u.id,
+            Process.dataset_version == (u.active_dataset_version or 0)
         ).scalar() or 0
 
         result.append({
@@ -1317,12 +1567,7 @@ from ai_agent import generate_analysis_stream
 
 @app.post("/api/generate-report")
 async def generate_report(
-    search: Optional[str] = None, 
-    type_filter: Optional[str] = None,
-    status_filter: Optional[str] = None,
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-    only_delayed: bool = False,
+    filters: process_query.FilterSpec = Depends(process_filters),
     user_prompt: Optional[str] = None,
     user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -1337,9 +1582,8 @@ async def generate_report(
     if user_role != "admin" and not user_can:
         raise HTTPException(status_code=403, detail="Permissão negada. Contate o administrador para liberar acesso aos relatórios de IA.")
 
-    from models import Process
-    query = db.query(Process).filter(Process.user_id == user.id)
-    df = pd.read_sql(query.statement, db.bind)
+    # Cached per dataset revision (frame_cache.py)
+    df = user_processes_frame(db, user)
 
     if df.empty:
         # Stream a message saying no data
@@ -1347,46 +1591,8 @@ async def generate_report(
             yield "Não há dados disponíveis para análise."
         return StreamingResponse(no_data_gen(), media_type="text/markdown")
 
-    # --- Filtering Logic (Same as other endpoints) ---
-    
-    # Normalize Request Type
-    if 'tipo_solicitacao' in df.columns:
-        df['tipo_solicitacao'] = df['tipo_solicitacao'].astype(str).str.strip().str.replace(r'\s+', ' ', regex=True)
-
-    # Pre-process dates
-    if 'data_abertura' in df.columns:
-        df['dt'] = pd.to_datetime(df['data_abertura'], format='%d/%m/%Y', errors='coerce')
-    
-    # Apply Filters
-    if start_date and 'dt' in df.columns:
-        df = df[df['dt'] >= pd.to_datetime(start_date)]
-    if end_date and 'dt' in df.columns:
-        df = df[df['dt'] <= pd.to_datetime(end_date)]
-
-    if status_filter:
-        statuses = [s.strip() for s in status_filter.split(',')]
-        if 'status' in df.columns:
-            df = df[df['status'].isin(statuses)]
-
-    if only_delayed and 'is_atrasado' in df.columns:
-        df = df[df['is_atrasado'] == True]
-
-    if type_filter:
-        types = [t.strip() for t in type_filter.split(',')]
-        if 'tipo_solicitacao' in df.columns:
-            df = df[df['tipo_solicitacao'].isin(types)]
-
-    if search:
-        search_lower = search.lower()
-        mask = (
-            df['id'].astype(str).str.lower().str.contains(search_lower) |
-            df['contribuinte'].astype(str).str.lower().str.contains(search_lower)
-        )
-        if 'tipo_solicitacao' in df.columns:
-             mask |= df['tipo_solicitacao'].astype(str).str.lower().str.contains(search_lower)
-        df = df[mask]
-    
-    # --- End Filtering ---
+    # Same filters as the other endpoints, as a vectorized mask (process_query.FilterSpec)
+    df = df[filters.mask(df)]
 
     return StreamingResponse(
         generate_analysis_stream(df, user_prompt or ""),
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime, JSON, UniqueConstraint
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, Date, DateTime, JSON, UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -20,6 +20,10 @@ class User(Base):
     can_view_reports = Column(Boolean, default=True)
     last_login = Column(DateTime, nullable=True)
     approval_status = Column(String, default="approved")
+    # Dataset version of the user's live `processes` rows (see ingest.py)
+    active_dataset_version = Column(Integer, default=0)
+    # Bumped whenever the live dataset changes (upload in either mode, /clear); cache key
+    dataset_revision = Column(Integer, default=0)
 
     processes = relationship("Process", back_populates="owner")
     reports = relationship("Report", back_populates="owner")
@@ -31,21 +35,39 @@ class Process(Base):
     pk = Column(Integer, primary_key=True, index=True)
     id = Column(String, index=True) # "1234 - 2024"
     user_id = Column(Integer, ForeignKey("users.id"))
+    # Rows of an upload in progress live under a new version until it is activated
+    dataset_version = Column(Integer, default=0, nullable=False)
 
     __table_args__ = (
-        UniqueConstraint("user_id", "id", name="uix_process_user_id"),
+        UniqueConstraint("user_id", "dataset_version", "id", name="uix_process_user_id"),
+        # Every read is scoped to one user's live dataset (user_id, dataset_version) first
+        Index("ix_processes_user_status", "user_id", "dataset_version", "status"),
+        Index("ix_processes_user_tipo", "user_id", "dataset_version", "tipo_solicitacao"),
+        Index("ix_processes_user_date", "user_id", "dataset_version", "data_abertura_date"),
+        # Partial: only delayed rows, ordered like the "only delayed" list
+        Index(
+            "ix_processes_user_delayed", "user_id", "dataset_version", "dias_atraso_calc",
+            sqlite_where=text("is_atrasado = 1"), postgresql_where=text("is_atrasado"),
+        ),
     )
     
     contribuinte = Column(String)
     data_abertura = Column(String) # Keeping as string to match legacy regex format, or could migrate to Date
+    data_abertura_date = Column(Date)  # parsed once at ingest (ingest.py); NULL if invalid
+    month_year = Column(String)  # "YYYY-MM" of data_abertura_date
     ano = Column(String)
     status = Column(String, index=True)
     setor_atual = Column(String)
-    tipo_solicitacao = Column(String, index=True)
+    tipo_solicitacao = Column(String, index=True)  # stored canonicalized (ingest.canonical_text)
     
     dias_atraso_pdf = Column(Integer, default=0)
     dias_atraso_calc = Column(Integer, default=0)
     is_atrasado = Column(Boolean, default=False)
+    row_hash = Column(String, nullable=True)  # content hash of the parsed record (diff ingest)
+    search_text = Column(Text, nullable=True)  # normalized id / contribuinte / tipo (process_search.py)
+    # Autocomplete keys: normalized contribuinte name / tipo (aggregated into process_suggestions)
+    contribuinte_key = Column(String().with_variant(String(collation="C"), "postgresql"), nullable=True)
+    tipo_key = Column(String().with_variant(String(collation="C"), "postgresql"), nullable=True)
     
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -80,3 +102,83 @@ class UserActivity(Base):
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
 
     user = relationship("User", back_populates="activities")
+
+class IngestJob(Base):
+    """One PDF upload and its progress (see ingest_jobs.py)."""
+    __tablename__ = "ingest_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    mode = Column(String, default="replace")  # "replace" or "diff"
+    file_hash = Column(String, nullable=True)
+    status = Column(String, default="queued", index=True)  # queued, processing, completed, error
+
+    message = Column(String, default="")
+    progress = Column(Integer, default=0)  # percent
+    pages_current = Column(Integer, default=0)
+    pages_total = Column(Integer, default=0)
+    processed_count = Column(Integer, default=0)
+    changes = Column(JSON, nullable=True)  # diff mode summary
+    error = Column(String, nullable=True)
+    cancel_requested = Column(Boolean, default=False)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class ExportJob(Base):
+    """One background export and its cached result file (see export_jobs.py)."""
+    __tablename__ = "export_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    format = Column(String)  # xlsx, csv, ndjson, parquet
+    filters = Column(JSON)  # /export filter parameters, as requested
+    dataset_version = Column(Integer, default=0)
+    dataset_revision = Column(Integer, default=0)  # users.dataset_revision at submit time
+    cache_key = Column(String, index=True)  # result file name (without extension)
+    status = Column(String, default="queued", index=True)  # queued, processing, completed, error
+
+    rows = Column(Integer, default=0)  # written so far / total once completed
+    size = Column(Integer, nullable=True)  # bytes of the result file
+    error = Column(String, nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class ProcessStatsCube(Base):
+    """Process counts by user dataset × month × status × tipo × delayed (see process_stats.py)."""
+    __tablename__ = "process_stats_cube"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    dataset_version = Column(Integer, default=0, nullable=False)
+    month_year = Column(String, nullable=True)
+    status = Column(String, nullable=True)
+    tipo_solicitacao = Column(String, nullable=True)
+    is_atrasado = Column(Boolean, nullable=True)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_process_stats_cube_user_version", "user_id", "dataset_version"),
+    )
+
+class ProcessSuggestion(Base):
+    """Distinct autocomplete keys of a user dataset with their process counts (see process_search.py)."""
+    __tablename__ = "process_suggestions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    dataset_version = Column(Integer, default=0, nullable=False)
+    field = Column(String, nullable=False)  # "contribuinte" or "tipo"
+    # Normalized key, compared bytewise so prefix ranges are exact
+    key = Column(String().with_variant(String(collation="C"), "postgresql"), nullable=False)
+    value = Column(String, nullable=True)  # displayed value (first original spelling)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_process_suggestions_prefix", "user_id", "dataset_version", "field", "key"),
+    )
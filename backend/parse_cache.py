@@ -0,0 +1,239 @@
+"""
+parse_cache.py
+On-disk cache of parsed PDF records, keyed by the uploaded file's content hash.
+
+Users often re-upload the same daily export (after a cancel, from another
+browser, after /clear). A cache hit skips pdfplumber entirely.
+
+Layout:
+  - One msgpack file per (sha256, PARSER_VERSION) in PARSE_CACHE_DIR
+  - The file is a stream of msgpack objects: a {"fields": [...]} header,
+    then lists of up to CACHE_CHUNK_ROWS rows (value lists in field order).
+    CacheWriter appends each chunk to a temp file while the PDF is still
+    being parsed, so an extraction is never held in memory as a whole; the
+    file is renamed into place once the extraction completes. A hit is read
+    back the same way (CacheReader), chunk by chunk
+  - Date-dependent fields (is_atrasado, dias_atraso_calc) are not trusted
+    from the cache: they are recomputed on load via refresh_delay
+  - Size-bounded LRU: a hit touches the file's mtime; writes evict the
+    least recently used files until the directory fits PARSE_CACHE_MAX_MB.
+    An entry that alone exceeds the limit is dropped while being written
+"""
+
+import os
+import time
+import logging
+import tempfile
+
+from process_pdf import PARSER_VERSION, refresh_delay
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+PARSE_CACHE_DIR = os.getenv(
+    "PARSE_CACHE_DIR",
+    os.path.join(os.path.dirname(__file__), "data", "parse_cache")
+)
+
+try:
+    PARSE_CACHE_MAX_BYTES = int(os.getenv("PARSE_CACHE_MAX_MB", "200")) * 1024 * 1024
+except ValueError:
+    PARSE_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+_SUFFIX = ".msgpack"
+
+# Rows per msgpack chunk written by CacheWriter
+CACHE_CHUNK_ROWS = 1000
+
+# Temp files older than this belong to a process that died mid-extraction
+_TMP_MAX_AGE = 3600
+
+# Fields persisted per record (order matters for the row lists)
+CACHED_FIELDS = [
+    "id", "contribuinte", "data_abertura", "ano", "status", "setor_atual",
+    "tipo_solicitacao", "dias_atraso_pdf",
+]
+
+
+def is_enabled() -> bool:
+    return msgpack is not None and PARSE_CACHE_MAX_BYTES > 0
+
+
+def _path(file_hash: str) -> str:
+    return os.path.join(PARSE_CACHE_DIR, f"{file_hash}-v{PARSER_VERSION}{_SUFFIX}")
+
+
+def _discard(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def load(file_hash: str):
+    """Open the cached records of `file_hash` as a CacheReader, or None on a miss."""
+    if not is_enabled() or not file_hash:
+        return None
+    path = _path(file_hash)
+    try:
+        reader = CacheReader(path)
+        os.utime(path)  # LRU: mark as recently used
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Discarding unreadable parse cache entry {path}: {e}")
+        _discard(path)
+        return None
+    return reader
+
+
+class CacheReader:
+    """
+    The records of one cache entry, read one chunk at a time: iterating
+    yields lists of up to CACHE_CHUNK_ROWS records. close() when stopping early.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fh = open(path, "rb")
+        try:
+            self.size = os.fstat(self._fh.fileno()).st_size
+            self._chunks = msgpack.Unpacker(self._fh, raw=False)
+            self.fields = next(self._chunks)["fields"]
+        except Exception:
+            self._fh.close()
+            raise
+
+    def __iter__(self):
+        fields = self.fields
+        try:
+            for chunk in self._chunks:
+                yield [refresh_delay(dict(zip(fields, row))) for row in chunk]
+        except Exception as e:
+            logger.warning(f"Discarding unreadable parse cache entry {self.path}: {e}")
+            _discard(self.path)
+            raise
+        finally:
+            self.close()
+
+    def progress(self) -> float:
+        """Fraction of the entry read so far."""
+        return min(1.0, self._chunks.tell() / self.size) if self.size else 1.0
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+class CacheWriter:
+    """
+    Streams the records of one extraction into the cache entry of `file_hash`.
+    add() every record, then commit() once the extraction is complete;
+    abort() (a no-op after commit) discards the partial entry.
+    """
+
+    def __init__(self, file_hash: str):
+        self.file_hash = file_hash
+        self._fh = None
+        self._tmp_path = None
+        self._chunk = []
+        self._size = 0
+        if not is_enabled() or not file_hash:
+            return
+        try:
+            os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+            fd, self._tmp_path = tempfile.mkstemp(dir=PARSE_CACHE_DIR, suffix=".tmp")
+            self._fh = os.fdopen(fd, "wb")
+            self._write({"fields": CACHED_FIELDS})
+        except Exception as e:
+            logger.warning(f"Failed to start parse cache entry for {file_hash}: {e}")
+            self.abort()
+
+    def add(self, record: dict) -> None:
+        if self._fh is None:
+            return
+        self._chunk.append(cache_row(record))
+        if len(self._chunk) >= CACHE_CHUNK_ROWS:
+            self._write(self._chunk)
+            self._chunk = []
+
+    def commit(self) -> None:
+        """Publish the entry (atomically, so concurrent readers never see a partial file)."""
+        if self._chunk:
+            self._write(self._chunk)
+            self._chunk = []
+        if self._fh is None:
+            return
+        try:
+            self._fh.close()
+            self._fh = None
+            os.replace(self._tmp_path, _path(self.file_hash))
+            self._tmp_path = None
+            _evict()
+        except Exception as e:
+            logger.warning(f"Failed to write parse cache for {self.file_hash}: {e}")
+            self.abort()
+
+    def abort(self) -> None:
+        if self._fh is not None:
+            try:
+                self._fh.close()
+            except OSError:
+                pass
+            self._fh = None
+        if self._tmp_path is not None:
+            try:
+                os.remove(self._tmp_path)
+            except OSError:
+                pass
+            self._tmp_path = None
+
+    def _write(self, obj) -> None:
+        if self._fh is None:
+            return
+        try:
+            data = msgpack.packb(obj, use_bin_type=True)
+            self._size += len(data)
+            if self._size > PARSE_CACHE_MAX_BYTES:
+                # Would evict everything else and still not fit
+                self.abort()
+                return
+            self._fh.write(data)
+        except Exception as e:
+            logger.warning(f"Failed to write parse cache for {self.file_hash}: {e}")
+            self.abort()
+
+
+def cache_row(record: dict) -> list:
+    """Convert a parsed record into the compact row written by `CacheWriter.add`."""
+    return [record[f] for f in CACHED_FIELDS]
+
+
+def _evict() -> None:
+    now = time.time()
+    entries = []
+    for name in os.listdir(PARSE_CACHE_DIR):
+        try:
+            st = os.stat(os.path.join(PARSE_CACHE_DIR, name))
+        except FileNotFoundError:
+            continue
+        if name.endswith(".tmp") and now - st.st_mtime > _TMP_MAX_AGE:
+            try:
+                os.remove(os.path.join(PARSE_CACHE_DIR, name))
+            except OSError:
+                pass
+        elif name.endswith(_SUFFIX):
+            entries.append((st.st_mtime, st.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= PARSE_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(os.path.join(PARSE_CACHE_DIR, name))
+            total -= size
+        except FileNotFoundError:
+            pass
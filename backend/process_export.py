@@ -0,0 +1,317 @@
+"""
+process_export.py
+Streaming exports of the filtered process list.
+
+Exports used to load the user's whole dataset into a DataFrame, filter it
+in pandas, write it with iterrows() into an in-memory workbook and only then
+start the response. Here:
+  - Rows come from the database with the same filters and order as
+    /processes (process_query), as plain tuples of EXPORT_COLUMNS, through a
+    streaming cursor (yield_per) in EXPORT_BATCH_SIZE batches
+  - Excel: xlsxwriter in constant_memory mode writes each row to a temp file
+    as it arrives, so memory stays flat whatever the row count; the finished
+    file is streamed to the client in chunks and deleted afterwards
+  - CSV / NDJSON / Parquet (/export): unstyled DATA_COLUMNS for BI tools and
+    scripts, encoded batch by batch while the cursor is read and sent with
+    chunked transfer encoding. Parquet gets one row group per batch, so only
+    one batch is held at a time; it needs pyarrow (optional)
+"""
+
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from models import Process
+import process_query
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    EXPORT_BATCH_SIZE = max(1, int(os.getenv("EXPORT_BATCH_SIZE", "5000")))
+except ValueError:
+    EXPORT_BATCH_SIZE = 5000
+
+# Fetched per row, in this order
+EXPORT_COLUMNS = [
+    Process.id, Process.contribuinte, Process.data_abertura, Process.status,
+    Process.tipo_solicitacao, Process.is_atrasado, Process.dias_atraso_calc,
+]
+
+# Raw columns of the data formats, in this order
+DATA_COLUMNS = [
+    Process.id, Process.contribuinte, Process.data_abertura, Process.data_abertura_date, Process.ano,
+    Process.status, Process.setor_atual, Process.tipo_solicitacao, Process.dias_atraso_pdf,
+    Process.dias_atraso_calc, Process.is_atrasado,
+]
+DATA_FIELDS = [c.key for c in DATA_COLUMNS]
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+XLSX_HEADERS = ['Nº Proc. / Ano', 'Contribuinte', 'Data Abertura', 'Situação', 'Tipo de Solicitação', 'Dias Atraso']
+XLSX_COLUMN_WIDTHS = [18, 35, 15, 20, 40, 14]
+
+_CELL = {'border': 1, 'border_color': '#D0D5DD', 'font_size': 10, 'valign': 'vcenter'}
+_STATUS_CELL = dict(_CELL, align='center')
+
+
+def export_rows(query, only_delayed: bool = False, batch_size: int = EXPORT_BATCH_SIZE, columns=EXPORT_COLUMNS):
+    """Tuples of `columns` for a filtered process query, in list order, streamed from the cursor."""
+    return (
+        query.order_by(*process_query.process_order(only_delayed))
+        .with_entities(*columns)
+        .yield_per(batch_size)
+    )
+
+
+def _batches(rows, batch_size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _status_formats(workbook):
+    def fmt(bg, fg):
+        return workbook.add_format(dict(_STATUS_CELL, bg_color=bg, font_color=fg))
+    green, red = fmt('#DCFCE7', '#166534'), fmt('#FEE2E2', '#991B1B')
+    blue, orange, gray = fmt('#DBEAFE', '#1E40AF'), fmt('#FFEDD5', '#9A3412'), fmt('#F3F4F6', '#374151')
+
+    cache = {}
+
+    def status_fmt(status_val):
+        # Few distinct statuses: resolve each one once
+        status = str(status_val)
+        if status not in cache:
+            if any(s in status for s in ['ENCERRAMENTO', 'DEFERIDO']):
+                cache[status] = green
+            elif any(s in status for s in ['INDEFERIDO', 'CANCELADO']):
+                cache[status] = red
+            elif status in ['ANDAMENTO', 'EM DILIGENCIA']:
+                cache[status] = blue
+            elif status in ['RETORNO', 'PENDENCIA', 'SUSPENSO']:
+                cache[status] = orange
+            else:
+                cache[status] = gray
+        return cache[status]
+    return status_fmt
+
+
+def write_xlsx(path: str, rows, total: int, filters_desc: list = None) -> int:
+    """
+    Write the formatted process workbook to `path` from an iterable of
+    EXPORT_COLUMNS tuples, in constant memory. Returns the rows written.
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'tmpdir': os.path.dirname(path)})
+    try:
+        worksheet = workbook.add_worksheet('Processos')
+
+        header_fmt = workbook.add_format({
+            'bold': True, 'font_color': '#FFFFFF', 'bg_color': '#1E3A5F',
+            'border': 1, 'border_color': '#B0BEC5', 'align': 'center',
+            'valign': 'vcenter', 'font_size': 11, 'text_wrap': True,
+        })
+        cell_fmt = workbook.add_format(_CELL)
+        cell_center_fmt = workbook.add_format(dict(_CELL, align='center'))
+        delay_fmt = workbook.add_format(dict(_CELL, align='right', bold=True, font_color='#DC2626'))
+        title_fmt = workbook.add_format({'bold': True, 'font_size': 14, 'font_color': '#1E3A5F'})
+        subtitle_fmt = workbook.add_format({'font_size': 10, 'font_color': '#64748B', 'italic': True})
+        status_fmt = _status_formats(workbook)
+
+        # constant_memory flushes each row once a later row is written: layout first
+        for col, width in enumerate(XLSX_COLUMN_WIDTHS):
+            worksheet.set_column(col, col, width)
+        worksheet.freeze_panes(4, 0)
+
+        worksheet.merge_range('A1:F1', 'Report Terra - Processos', title_fmt)
+        subtitle = f"Exportado em {datetime.now().strftime('%d/%m/%Y %H:%M')}"
+        if filters_desc:
+            subtitle += f" | Filtros: {', '.join(filters_desc)}"
+        subtitle += f" | Total: {total} registros"
+        worksheet.merge_range('A2:F2', subtitle, subtitle_fmt)
+
+        worksheet.set_row(3, 22)
+        for col, header in enumerate(XLSX_HEADERS):
+            worksheet.write_string(3, col, header, header_fmt)
+
+        write_string = worksheet.write_string
+        row_idx = 4
+        for proc_id, contribuinte, data_abertura, status, tipo, is_atrasado, dias_atraso in rows:
+            write_string(row_idx, 0, proc_id or '', cell_center_fmt)
+            write_string(row_idx, 1, contribuinte or '', cell_fmt)
+            write_string(row_idx, 2, data_abertura or '', cell_center_fmt)
+            write_string(row_idx, 3, status or '', status_fmt(status or ''))
+            write_string(row_idx, 4, tipo or '', cell_fmt)
+            if is_atrasado and dias_atraso:
+                write_string(row_idx, 5, f"{dias_atraso} dias", delay_fmt)
+            else:
+                write_string(row_idx, 5, '-', cell_center_fmt)
+            row_idx += 1
+    finally:
+        workbook.close()
+    return row_idx - 4
+
+
+def xlsx_export_file(base_query, filters: process_query.FilterSpec) -> str:
+    """Write the filtered export of a process query to a temp .xlsx file and return its path."""
+    fd, path = tempfile.mkstemp(prefix="report_terra_export_", suffix=".xlsx")
+    os.close(fd)
+    try:
+        write_file(path, "xlsx", base_query, filters)
+    except Exception:
+        remove_file(path)
+        raise
+    return path
+
+
+def iter_csv(rows, batch_size: int = EXPORT_BATCH_SIZE):
+    """CSV bytes (header first) of DATA_COLUMNS tuples, one chunk per batch."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(DATA_FIELDS)
+    for batch in _batches(rows, batch_size):
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        # Header only: no rows matched
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_ndjson(rows, batch_size: int = EXPORT_BATCH_SIZE):
+    """One JSON object per line for DATA_COLUMNS tuples, one chunk per batch."""
+    for batch in _batches(rows, batch_size):
+        lines = []
+        for row in batch:
+            record = dict(zip(DATA_FIELDS, row))
+            if record["data_abertura_date"] is not None:
+                record["data_abertura_date"] = record["data_abertura_date"].isoformat()
+            lines.append(json.dumps(record, ensure_ascii=False))
+        lines.append("")
+        yield "\n".join(lines).encode("utf-8")
+
+
+class _ChunkSink:
+    """Write-only file object whose written bytes are drained by the caller."""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_schema():
+    return pa.schema([
+        ("id", pa.string()), ("contribuinte", pa.string()), ("data_abertura", pa.string()),
+        ("data_abertura_date", pa.date32()), ("ano", pa.string()), ("status", pa.string()),
+        ("setor_atual", pa.string()), ("tipo_solicitacao", pa.string()), ("dias_atraso_pdf", pa.int32()),
+        ("dias_atraso_calc", pa.int32()), ("is_atrasado", pa.bool_()),
+    ])
+
+
+def iter_parquet(rows, batch_size: int = EXPORT_BATCH_SIZE):
+    """Parquet bytes of DATA_COLUMNS tuples: one row group per batch, streamed as written."""
+    if pq is None:
+        raise RuntimeError("pyarrow is not installed")
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        for batch in _batches(rows, batch_size):
+            columns = list(zip(*batch))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema,
+            ))
+            yield sink.drain()
+    finally:
+        writer.close()
+    # Footer (and the schema, if no rows matched)
+    yield sink.drain()
+
+
+# format -> (encoder, media type, file extension)
+EXPORT_FORMATS = {
+    "csv": (iter_csv, "text/csv; charset=utf-8", "csv"),
+    "ndjson": (iter_ndjson, "application/x-ndjson", "ndjson"),
+    "parquet": (iter_parquet, "application/vnd.apache.parquet", "parquet"),
+}
+
+
+def format_available(fmt: str) -> bool:
+    return fmt in EXPORT_FORMATS and (fmt != "parquet" or pq is not None)
+
+
+def file_extension(fmt: str) -> str:
+    return "xlsx" if fmt == "xlsx" else EXPORT_FORMATS[fmt][2]
+
+
+def write_file(path: str, fmt: str, base_query, filters: process_query.FilterSpec, track=None) -> int:
+    """
+    Write the filtered export of a process query to `path` as `fmt` ("xlsx" or
+    an EXPORT_FORMATS key). `track`, if given, wraps the row iterator (e.g. to
+    report progress). Returns the rows written.
+    """
+    query = filters.apply(base_query)
+    only_delayed = filters.only_delayed
+    written = 0
+
+    def counted(rows):
+        nonlocal written
+        for row in rows:
+            written += 1
+            yield row
+
+    if fmt == "xlsx":
+        rows = counted(export_rows(query, only_delayed))
+        write_xlsx(path, track(rows) if track else rows, process_query.count_processes(query), filters.describe())
+    else:
+        rows = counted(export_rows(query, only_delayed, columns=DATA_COLUMNS))
+        with open(path, "wb") as fh:
+            for chunk in EXPORT_FORMATS[fmt][0](track(rows) if track else rows):
+                fh.write(chunk)
+    return written
+
+
+def remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,48 @@
+"""
+process_frame.py
+Typed DataFrame loader for Process rows.
+
+A plain `pd.read_sql` of processes gives every text column as Python object
+strings and every counter as int64, although status, tipo_solicitacao,
+setor_atual, ano and month_year only have a few dozen distinct values:
+  - Only FRAME_COLUMNS are read (ingest bookkeeping such as row_hash and the
+    autocomplete keys stays in the database)
+  - Low-cardinality text columns become categoricals
+  - Day counters are downcast to the smallest integer width that holds them
+  - is_atrasado is bool, and the opening date is datetime64 in 'dt'
+
+Categorical value_counts() also lists categories with no rows left after a
+filter; drop zero counts (or use observed=True when grouping).
+See scripts/report_frame_memory.py for bytes per row before and after.
+"""
+
+import pandas as pd
+
+from models import Process
+
+# Read per row, in this order ('data_abertura_date' is returned as 'dt')
+FRAME_COLUMNS = [
+    Process.id, Process.contribuinte, Process.data_abertura, Process.data_abertura_date,
+    Process.month_year, Process.ano, Process.status, Process.setor_atual, Process.tipo_solicitacao,
+    Process.dias_atraso_pdf, Process.dias_atraso_calc, Process.is_atrasado, Process.search_text,
+]
+
+CATEGORY_COLUMNS = ["month_year", "ano", "status", "setor_atual", "tipo_solicitacao"]
+INTEGER_COLUMNS = ["dias_atraso_pdf", "dias_atraso_calc"]
+
+
+def typed_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Apply the compact dtypes to a frame of FRAME_COLUMNS (in place; returns it)."""
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype("category")
+    for col in INTEGER_COLUMNS:
+        df[col] = pd.to_numeric(df[col].fillna(0), downcast="integer")
+    df["is_atrasado"] = df["is_atrasado"].fillna(False).astype(bool)
+    df["dt"] = pd.to_datetime(df.pop("data_abertura_date"))
+    return df
+
+
+def load_processes(query, bind) -> pd.DataFrame:
+    """FRAME_COLUMNS of a Process query as a typed DataFrame."""
+    df = pd.read_sql(query.with_entities(*FRAME_COLUMNS).statement, bind)
+    return typed_frame(df)
@@ -4,6 +4,8 @@ import os
 from datetime import datetime, timedelta
 import logging
 import unicodedata
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from tipo_resolver import resolve_tipo
 
 # Disable verbose pdfminer logs
@@ -23,9 +25,128 @@ try:
 except ValueError:
     DELAY_THRESHOLD_DAYS = 30
 
-def parse_pdf(pdf_path, progress_callback=None, cancel_check=None):
+# Page-level parallelism: 0 = one worker per CPU, 1 = serial (single process)
+try:
+    PDF_PARSE_WORKERS = int(os.getenv("PDF_PARSE_WORKERS", "0"))
+except ValueError:
+    PDF_PARSE_WORKERS = 0
+
+# Pages handed to a worker at a time (smaller = smoother progress / faster cancel)
+PAGES_PER_CHUNK = 20
+
+# Below this page count the process pool start-up costs more than it saves
+PARALLEL_MIN_PAGES = 40
+
+# Bump whenever extraction output changes, so cached parses (parse_cache) are not reused
+PARSER_VERSION = "1"
+
+STATUS_KEYWORDS = [
+    "ANDAMENTO", "ENCERRAMENTO", "DEFERIDO", "INDEFERIDO",
+    "SUSPENSO", "CANCELADO", "RETORNO", "EM DILIGENCIA", "PENDENCIA", "AGUARDANDO PAGAMENTO"
+]
+
+# Column X boundaries derived from PDF header row bounding-box analysis
+# Actual word positions observed:
+#   Status words (ANDAMENTO etc): x ~ 389.0
+#   NUCLEO (start of Setor Atual): x ~ 485.4
+#   First word of Tipo:            x ~ 581.7 (varies by content)
+COL_ID_END      = 85
+COL_CONTRIB_END = 213
+COL_DATAS_END   = 388   # Status starts at x=389, so cut before it
+COL_STATUS_END  = 484   # NUCLEO starts at x=485.4, cut before it
+COL_SETOR_END   = 580   # Tipo starts at x=581.7 or higher
+COL_TIPO_END    = 676
+COL_TITULO_END  = 772
+
+# Group words into logical rows using a tolerance of 6px.
+# Some PDFs render words of the same row at slightly different
+# vertical positions (e.g. top=139 vs top=140 for ID vs CPF),
+# so a simple round() would split them into separate rows.
+ROW_TOLERANCE = 6
+
+DATE_RE = re.compile(r"\d{2}/\d{2}/\d{4}")
+
+
+def compute_delay(status, entry_date):
+    """Return (is_atrasado, dias_atraso_calc) for a process as of today."""
+    if not entry_date:
+        return False, 0
+    days_since_entry = (datetime.now() - entry_date).days
+    if status == "ANDAMENTO" and days_since_entry > DELAY_THRESHOLD_DAYS:
+        return True, days_since_entry - DELAY_THRESHOLD_DAYS
+    return False, 0
+
+
+def refresh_delay(record):
+    """Recompute the date-dependent delay fields of a stored record (e.g. from parse_cache)."""
+    entry_date = None
+    if record.get("data_abertura"):
+        try:
+            entry_date = datetime.strptime(record["data_abertura"], "%d/%m/%Y")
+        except Exception:
+            pass
+    record["is_atrasado"], record["dias_atraso_calc"] = compute_delay(record["status"], entry_date)
+    return record
+
+
+def resolve_workers(workers=None):
+    """Return the effective worker count for `workers` (None = PDF_PARSE_WORKERS)."""
+    if workers is None:
+        workers = PDF_PARSE_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+# Sorted boundary vector: bisect_right(COL_BOUNDARIES, x0) is the column index
+COL_BOUNDARIES = [
+    COL_ID_END, COL_CONTRIB_END, COL_DATAS_END, COL_STATUS_END,
+    COL_SETOR_END, COL_TIPO_END, COL_TITULO_END,
+]
+
+
+def cluster_rows(words, tolerance=ROW_TOLERANCE):
     """
-    Parse a Sistema Terra PDF report using bounding-box column detection.
+    Group words into rows in one sweep over the words sorted by `top`.
+
+    A word joins the current row when it is within `tolerance` of the row's
+    representative top (its first word); otherwise it starts a new row.
+    Representative tops of consecutive rows are always more than
+    `tolerance` apart, so only the last row can ever match, and rows come
+    out already ordered top to bottom.
+    """
+    rows = []
+    row_top = None
+    current = None
+    for w in sorted(words, key=lambda w: w["top"]):
+        if current is not None and abs(w["top"] - row_top) <= tolerance:
+            current.append(w)
+        else:
+            row_top = w["top"]
+            current = [w]
+            rows.append(current)
+    return rows
+
+
+def assign_columns(row_words):
+    """Split a row's words (left to right) into one text list per PDF column."""
+    columns = [[] for _ in range(len(COL_BOUNDARIES) + 1)]
+    for w in sorted(row_words, key=lambda w: w["x0"]):
+        columns[bisect_right(COL_BOUNDARIES, w["x0"])].append(w["text"])
+    return columns
+
+
+def _parse_page(page):
+    """Extract process records from a single pdfplumber page."""
+    words = page.extract_words(x_tolerance=3, y_tolerance=5)
+    if not words:
+        return []
+    return parse_words(words)
+
+
+def parse_words(words):
+    """
+    Build process records from the words of one page (pdfplumber extract_words).
 
     PDF Column X boundaries (confirmed from header row via extract_words):
       ID         : x < 85
@@ -39,31 +160,121 @@ def parse_pdf(pdf_path, progress_callback=None, cancel_check=None):
     """
     processes = []
 
-    STATUS_KEYWORDS = [
-        "ANDAMENTO", "ENCERRAMENTO", "DEFERIDO", "INDEFERIDO",
-        "SUSPENSO", "CANCELADO", "RETORNO", "EM DILIGENCIA", "PENDENCIA", "AGUARDANDO PAGAMENTO"
-    ]
-
-    # Column X boundaries derived from PDF header row bounding-box analysis
-    # Actual word positions observed:
-    #   Status words (ANDAMENTO etc): x ~ 389.0
-    #   NUCLEO (start of Setor Atual): x ~ 485.4
-    #   First word of Tipo:            x ~ 581.7 (varies by content)
-    COL_ID_END      = 85
-    COL_CONTRIB_END = 213
-    COL_DATAS_END   = 388   # Status starts at x=389, so cut before it
-    COL_STATUS_END  = 484   # NUCLEO starts at x=485.4, cut before it
-    COL_SETOR_END   = 580   # Tipo starts at x=581.7 or higher
-    COL_TIPO_END    = 676
-    COL_TITULO_END  = 772
+    for row_words in cluster_rows(words):
+        # Assign each word to its column based on x0 position
+        (col_id, col_contrib, col_datas, col_status,
+         col_setor_at, col_tipo, col_titulo, col_dias) = assign_columns(row_words)
+
+        id_text = " ".join(col_id).strip()
+
+        # Only process rows that are data rows (ID starts with digit)
+        if not id_text or not id_text[0].isdigit():
+            continue
+
+        # --- Clean contribuinte tokens contaminated with date ---
+        # pdfplumber sometimes merges last name word with date, e.g. "PAS13/02/2026"
+        # We strip any trailing date pattern from each contribuinte token.
+        cleaned_contrib = []
+        for token in col_contrib:
+            m = DATE_RE.search(token)
+            if m:
+                # keep only the part before the date
+                clean = token[:m.start()].strip()
+                if clean:
+                    cleaned_contrib.append(clean)
+            else:
+                cleaned_contrib.append(token)
+
+        # Reconstruct fields
+        contribuinte = " ".join(cleaned_contrib).strip()
+
+        datas_text   = " ".join(col_datas).strip()
+        status_raw   = " ".join(col_status).strip()
+        setor_atual  = " ".join(col_setor_at).strip()
+        tipo_raw     = " ".join(col_tipo).strip()
+        dias_text    = " ".join(col_dias).strip()
+
+        # Normalize status keyword
+        status = "DESCONHECIDO"
+        for kw in STATUS_KEYWORDS:
+            if kw in status_raw.upper():
+                status = kw
+                break
+
+        # Parse opening date (first date in the dates column)
+        entry_date_str = ""
+        entry_date = None
+        date_match = re.search(r"(\d{2}/\d{2}/\d{4})", datas_text)
+        if date_match:
+            entry_date_str = date_match.group(1)
+            try:
+                entry_date = datetime.strptime(entry_date_str, "%d/%m/%Y")
+            except Exception:
+                pass
+
+        # Parse year from ID (e.g. "001157 - 2026")
+        ano = ""
+        proc_id = id_text
+        id_match = re.match(r"(\d+)\s*-\s*(\d{4})", proc_id)
+        if id_match:
+            ano = id_match.group(2)
+            proc_id = f"{id_match.group(1)} - {id_match.group(2)}"
+
+        # Parse days delay from dias column
+        days_delay_pdf = 0
+        if dias_text:
+            try:
+                days_delay_pdf = int(dias_text.strip())
+            except Exception:
+                pass
+
+        # Resolve tipo_solicitacao against canonical reference list
+        tipo_solicitacao = resolve_tipo(tipo_raw.strip()) if tipo_raw else ""
 
+        # Calculate delay
+        is_delayed, dias_atraso_calc = compute_delay(status, entry_date)
 
+        processes.append({
+            "id": proc_id,
+            "contribuinte": contribuinte,
+            "data_abertura": entry_date_str,
+            "ano": ano,
+            "status": status,
+            "setor_atual": setor_atual,
+            "tipo_solicitacao": tipo_solicitacao,
+            "dias_atraso_pdf": days_delay_pdf,
+            "dias_atraso_calc": dias_atraso_calc,
+            "is_atrasado": is_delayed
+        })
+
+    # tipo_solicitacao is already resolved and preserved in canonical form by resolve_tipo
+
+    return processes
+
+
+def _parse_page_range(pdf_path, start, stop):
+    """Worker entry point: open the PDF independently and parse pages [start, stop)."""
+    processes = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages[start:stop]:
+            processes.extend(_parse_page(page))
+            # Free memory used by this page data to prevent OOM on large PDFs
+            page.flush_cache()
+    return processes
+
+
+def _count_pages(pdf_path):
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def _iter_serial(pdf_path, progress_callback=None, cancel_check=None):
     with pdfplumber.open(pdf_path) as pdf:
         total_pages = len(pdf.pages)
         for page_idx, page in enumerate(pdf.pages):
             # Check for cancellation before processing each page
             if cancel_check and cancel_check():
-                return processes
+                return
 
             if progress_callback:
                 try:
@@ -71,154 +282,91 @@ def parse_pdf(pdf_path, progress_callback=None, cancel_check=None):
                 except Exception:
                     pass
 
-            words = page.extract_words(x_tolerance=3, y_tolerance=5)
-            if not words:
-                continue
-
-            # Group words into logical rows using a tolerance of 6px.
-            # Some PDFs render words of the same row at slightly different
-            # vertical positions (e.g. top=139 vs top=140 for ID vs CPF),
-            # so a simple round() would split them into separate rows.
-            ROW_TOLERANCE = 6
-            row_groups = []   # list of (representative_top, [words])
-            for w in sorted(words, key=lambda w: w["top"]):
-                placed = False
-                for grp in row_groups:
-                    if abs(w["top"] - grp[0]) <= ROW_TOLERANCE:
-                        grp[1].append(w)
-                        placed = True
-                        break
-                if not placed:
-                    row_groups.append((w["top"], [w]))
-
-            for _, row_words_unsorted in sorted(row_groups, key=lambda g: g[0]):
-                row_words = sorted(row_words_unsorted, key=lambda w: w["x0"])
-
-                # Assign each word to its column based on x0 position
-                col_id       = []
-                col_contrib  = []
-                col_datas    = []
-                col_status   = []
-                col_setor_at = []
-                col_tipo     = []
-                col_titulo   = []
-                col_dias     = []
-
-                for w in row_words:
-                    x = w["x0"]
-                    t = w["text"]
-                    if x < COL_ID_END:
-                        col_id.append(t)
-                    elif x < COL_CONTRIB_END:
-                        col_contrib.append(t)
-                    elif x < COL_DATAS_END:
-                        col_datas.append(t)
-                    elif x < COL_STATUS_END:
-                        col_status.append(t)
-                    elif x < COL_SETOR_END:
-                        col_setor_at.append(t)
-                    elif x < COL_TIPO_END:
-                        col_tipo.append(t)
-                    elif x < COL_TITULO_END:
-                        col_titulo.append(t)
-                    else:
-                        col_dias.append(t)
-
-                id_text = " ".join(col_id).strip()
-
-                # Only process rows that are data rows (ID starts with digit)
-                if not id_text or not id_text[0].isdigit():
-                    continue
-
-                # --- Clean contribuinte tokens contaminated with date ---
-                # pdfplumber sometimes merges last name word with date, e.g. "PAS13/02/2026"
-                # We strip any trailing date pattern from each contribuinte token.
-                DATE_RE = re.compile(r"\d{2}/\d{2}/\d{4}")
-                cleaned_contrib = []
-                for token in col_contrib:
-                    m = DATE_RE.search(token)
-                    if m:
-                        # keep only the part before the date
-                        clean = token[:m.start()].strip()
-                        if clean:
-                            cleaned_contrib.append(clean)
-                    else:
-                        cleaned_contrib.append(token)
-
-                # Reconstruct fields
-                contribuinte = " ".join(cleaned_contrib).strip()
-
-                datas_text   = " ".join(col_datas).strip()
-                status_raw   = " ".join(col_status).strip()
-                setor_atual  = " ".join(col_setor_at).strip()
-                tipo_raw     = " ".join(col_tipo).strip()
-                dias_text    = " ".join(col_dias).strip()
-
-                # Normalize status keyword
-                status = "DESCONHECIDO"
-                for kw in STATUS_KEYWORDS:
-                    if kw in status_raw.upper():
-                        status = kw
-                        break
-
-                # Parse opening date (first date in the dates column)
-                entry_date_str = ""
-                entry_date = None
-                date_match = re.search(r"(\d{2}/\d{2}/\d{4})", datas_text)
-                if date_match:
-                    entry_date_str = date_match.group(1)
-                    try:
-                        entry_date = datetime.strptime(entry_date_str, "%d/%m/%Y")
-                    except Exception:
-                        pass
+            yield from _parse_page(page)
 
-                # Parse year from ID (e.g. "001157 - 2026")
-                ano = ""
-                proc_id = id_text
-                id_match = re.match(r"(\d+)\s*-\s*(\d{4})", proc_id)
-                if id_match:
-                    ano = id_match.group(2)
-                    proc_id = f"{id_match.group(1)} - {id_match.group(2)}"
-
-                # Parse days delay from dias column
-                days_delay_pdf = 0
-                if dias_text:
+            # Free memory used by this page data to prevent OOM on large PDFs
+            page.flush_cache()
+
+
+def _iter_parallel(pdf_path, total_pages, workers, progress_callback=None, cancel_check=None, executor=None):
+    chunks = [(start, min(start + PAGES_PER_CHUNK, total_pages))
+              for start in range(0, total_pages, PAGES_PER_CHUNK)]
+    # Only keep a few chunks in flight so finished-but-unconsumed results stay bounded
+    max_in_flight = workers * 2
+    results = {}
+    pending = {}
+    next_submit = 0
+    next_yield = 0
+    pages_done = 0
+
+    # A shared executor (see ingest_queue) is left running; only our own chunks are cancelled
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=min(workers, len(chunks)))
+    try:
+        while next_yield < len(chunks):
+            if cancel_check and cancel_check():
+                return
+
+            while next_submit < len(chunks) and len(pending) + len(results) < max_in_flight:
+                start, stop = chunks[next_submit]
+                pending[executor.submit(_parse_page_range, pdf_path, start, stop)] = next_submit
+                next_submit += 1
+
+            done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx = pending.pop(future)
+                results[idx] = future.result()
+                start, stop = chunks[idx]
+                pages_done += stop - start
+                if progress_callback:
                     try:
-                        days_delay_pdf = int(dias_text.strip())
+                        progress_callback(pages_done, total_pages)
                     except Exception:
                         pass
 
-                # Resolve tipo_solicitacao against canonical reference list
-                tipo_solicitacao = resolve_tipo(tipo_raw.strip()) if tipo_raw else ""
-
-                # Calculate delay
-                is_delayed = False
-                days_since_entry = 0
-                if entry_date:
-                    delta = datetime.now() - entry_date
-                    days_since_entry = delta.days
-                    if status == "ANDAMENTO" and days_since_entry > DELAY_THRESHOLD_DAYS:
-                        is_delayed = True
-
-                processes.append({
-                    "id": proc_id,
-                    "contribuinte": contribuinte,
-                    "data_abertura": entry_date_str,
-                    "ano": ano,
-                    "status": status,
-                    "setor_atual": setor_atual,
-                    "tipo_solicitacao": tipo_solicitacao,
-                    "dias_atraso_pdf": days_delay_pdf,
-                    "dias_atraso_calc": days_since_entry - DELAY_THRESHOLD_DAYS if is_delayed else 0,
-                    "is_atrasado": is_delayed
-                })
-            
-            # Free memory used by this page data to prevent OOM on large PDFs
-            page.flush_cache()
+            # Emit finished chunks in page order
+            while next_yield in results:
+                yield from results.pop(next_yield)
+                next_yield += 1
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            for future in pending:
+                future.cancel()
 
-    # tipo_solicitacao is already resolved and preserved in canonical form by resolve_tipo
 
-    return processes
+def iter_parse_pdf(pdf_path, progress_callback=None, cancel_check=None, workers=None, executor=None):
+    """
+    Parse a Sistema Terra PDF report, yielding process records page by page.
+
+    Pages are split into chunks of PAGES_PER_CHUNK and parsed by a pool of
+    `workers` processes (default: PDF_PARSE_WORKERS); records are always
+    yielded in page order. Small PDFs and workers=1 are parsed serially
+    in-process. Iteration stops early when `cancel_check()` returns True.
+
+    When a ProcessPoolExecutor is passed in `executor`, every PDF (whatever
+    its size) is parsed by that pool and `workers` only bounds how many
+    chunks are kept in flight.
+    """
+    workers = resolve_workers(workers)
+    if executor is not None:
+        total_pages = _count_pages(pdf_path)
+        if total_pages:
+            yield from _iter_parallel(pdf_path, total_pages, workers, progress_callback, cancel_check, executor)
+        return
+    if workers > 1:
+        total_pages = _count_pages(pdf_path)
+        if total_pages >= PARALLEL_MIN_PAGES:
+            yield from _iter_parallel(pdf_path, total_pages, workers, progress_callback, cancel_check)
+            return
+    yield from _iter_serial(pdf_path, progress_callback, cancel_check)
+
+
+def parse_pdf(pdf_path, progress_callback=None, cancel_check=None, workers=None):
+    """Parse a Sistema Terra PDF report and return all records as a list (see iter_parse_pdf)."""
+    return list(iter_parse_pdf(pdf_path, progress_callback, cancel_check, workers))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,237 @@
+"""
+process_query.py
+SQL building blocks for the process list endpoints.
+
+Filters, ordering and pagination are pushed down to the database, so the
+cost of a page depends on the page size and not on the size of the
+user's dataset:
+  - FilterSpec parses the query-string filters (search, type, status, date
+    range, only_delayed) once per request and compiles them into a WHERE
+    clause (search goes through the full-text index, process_search.py), a
+    boolean mask over a process_frame DataFrame, or a normalized cache key;
+    every endpoint that filters processes goes through it
+  - process_order returns the ORDER BY of the list (opening date, or delay
+    days when only delayed processes are shown), with pk as tiebreaker
+  - The total comes from a separate COUNT over the same WHERE clause
+  - Keyset mode: an opaque cursor carries the last row's (sort key, pk), so
+    the next page is an index seek past it instead of an ever-deeper OFFSET.
+    Rows with a sort key are paged first with a row-value range
+    ((key, pk) < cursor), then the ones without it (NULLS LAST) by pk alone;
+    a cursor with a null key is in that second phase, so each query is a
+    single range scan
+"""
+
+import base64
+import json
+from datetime import date
+from typing import List, Optional
+
+import pandas as pd
+from sqlalchemy import func, tuple_
+
+from models import Process
+import process_search
+
+
+def split_param(value: Optional[str]) -> List[str]:
+    """Comma-separated query parameter -> list of stripped, non-empty values."""
+    if not value:
+        return []
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+def parse_date_param(value: Optional[str]) -> Optional[date]:
+    """Parse a start_date / end_date parameter (ValueError if invalid)."""
+    if not value:
+        return None
+    parsed = pd.to_datetime(value, errors="coerce")
+    if pd.isna(parsed):
+        raise ValueError(f"Data inválida: {value}")
+    return parsed.date()
+
+
+class FilterSpec:
+    """
+    The process filters of one request, parsed and normalized: status and
+    tipo lists are sorted and de-duplicated, dates are parsed (ValueError if
+    invalid) and the search term is normalized like processes.search_text.
+    """
+
+    __slots__ = ("search", "term", "types", "statuses", "start", "end", "only_delayed")
+
+    def __init__(
+        self,
+        search: Optional[str] = None,
+        type_filter: Optional[str] = None,
+        status_filter: Optional[str] = None,
+        start_date: Optional[str] = None,
+        end_date: Optional[str] = None,
+        only_delayed: bool = False,
+    ):
+        self.search = search or None
+        # A search left empty by normalization (e.g. only spaces) filters nothing
+        self.term = process_search.normalize_term(search) if search else ""
+        self.types = tuple(sorted(set(split_param(type_filter))))
+        self.statuses = tuple(sorted(set(split_param(status_filter))))
+        self.start = parse_date_param(start_date)
+        self.end = parse_date_param(end_date)
+        self.only_delayed = bool(only_delayed)
+
+    def __repr__(self) -> str:
+        return f"FilterSpec{self.key()}"
+
+    def key(self) -> tuple:
+        """Hashable normalized form: equivalent query strings give equal keys."""
+        return (
+            self.term, self.types, self.statuses,
+            self.start.isoformat() if self.start else None,
+            self.end.isoformat() if self.end else None,
+            self.only_delayed,
+        )
+
+    def params(self) -> dict:
+        """Query-string parameters that rebuild this spec (JSON-serializable)."""
+        return {
+            "search": self.search,
+            "type_filter": ",".join(self.types) or None,
+            "status_filter": ",".join(self.statuses) or None,
+            "start_date": self.start.isoformat() if self.start else None,
+            "end_date": self.end.isoformat() if self.end else None,
+            "only_delayed": self.only_delayed,
+        }
+
+    def describe(self) -> List[str]:
+        """Human-readable summary, e.g. for export headers."""
+        desc = []
+        if self.start or self.end:
+            fmt = lambda d: d.strftime("%d/%m/%Y") if d else None
+            desc.append(f"Período: {fmt(self.start) or 'Início'} a {fmt(self.end) or 'Fim'}")
+        if self.statuses:
+            desc.append(f"Situação: {', '.join(self.statuses)}")
+        if self.types:
+            desc.append(f"Tipo: {', '.join(self.types)}")
+        if self.term:
+            desc.append(f"Busca: {self.search}")
+        if self.only_delayed:
+            desc.append("Apenas Atrasados")
+        return desc
+
+    def predicates(self) -> list:
+        """The filters as SQL predicates on Process."""
+        clauses = []
+        if self.statuses:
+            clauses.append(Process.status.in_(self.statuses))
+        if self.types:
+            clauses.append(Process.tipo_solicitacao.in_(self.types))
+        # Range scan on the typed column; rows without a valid opening date (NULL) never match
+        if self.start:
+            clauses.append(Process.data_abertura_date >= self.start)
+        if self.end:
+            clauses.append(Process.data_abertura_date <= self.end)
+        if self.only_delayed:
+            clauses.append(Process.is_atrasado == True)
+        if self.term:
+            # Accent- and case-insensitive, served by the full-text index (process_search.py)
+            clauses.append(process_search.search_condition(self.term))
+        return clauses
+
+    def apply(self, query):
+        """Add the filters to a Process query."""
+        clauses = self.predicates()
+        return query.filter(*clauses) if clauses else query
+
+    def mask(self, df: pd.DataFrame) -> pd.Series:
+        """The filters as a boolean mask over a process_frame DataFrame (same rows as the SQL)."""
+        mask = pd.Series(True, index=df.index)
+        if self.statuses:
+            mask &= df["status"].isin(self.statuses)
+        if self.types:
+            mask &= df["tipo_solicitacao"].isin(self.types)
+        # NaT (no valid opening date) never matches
+        if self.start:
+            mask &= df["dt"] >= pd.Timestamp(self.start)
+        if self.end:
+            mask &= df["dt"] <= pd.Timestamp(self.end)
+        if self.only_delayed:
+            mask &= df["is_atrasado"]
+        if self.term:
+            mask &= df["search_text"].fillna("").str.contains(self.term, regex=False)
+        return mask
+
+
+def sort_key(only_delayed: bool = False):
+    """Primary sort column of the process list (descending, NULLs last, pk breaks ties)."""
+    return Process.dias_atraso_calc if only_delayed else Process.data_abertura_date
+
+
+def process_order(only_delayed: bool = False) -> list:
+    """ORDER BY of the process list: most delayed first, or most recent first."""
+    return [sort_key(only_delayed).desc().nulls_last(), Process.pk.desc()]
+
+
+def encode_cursor(only_delayed: bool, key, pk: int) -> str:
+    """Opaque keyset cursor pointing after the row with sort key `key` and `pk`."""
+    if isinstance(key, date):
+        key = key.isoformat()
+    payload = json.dumps({"o": "delay" if only_delayed else "date", "k": key, "pk": pk}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, only_delayed: bool):
+    """(key, pk) of a cursor; ValueError if malformed or issued for the other ordering."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        order, key, pk = data["o"], data["k"], int(data["pk"])
+    except Exception:
+        raise ValueError("Cursor inválido.")
+    if order != ("delay" if only_delayed else "date"):
+        raise ValueError("Cursor não corresponde à ordenação atual.")
+    if key is not None and not only_delayed:
+        try:
+            key = date.fromisoformat(key)
+        except (TypeError, ValueError):
+            raise ValueError("Cursor inválido.")
+    return key, pk
+
+
+def keyset_page(query, cursor: Optional[str], limit: int, only_delayed: bool = False):
+    """One page of an ordered process query in keyset mode: (rows, next_cursor or None)."""
+    after = decode_cursor(cursor, only_delayed) if cursor else None
+    col = sort_key(only_delayed)
+    rows = []
+    if after is None or after[0] is not None:
+        keyed = query.filter(col.isnot(None))
+        if after is not None:
+            keyed = keyed.filter(tuple_(col, Process.pk) < tuple_(*after))
+        rows = keyed.order_by(col.desc(), Process.pk.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        # Keyed rows exhausted: continue with the NULL keys
+        unkeyed = query.filter(col.is_(None))
+        if after is not None and after[0] is None:
+            unkeyed = unkeyed.filter(Process.pk < after[1])
+        rows += unkeyed.order_by(Process.pk.desc()).limit(limit + 1 - len(rows)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(only_delayed, getattr(last, col.key), last.pk)
+    return rows, next_cursor
+
+
+def count_processes(query) -> int:
+    """COUNT(*) of a (filtered) process query, without its ORDER BY."""
+    return query.order_by(None).with_entities(func.count(Process.pk)).scalar() or 0
+
+
+# Fields of a process in /processes responses: the record as the frontend knows
+# it, without ingest bookkeeping (dataset_version, row_hash, search keys, ...)
+PROCESS_FIELDS = [
+    "pk", "id", "user_id", "contribuinte", "data_abertura", "ano", "status", "setor_atual",
+    "tipo_solicitacao", "dias_atraso_pdf", "dias_atraso_calc", "is_atrasado", "created_at", "updated_at",
+]
+
+
+def process_dict(process: Process) -> dict:
+    """Serialize a Process row as PROCESS_FIELDS."""
+    return {name: getattr(process, name) for name in PROCESS_FIELDS}
@@ -0,0 +1,212 @@
+"""
+process_search.py
+Accent-insensitive full-text search over id / contribuinte / tipo.
+
+`search` used to be a case-folded substring scan of three columns on every
+request, and "joao" never found "JOÃO":
+  - processes.search_text holds id, contribuinte and tipo_solicitacao run
+    through process_pdf.normalize_text (accents stripped, uppercase), written
+    once at ingest; search terms are normalized the same way
+  - SQLite: an FTS5 table with the trigram tokenizer (processes_fts, external
+    content over processes.search_text) answers substring queries of 3+
+    characters from the index. Deletes and updates are synced by triggers;
+    inserts are indexed set-wise by ingest.bulk_insert_processes
+    (index_new_rows), since a per-row FTS trigger triples the insert time
+  - PostgreSQL: a pg_trgm GIN index on search_text serves LIKE '%term%'
+  - Shorter terms, and databases where the index could not be created, fall
+    back to a LIKE scan of search_text (same results, no index)
+
+Prefix autocomplete (/processes/suggest):
+  - contribuinte_key (the taxpayer name without its leading document number)
+    and tipo_key hold normalized values, written at ingest
+  - process_suggestions holds each dataset's distinct keys with their
+    process counts (ingest.build_suggestions), so a lookup reads distinct
+    values, not processes
+  - A prefix is the key range [prefix, prefix with its last character
+    incremented): an index range scan, then the most frequent keys win
+  - Datasets uploaded before the table existed are answered from the
+    process rows (same result, slower) until their next upload
+"""
+
+import logging
+import re
+from collections import defaultdict
+
+from sqlalchemy import bindparam, func, text
+
+from database import engine
+from models import Process, ProcessSuggestion
+from process_pdf import normalize_text
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "processes_fts"
+PG_TRGM_INDEX = "ix_processes_search_trgm"
+
+# Trigram indexes need at least one full trigram in the term
+MIN_INDEXED_TERM = 3
+
+# Between the indexed fields, so a term never matches across two of them
+FIELD_SEPARATOR = "\x1f"
+
+# Process ids per INSERT ... SELECT when indexing new rows
+INDEX_CHUNK_SIZE = 500
+
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+# "123.456.789-00 - NAME" -> "NAME"
+_DOCUMENT_PREFIX = re.compile(r"^[\d./\s-]*\d[\d./\s]*-\s*")
+
+_SQLITE_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"search_text, content='processes', content_rowid='pk', tokenize='trigram')",
+    f"""CREATE TRIGGER IF NOT EXISTS processes_fts_ad AFTER DELETE ON processes BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.pk, old.search_text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS processes_fts_au AFTER UPDATE OF search_text ON processes BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.pk, old.search_text);
+        INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.pk, new.search_text);
+    END""",
+]
+
+# Set by ensure_search_index once the dialect's index is in place
+_index_ready = False
+
+
+def search_document(*fields) -> str:
+    """search_text of a row: its searchable fields, normalized and separated."""
+    return FIELD_SEPARATOR.join(normalize_text(f) if f else "" for f in fields)
+
+
+def normalize_term(term: str) -> str:
+    return normalize_text(term).replace(FIELD_SEPARATOR, "")
+
+
+def _fts_exists(conn) -> bool:
+    return conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+    ).first() is not None
+
+
+def index_new_rows(db, rows: list) -> None:
+    """
+    Add just-inserted process rows (see ingest.process_row) to the SQLite FTS
+    index, in the caller's transaction. Rows are found again through the
+    (user_id, dataset_version, id) unique key. No-op elsewhere.
+    """
+    if db.get_bind().dialect.name != "sqlite" or not rows or not _fts_exists(db):
+        return
+    ids = defaultdict(list)
+    for row in rows:
+        ids[(row["user_id"], row["dataset_version"])].append(row["id"])
+    stmt = text(
+        f"INSERT INTO {FTS_TABLE}(rowid, search_text) SELECT pk, search_text FROM processes "
+        "WHERE user_id = :user_id AND dataset_version = :version AND id IN :ids"
+    ).bindparams(bindparam("ids", expanding=True))
+    for (user_id, version), group in ids.items():
+        for start in range(0, len(group), INDEX_CHUNK_SIZE):
+            db.execute(stmt, {"user_id": user_id, "version": version, "ids": group[start:start + INDEX_CHUNK_SIZE]})
+
+
+def ensure_search_index(conn) -> None:
+    """Create the dialect's search index if missing (idempotent; commits)."""
+    global _index_ready
+    dialect = conn.dialect.name
+    try:
+        if dialect == "sqlite":
+            created = not _fts_exists(conn)
+            for ddl in _SQLITE_FTS_DDL:
+                conn.execute(text(ddl))
+            if created:
+                # Index the rows that existed before the table
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        elif dialect == "postgresql":
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(
+                f"CREATE INDEX IF NOT EXISTS {PG_TRGM_INDEX} ON processes USING gin (search_text gin_trgm_ops)"
+            ))
+        else:
+            return
+        conn.commit()
+        _index_ready = True
+    except Exception as e:
+        conn.rollback()
+        logger.warning(f"Search index unavailable on {dialect}, searches will scan search_text: {e}")
+
+
+def search_condition(search: str):
+    """WHERE clause matching processes whose id / contribuinte / tipo contains `search`."""
+    term = normalize_term(search)
+    if not term:
+        # Nothing searchable left after normalization (e.g. only spaces)
+        return Process.search_text.isnot(None)
+    if _index_ready and engine.dialect.name == "sqlite" and len(term) >= MIN_INDEXED_TERM:
+        phrase = '"' + term.replace('"', '""') + '"'
+        return Process.pk.in_(
+            text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :search_phrase")
+            .bindparams(search_phrase=phrase)
+        )
+    # PostgreSQL serves this from the pg_trgm index
+    return Process.search_text.contains(term, autoescape=True)
+
+
+def contribuinte_name(contribuinte) -> str:
+    """Taxpayer name of a contribuinte value, without the leading document number."""
+    return _DOCUMENT_PREFIX.sub("", contribuinte or "").strip()
+
+
+def contribuinte_key(contribuinte) -> str:
+    return normalize_term(contribuinte_name(contribuinte))
+
+
+def tipo_key(tipo) -> str:
+    return normalize_term(tipo or "")
+
+
+# field -> (key column, displayed column, display function)
+SUGGEST_FIELDS = {
+    "contribuinte": (Process.contribuinte_key, Process.contribuinte, contribuinte_name),
+    "tipo": (Process.tipo_key, Process.tipo_solicitacao, lambda v: v),
+}
+
+
+def prefix_upper_bound(prefix: str) -> str:
+    """Smallest string greater than every string starting with `prefix`."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _prefix_filter(query, key_col, prefix: str):
+    if prefix:
+        return query.filter(key_col >= prefix, key_col < prefix_upper_bound(prefix))
+    return query.filter(key_col.isnot(None), key_col != "")
+
+
+def suggest(base_query, field: str, q: str = "", limit: int = SUGGEST_LIMIT, index=None) -> list:
+    """
+    Most frequent values of `field` ("contribuinte" or "tipo") whose normalized
+    key starts with `q`: [{"value", "count"}], count desc then key. Pass
+    index=(db, user_id, dataset_version) to read process_suggestions.
+    """
+    key_col, value_col, display = SUGGEST_FIELDS[field]
+    prefix = normalize_term(q or "")
+
+    if index is not None:
+        db, user_id, dataset_version = index
+        keys = db.query(ProcessSuggestion).filter(
+            ProcessSuggestion.user_id == user_id, ProcessSuggestion.dataset_version == dataset_version
+        )
+        if db.query(keys.exists()).scalar():
+            rows = (
+                _prefix_filter(keys.filter(ProcessSuggestion.field == field), ProcessSuggestion.key, prefix)
+                .with_entities(ProcessSuggestion.key, ProcessSuggestion.value, ProcessSuggestion.count)
+                .order_by(ProcessSuggestion.count.desc(), ProcessSuggestion.key)
+                .limit(limit)
+                .all()
+            )
+            return [{"value": display(value), "count": count} for _, value, count in rows]
+
+    query = base_query.order_by(None).with_entities(key_col, func.min(value_col), func.count(Process.pk))
+    rows = _prefix_filter(query, key_col, prefix).group_by(key_col).all()
+    rows.sort(key=lambda r: (-r[2], r[0]))
+    return [{"value": display(value), "count": count} for _, value, count in rows[:limit]]
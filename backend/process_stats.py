@@ -0,0 +1,169 @@
+"""
+process_stats.py
+Dashboard aggregates (/stats) computed with SQL GROUP BY.
+
+Only aggregate rows leave the database, so the response cost depends on the
+number of months and request types, not on the number of processes:
+  - Filter options: DISTINCT status / tipo_solicitacao / month_year over the
+    user's whole dataset
+  - KPIs + by_month: one GROUP BY month_year with conditional SUM(CASE ...);
+    the KPIs are the sum over all groups (rows without a date included)
+  - by_type, by_type_delayed, by_type_closed_*: one GROUP BY tipo_solicitacao
+    with the same conditional sums, ranked in Python (count desc, type asc)
+
+The response has the same shape and numbers as the previous pandas version
+(scripts/check_stats_equivalence.py compares both).
+
+Stats cube (process_stats_cube):
+  - Counts by user × dataset_version × month × status × tipo × delayed,
+    built at the end of each upload (ingest.build_dataset_aggregates), so
+    it always matches the live rows
+  - compute_stats answers from the cube when the filters can be expressed
+    on its dimensions (no free-text search, date range aligned to whole
+    months); otherwise, or when the dataset has no cube yet, it aggregates
+    the process rows. Both paths run the same queries, weighted by `count`
+    on the cube
+"""
+
+import calendar
+from types import SimpleNamespace
+
+from sqlalchemy import case, func, literal, or_
+from sqlalchemy.orm import Session
+
+from models import Process, ProcessStatsCube
+import process_query
+
+TOP_N = 10
+
+# Statuses counted as closed (substring match, like the dashboard always did)
+CLOSED_STATUS_PATTERNS = ["ENCERRAMENTO", "DEFERIDO", "INDEFERIDO"]
+
+def closed_condition(status_col=Process.status):
+    status = func.upper(status_col)
+    return or_(*[status.like(f"%{p}%") for p in CLOSED_STATUS_PATTERNS])
+
+
+def _ranked(counts, top_n=TOP_N, ascending=False):
+    """[(type, count)] -> [{"type", "count"}] ordered by count (ties by type)."""
+    key = (lambda tc: (tc[1], tc[0])) if ascending else (lambda tc: (-tc[1], tc[0]))
+    return [{"type": t, "count": c} for t, c in sorted(counts, key=key)[:top_n]]
+
+
+# Columns the aggregation reads, for process rows and for cube cells
+_ROWS = SimpleNamespace(
+    status=Process.status, tipo=Process.tipo_solicitacao, month=Process.month_year,
+    delayed=Process.is_atrasado, weight=literal(1),
+)
+_CUBE = SimpleNamespace(
+    status=ProcessStatsCube.status, tipo=ProcessStatsCube.tipo_solicitacao,
+    month=ProcessStatsCube.month_year, delayed=ProcessStatsCube.is_atrasado,
+    weight=ProcessStatsCube.count,
+)
+
+
+def _aggregate(base_query, query, src) -> dict:
+    """Build the /stats payload; `query` is `base_query` with the filters applied."""
+    def distinct(col):
+        rows = base_query.with_entities(col).filter(col.isnot(None)).distinct().all()
+        return sorted(r[0] for r in rows)
+
+    def total():
+        return func.coalesce(func.sum(src.weight), 0)
+
+    def sum_if(condition):
+        return func.coalesce(func.sum(case((condition, src.weight), else_=0)), 0)
+
+    closed = closed_condition(src.status)
+    andamento = src.status == "ANDAMENTO"
+    delayed = src.delayed == True
+    query = query.order_by(None)
+
+    months = query.with_entities(
+        src.month, total(), sum_if(closed), sum_if(andamento), sum_if(delayed),
+    ).group_by(src.month).all()
+
+    by_month = [
+        {"month_year": m, "total": int(t), "encerrados": int(e), "andamento": int(a), "atrasados": int(d)}
+        for m, t, e, a, d in sorted((r for r in months if r[0] is not None), key=lambda r: r[0])
+    ]
+
+    types = query.with_entities(
+        src.tipo, total(), sum_if(closed), sum_if(delayed),
+    ).filter(src.tipo.isnot(None)).group_by(src.tipo).all()
+
+    closed_counts = [(t, int(c)) for t, _, c, _ in types if c]
+    return {
+        "total": sum(int(r[1]) for r in months),
+        "encerrados": sum(int(r[2]) for r in months),
+        "andamento": sum(int(r[3]) for r in months),
+        "atrasados": sum(int(r[4]) for r in months),
+        "by_month": by_month,
+        "by_type": _ranked([(t, int(n)) for t, n, _, _ in types if n]),
+        "by_type_delayed": _ranked([(t, int(d)) for t, _, _, d in types if d]),
+        "by_type_closed_top": _ranked(closed_counts),
+        "by_type_closed_bottom": _ranked(closed_counts, ascending=True),
+        "all_statuses": distinct(src.status),
+        "all_types": distinct(src.tipo),
+        "available_months": distinct(src.month),
+    }
+
+
+def cube_month_range(start=None, end=None):
+    """
+    (first_month, last_month) as "YYYY-MM" (None = open) when the date range
+    covers whole months; raises LookupError when it does not.
+    """
+    if start and start.day != 1:
+        raise LookupError("start_date is not the first day of a month")
+    if end and end.day != calendar.monthrange(end.year, end.month)[1]:
+        raise LookupError("end_date is not the last day of a month")
+    return (start.strftime("%Y-%m") if start else None, end.strftime("%Y-%m") if end else None)
+
+
+def _cube_query(db: Session, user_id: int, dataset_version: int):
+    return db.query(ProcessStatsCube).filter(
+        ProcessStatsCube.user_id == user_id, ProcessStatsCube.dataset_version == dataset_version
+    )
+
+
+def _cube_stats(db, user_id, dataset_version, filters: process_query.FilterSpec):
+    """Stats from the cube, or None if the filters are not cube-expressible or there is no cube."""
+    if filters.term:
+        return None
+    try:
+        first_month, last_month = cube_month_range(filters.start, filters.end)
+    except LookupError:
+        return None
+
+    base = _cube_query(db, user_id, dataset_version)
+    if not db.query(base.exists()).scalar():
+        return None
+
+    query = base
+    if filters.statuses:
+        query = query.filter(ProcessStatsCube.status.in_(filters.statuses))
+    if filters.types:
+        query = query.filter(ProcessStatsCube.tipo_solicitacao.in_(filters.types))
+    # Same as the row path: rows without a date never match a date range
+    if first_month:
+        query = query.filter(ProcessStatsCube.month_year >= first_month)
+    if last_month:
+        query = query.filter(ProcessStatsCube.month_year <= last_month)
+    if filters.only_delayed:
+        query = query.filter(ProcessStatsCube.is_atrasado == True)
+    return _aggregate(base, query, _CUBE)
+
+
+def compute_stats(base_query, filters: process_query.FilterSpec, cube=None) -> dict:
+    """
+    The /stats payload for `base_query` (the user's live dataset) and the given
+    filters. Pass cube=(db, user_id, dataset_version) to answer from the stats
+    cube when possible.
+    """
+    if cube is not None:
+        stats = _cube_stats(*cube, filters)
+        if stats is not None:
+            return stats
+    return _aggregate(base_query, filters.apply(base_query), _ROWS)
+
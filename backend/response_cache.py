@@ -0,0 +1,146 @@
+"""
+response_cache.py
+Process-local cache of rendered /stats and /processes responses.
+
+The dashboard repeats the same requests on every navigation:
+  - Responses are cached by (endpoint, user, users.dataset_revision,
+    normalized query parameters); the revision changes with the live
+    dataset, so an entry can never outlive the data it was computed from
+  - Equivalent query strings share an entry: the process filters are keyed
+    by process_query.FilterSpec.key() (lists sorted and de-duplicated, dates
+    parsed, search normalized), other parameters drop their defaults
+  - Every response carries a strong ETag (hash of the exact body bytes);
+    a matching If-None-Match is answered with 304 from the cache, without
+    running the endpoint's queries
+  - Bounded to RESPONSE_CACHE_MB of bodies, least recently used first;
+    the ingest job and /clear drop the user's entries right away
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+try:
+    RESPONSE_CACHE_MB = max(0, int(os.getenv("RESPONSE_CACHE_MB", "32")))
+except ValueError:
+    RESPONSE_CACHE_MB = 32
+
+# Clients must revalidate, but may keep the body and send If-None-Match
+CACHE_CONTROL = "private, no-cache"
+
+
+def normalize_params(params: dict) -> tuple:
+    """Canonical, hashable form of an endpoint's query parameters other than the filters."""
+    normalized = []
+    for name, value in sorted(params.items()):
+        if name == "cursor":
+            # An empty cursor (first keyset page) differs from no cursor (page mode)
+            if value is not None:
+                normalized.append((name, value))
+            continue
+        if value is None or value == "" or value is False:
+            continue
+        normalized.append((name, value))
+    return tuple(normalized)
+
+
+def render(payload) -> bytes:
+    """JSON body exactly as FastAPI would have rendered `payload`."""
+    return JSONResponse(content=jsonable_encoder(payload)).body
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+class ResponseCache:
+    """LRU of key -> (etag, body) within a byte budget; keys start with (endpoint, user_id)."""
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body: bytes):
+        entry = (make_etag(body), body)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            if len(body) > self.max_bytes:
+                return entry
+            self._entries[key] = entry
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, user_id: int) -> None:
+        """Drop every cached response of the user."""
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == user_id]:
+                self._bytes -= len(self._entries.pop(key)[1])
+
+    def respond(self, request, endpoint: str, user_id: int, revision: int, params: dict, compute,
+                filters=None) -> Response:
+        """
+        Serve `endpoint` for these parameters and process_query.FilterSpec from
+        the cache, calling compute() (which returns the payload) on a miss.
+        Errors raised by compute() are not cached.
+        """
+        key = (endpoint, user_id, revision, filters.key() if filters is not None else (), normalize_params(params))
+        entry = self.get(key)
+        if entry is None:
+            entry = self.put(key, render(compute()))
+        etag, body = entry
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            with self._lock:
+                self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+responses = ResponseCache()
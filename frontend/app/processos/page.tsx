@@ -1,7 +1,7 @@
 "use client";
 
 import { useState, useEffect, useRef } from 'react';
-import { uploadPDF, getStats, getProcesses, exportExcel, clearRecords, PaginatedProcesses, getUploadStatus, KPIStats, cancelUpload } from '@/lib/api';
+import { uploadPDF, getStats, getProcesses, exportExcel, clearRecords, PaginatedProcesses, getUploadStatus, KPIStats, cancelUpload, openUploadEvents, UploadStatus } from '@/lib/api';
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import { Upload, RefreshCw, AlertCircle, Check, ListFilter, Loader2, Search, Download, FilterX, TableProperties, Trash2, ChevronsLeft, ChevronsRight, X } from 'lucide-react';
@@ -36,6 +36,8 @@ export default function ProcessosPage() {
     const [exporting, setExporting] = useState(false);
     const [refreshKey, setRefreshKey] = useState(0);
     const pollingRef = useRef<ReturnType<typeof setInterval> | null>(null);
+    const streamRef = useRef<EventSource | null>(null);
+    const trackingRef = useRef(false);
 
     useEffect(() => {
         if (status === 'loading') return;
@@ -76,85 +78,88 @@ export default function ProcessosPage() {
         loadData();
     }, [page, search, typeFilter, statusFilter, dateRange, onlyDelayed, refreshKey, isCheckingUpload, uploading]);
 
-    // Cleanup polling on unmount
+    // Cleanup status tracking on unmount
     useEffect(() => {
-        return () => {
-            if (pollingRef.current) {
-                clearInterval(pollingRef.current);
-                pollingRef.current = null;
-            }
-        };
+        return () => stopTracking();
     }, []);
 
+    const stopTracking = () => {
+        trackingRef.current = false;
+        if (pollingRef.current) {
+            clearInterval(pollingRef.current);
+            pollingRef.current = null;
+        }
+        if (streamRef.current) {
+            streamRef.current.close();
+            streamRef.current = null;
+        }
+    };
+
+    const applyUploadStatus = (status: UploadStatus) => {
+        if (status.status === 'processing') {
+            setUploadMessage(status.message || "Processando...");
+            const pctMatch = status.message?.match(/\((\d+)%\)/);
+            if (pctMatch) {
+                setUploadProgress(10 + Math.round(parseInt(pctMatch[1]) * 0.85));
+            } else if (status.message?.includes("Extraindo")) {
+                setUploadProgress(15);
+            }
+        } else if (status.status === 'completed') {
+            stopTracking();
+            setUploadMessage(`Concluído! ${status.processed_count} registros.`);
+            setUploadProgress(100);
+
+            // Refresh data - reset filters and force reload
+            setDateRange(undefined);
+            setStats(null);
+            setPage(1);
+            setRefreshKey(k => k + 1);
+
+            // Reset UI after short delay
+            setTimeout(() => {
+                setUploading(false);
+                setUploadMessage("");
+                setUploadProgress(0);
+            }, 1500);
+        } else if (status.status === 'error') {
+            stopTracking();
+
+            const wasCancelled = status.error?.toLowerCase().includes('cancelado');
+
+            if (wasCancelled) {
+                // User-initiated cancel: reset cleanly
+                setUploadMessage("Upload cancelado.");
+                setUploadProgress(0);
+                setTimeout(() => {
+                    setUploading(false);
+                    setUploadMessage("");
+                }, 1500);
+            } else {
+                // Genuine error
+                setUploading(false);
+                setUploadMessage("");
+                setUploadProgress(0);
+                alert(`Erro no processamento: ${status.error}`);
+            }
+        }
+    };
+
+    // Fallback when the event stream is unavailable: poll /upload/status
     const startPolling = () => {
         if (pollingRef.current) return;
+        trackingRef.current = true;
         let pollFailCount = 0;
         pollingRef.current = setInterval(async () => {
             try {
                 if (typeof document !== "undefined" && document.hidden) return;
                 const status = await getUploadStatus();
                 pollFailCount = 0; // Reset on success
-
-                if (status.status === 'processing') {
-                    setUploadMessage(status.message || "Processando...");
-                    const pctMatch = status.message?.match(/\((\d+)%\)/);
-                    if (pctMatch) {
-                        setUploadProgress(10 + Math.round(parseInt(pctMatch[1]) * 0.85));
-                    } else if (status.message?.includes("Extraindo")) {
-                        setUploadProgress(15);
-                    }
-                } else if (status.status === 'completed') {
-                    if (pollingRef.current) {
-                        clearInterval(pollingRef.current);
-                        pollingRef.current = null;
-                    }
-                    setUploadMessage(`Concluído! ${status.processed_count} registros.`);
-                    setUploadProgress(100);
-
-                    // Refresh data - reset filters and force reload
-                    setDateRange(undefined);
-                    setStats(null);
-                    setPage(1);
-                    setRefreshKey(k => k + 1);
-
-                    // Reset UI after short delay
-                    setTimeout(() => {
-                        setUploading(false);
-                        setUploadMessage("");
-                        setUploadProgress(0);
-                    }, 1500);
-                } else if (status.status === 'error') {
-                    if (pollingRef.current) {
-                        clearInterval(pollingRef.current);
-                        pollingRef.current = null;
-                    }
-
-                    const wasCancelled = status.error?.toLowerCase().includes('cancelado');
-
-                    if (wasCancelled) {
-                        // User-initiated cancel: reset cleanly
-                        setUploadMessage("Upload cancelado.");
-                        setUploadProgress(0);
-                        setTimeout(() => {
-                            setUploading(false);
-                            setUploadMessage("");
-                        }, 1500);
-                    } else {
-                        // Genuine error
-                        setUploading(false);
-                        setUploadMessage("");
-                        setUploadProgress(0);
-                        alert(`Erro no processamento: ${status.error}`);
-                    }
-                }
+                applyUploadStatus(status);
             } catch (err) {
                 console.error("Polling error", err);
                 pollFailCount++;
                 if (pollFailCount >= 5) {
-                    if (pollingRef.current) {
-                        clearInterval(pollingRef.current);
-                        pollingRef.current = null;
-                    }
+                    stopTracking();
                     setUploading(false);
                     setUploadMessage("");
                     setUploadProgress(0);
@@ -164,6 +169,38 @@ export default function ProcessosPage() {
         }, 3000);
     };
 
+    // Progress pushed by /upload/events; falls back to polling if the stream can't be opened or is closed
+    const startTracking = async () => {
+        if (trackingRef.current) return;
+        trackingRef.current = true;
+        if (typeof EventSource === "undefined") {
+            startPolling();
+            return;
+        }
+        try {
+            const source = await openUploadEvents();
+            if (!trackingRef.current) {
+                // Finished or unmounted while the stream token was requested
+                source.close();
+                return;
+            }
+            streamRef.current = source;
+            source.addEventListener('status', (event) => {
+                applyUploadStatus(JSON.parse((event as MessageEvent).data));
+            });
+            source.onerror = () => {
+                // CONNECTING means the browser retries (Last-Event-ID); CLOSED means it gave up
+                if (source.readyState === EventSource.CLOSED && streamRef.current === source) {
+                    streamRef.current = null;
+                    startPolling();
+                }
+            };
+        } catch (err) {
+            console.error("Upload event stream unavailable", err);
+            if (trackingRef.current) startPolling();
+        }
+    };
+
     // Check for ongoing background upload on mount
     useEffect(() => {
         if (status === 'loading' || !canViewProcesses) return;
@@ -175,7 +212,7 @@ export default function ProcessosPage() {
                     setUploadMessage(res.message || "Processando em segundo plano...");
                     setProcesses(null);
                     setStats(null);
-                    startPolling();
+                    startTracking();
                 }
             } catch (e) {
                 console.error("Não foi possível verificar status de upload", e);
@@ -206,7 +243,7 @@ export default function ProcessosPage() {
             // 2. Start Polling
             setUploadMessage("Processando PDF...");
             setUploadProgress(10);
-            startPolling();
+            startTracking();
 
         } catch (error: any) {
             setUploading(false);
@@ -227,7 +264,7 @@ export default function ProcessosPage() {
         try {
             await cancelUpload();
             setUploadMessage("Cancelando...");
-            // Polling will catch the 'error' or 'cancelled' status and reset the UI
+            // The status stream (or polling) will catch the 'error' or 'cancelled' status and reset the UI
         } catch (error) {
             console.error("Falha ao cancelar upload", error);
             alert("Erro ao tentar cancelar o upload. Ele pode já ter terminado.");
@@ -320,8 +357,12 @@ export default function ProcessosPage() {
                                     setStats(null);
                                     setProcesses(null);
                                     setPage(1);
-                                } catch (error) {
-                                    alert('Erro ao limpar registros');
+                                } catch (error: any) {
+                                    if (error.response?.status === 409) {
+                                        alert('Há um arquivo sendo processado. Aguarde ou cancele o envio antes de limpar.');
+                                    } else {
+                                        alert('Erro ao limpar registros');
+                                    }
                                 }
                             }}
                         >
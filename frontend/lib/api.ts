@@ -95,6 +95,13 @@ export const getUploadStatus = async (): Promise<UploadStatus> => {
     return response.data;
 };
 
+// Progress stream of the current upload. EventSource cannot send the Authorization
+// header, so the URL carries a short-lived token that only works for this stream
+export const openUploadEvents = async (): Promise<EventSource> => {
+    const response = await api.post('/upload/events/token');
+    return new EventSource(`${API_URL}/upload/events?stream_token=${encodeURIComponent(response.data.stream_token)}`);
+};
+
 export const uploadPDF = async (file: File) => {
     const formData = new FormData();
     formData.append('file', file);
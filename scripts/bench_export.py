@@ -0,0 +1,143 @@
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+# Benchmark against a throwaway SQLite file unless DATABASE_URL is set explicitly
+if not os.getenv("DATABASE_URL"):
+    _tmp_db = os.path.join(tempfile.mkdtemp(), "bench_export.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{_tmp_db}"
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import pandas as pd
+import xlsxwriter
+
+from database import SessionLocal, engine
+from models import Base, Process, User
+import ingest
+import process_export
+import process_query
+
+# Row counts to export as xlsx, csv, ndjson and parquet; the legacy xlsx writer
+# holds everything in memory, so it only runs up to LEGACY_MAX_ROWS
+SIZES = [int(n) for n in sys.argv[1:]] or [10_000, 100_000, 500_000]
+LEGACY_MAX_ROWS = int(os.getenv("LEGACY_MAX_ROWS", "100000"))
+BATCH_SIZE = 10000
+BENCH_USER = "bench_export"
+
+STATUSES = ["ANDAMENTO", "ENCERRAMENTO", "DEFERIDO", "INDEFERIDO", "CANCELADO", "RETORNO"]
+TIPOS = [f"TIPO DE SOLICITAÇÃO {i:02d}" for i in range(40)]
+
+
+def seed(db, user_id, rows):
+    rng = random.Random(21)
+    first_day = date(2023, 1, 1)
+    now = datetime.utcnow()
+    for start in range(0, rows, BATCH_SIZE):
+        batch = []
+        for i in range(start, min(start + BATCH_SIZE, rows)):
+            opened = first_day + timedelta(days=rng.randint(0, 1000))
+            status = rng.choice(STATUSES)
+            delayed = status == "ANDAMENTO" and rng.random() < 0.5
+            batch.append(ingest.process_row({
+                "id": f"{i:07d} - {opened.year}",
+                "contribuinte": f"{100000000 + i} - CONTRIBUINTE {rng.randint(0, rows // 5)}",
+                "data_abertura": opened.strftime("%d/%m/%Y"),
+                "ano": str(opened.year),
+                "status": status,
+                "setor_atual": "NUCLEO DE CADASTRO",
+                "tipo_solicitacao": rng.choice(TIPOS),
+                "dias_atraso_pdf": 0,
+                "dias_atraso_calc": rng.randint(31, 900) if delayed else 0,
+                "is_atrasado": delayed,
+            }, user_id, 0, now))
+        ingest.bulk_insert_processes(db, batch)
+        db.commit()
+
+
+def legacy_export(db, query):
+    """The previous /export-excel: whole DataFrame, iterrows() into an in-memory workbook."""
+    import io
+    df = pd.read_sql(query.statement, db.bind)
+    df["dt"] = pd.to_datetime(df["data_abertura_date"])
+    df = df.sort_values("dt", ascending=False)
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {"in_memory": True})
+    worksheet = workbook.add_worksheet("Processos")
+    fmt = workbook.add_format({"border": 1, "font_size": 10})
+    for row_idx, (_, row) in enumerate(df.iterrows(), start=4):
+        worksheet.write(row_idx, 0, str(row.get("id", "")), fmt)
+        worksheet.write(row_idx, 1, str(row.get("contribuinte", "")), fmt)
+        worksheet.write(row_idx, 2, str(row.get("data_abertura", "")), fmt)
+        worksheet.write(row_idx, 3, str(row.get("status", "")), fmt)
+        worksheet.write(row_idx, 4, str(row.get("tipo_solicitacao", "")), fmt)
+        worksheet.write(row_idx, 5, f"{row.get('dias_atraso_calc', 0)} dias" if row.get("is_atrasado") else "-", fmt)
+    workbook.close()
+    return len(output.getvalue())
+
+
+def streaming_export(db, query):
+    path = process_export.xlsx_export_file(query, process_query.FilterSpec())
+    try:
+        return os.path.getsize(path)
+    finally:
+        process_export.remove_file(path)
+
+
+def data_export(fmt):
+    def run(db, query):
+        encode = process_export.EXPORT_FORMATS[fmt][0]
+        return sum(len(chunk) for chunk in encode(
+            process_export.export_rows(query, columns=process_export.DATA_COLUMNS)))
+    return run
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = fn(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = db.query(User).filter(User.username == BENCH_USER).first()
+    if not user:
+        user = User(username=BENCH_USER, hashed_password="-", is_active=False)
+        db.add(user)
+        db.commit()
+
+    try:
+        print(f"Engine: {engine.url.render_as_string(hide_password=True)} ({engine.dialect.name})")
+        print(f"{'rows':>8} | {'writer':<9} | {'seconds':>8} | {'rows/s':>9} | {'peak MB':>8} | {'file MB':>7}")
+        for rows in SIZES:
+            db.query(Process).filter(Process.user_id == user.id).delete(synchronize_session=False)
+            db.commit()
+            seed(db, user.id, rows)
+            query = db.query(Process).filter(Process.user_id == user.id, Process.dataset_version == 0)
+            writers = [("xlsx", streaming_export)]
+            if rows <= LEGACY_MAX_ROWS:
+                writers.insert(0, ("xlsx-old", legacy_export))
+            writers += [(fmt, data_export(fmt)) for fmt in process_export.EXPORT_FORMATS
+                        if process_export.format_available(fmt)]
+            for name, fn in writers:
+                elapsed, peak, size = measure(fn, db, query)
+                db.expunge_all()
+                print(f"{rows:>8} | {name:<9} | {elapsed:>8.2f} | {rows / elapsed:>9.0f} | "
+                      f"{peak / 1024 / 1024:>8.1f} | {size / 1024 / 1024:>7.1f}")
+    finally:
+        db.query(Process).filter(Process.user_id == user.id).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
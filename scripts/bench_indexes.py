@@ -0,0 +1,156 @@
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# Benchmark against a throwaway SQLite file unless DATABASE_URL is set explicitly
+if not os.getenv("DATABASE_URL"):
+    _tmp_db = os.path.join(tempfile.mkdtemp(), "bench_indexes.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{_tmp_db}"
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from sqlalchemy import func
+
+from database import SessionLocal, engine
+from models import Base, Process, User
+import ingest
+import process_query
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+USERS = 10
+BATCH_SIZE = 10000
+REPEAT = 5
+BENCH_PREFIX = "bench_indexes"
+
+STATUSES = ["ANDAMENTO", "ENCERRAMENTO", "DEFERIDO", "INDEFERIDO", "SUSPENSO", "RETORNO"]
+TIPOS = [f"TIPO DE SOLICITACAO {i:02d}" for i in range(40)]
+COMPOSITE_INDEXES = [
+    "ix_processes_user_status", "ix_processes_user_tipo",
+    "ix_processes_user_date", "ix_processes_user_delayed",
+]
+
+
+def seed(db, user_ids):
+    """ROWS synthetic processes spread over USERS users (same shape as real uploads)."""
+    rng = random.Random(11)
+    first_day = date(2023, 1, 1)
+    now = datetime.utcnow()
+    for start in range(0, ROWS, BATCH_SIZE):
+        batch = []
+        for i in range(start, min(start + BATCH_SIZE, ROWS)):
+            is_atrasado = rng.random() < 0.15
+            opened = first_day + timedelta(days=rng.randint(0, 1000))
+            batch.append(ingest.process_row({
+                "id": f"{i:07d} - {opened.year}",
+                "contribuinte": f"{100000000 + i} - CONTRIBUINTE {i}",
+                "data_abertura": opened.strftime("%d/%m/%Y"),
+                "ano": str(opened.year),
+                "status": rng.choice(STATUSES),
+                "setor_atual": "NUCLEO DE CADASTRO",
+                "tipo_solicitacao": rng.choice(TIPOS),
+                "dias_atraso_pdf": rng.randint(0, 400),
+                "dias_atraso_calc": rng.randint(1, 300) if is_atrasado else 0,
+                "is_atrasado": is_atrasado,
+            }, user_ids[i % len(user_ids)], 0, now))
+        ingest.bulk_insert_processes(db, batch)
+        db.commit()
+
+
+def workload(db, user_id):
+    """The per-user queries issued by /processes and /stats."""
+    base = db.query(Process).filter(Process.user_id == user_id, Process.dataset_version == 0)
+    date_range = process_query.FilterSpec(start_date="2024-03-01", end_date="2024-05-31").apply(base)
+    by_status = process_query.FilterSpec(status_filter="ANDAMENTO").apply(base)
+    by_tipo = process_query.FilterSpec(type_filter=TIPOS[3]).apply(base)
+    delayed = process_query.FilterSpec(only_delayed=True).apply(base)
+    return {
+        "page (recent first)": base.order_by(*process_query.process_order()).limit(10),
+        "count status": by_status.with_entities(func.count(Process.pk)),
+        "page tipo": by_tipo.order_by(*process_query.process_order()).limit(10),
+        "count date range": date_range.with_entities(func.count(Process.pk)),
+        "page delayed": delayed.order_by(*process_query.process_order(True)).limit(10),
+        "group by status": base.with_entities(Process.status, func.count(Process.pk)).group_by(Process.status),
+    }
+
+
+def explain(conn, query):
+    compiled = query.statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    if engine.dialect.name == "postgresql":
+        rows = conn.exec_driver_sql(f"EXPLAIN ANALYZE {compiled}").fetchall()
+        return [r[0] for r in rows]
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").fetchall()
+    return [r[-1] for r in rows]
+
+
+def run(label, db, user_id):
+    print(f"\n=== {label} ===")
+    with engine.connect() as conn:
+        for name, query in workload(db, user_id).items():
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                query.all()
+            elapsed = (time.perf_counter() - start) / REPEAT
+            print(f"{name:<22} {elapsed * 1000:>9.2f} ms")
+            for line in explain(conn, query):
+                print(f"    {line}")
+
+
+def drop_composites():
+    with engine.begin() as conn:
+        for name in COMPOSITE_INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+
+
+def create_composites():
+    with engine.begin() as conn:
+        for index in Process.__table__.indexes:
+            if index.name in COMPOSITE_INDEXES:
+                index.create(conn, checkfirst=True)
+        if engine.dialect.name == "sqlite":
+            conn.exec_driver_sql("ANALYZE")
+        elif engine.dialect.name == "postgresql":
+            conn.exec_driver_sql("ANALYZE processes")
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user_ids = []
+    for n in range(USERS):
+        username = f"{BENCH_PREFIX}_{n}"
+        user = db.query(User).filter(User.username == username).first()
+        if not user:
+            user = User(username=username, hashed_password="-", is_active=False)
+            db.add(user)
+            db.commit()
+        user_ids.append(user.id)
+
+    try:
+        print(f"Engine: {engine.url.render_as_string(hide_password=True)} ({engine.dialect.name})")
+        db.query(Process).filter(Process.user_id.in_(user_ids)).delete(synchronize_session=False)
+        db.commit()
+        drop_composites()
+
+        start = time.perf_counter()
+        seed(db, user_ids)
+        print(f"Seeded {ROWS} rows for {USERS} users in {time.perf_counter() - start:.1f}s")
+        if engine.dialect.name == "sqlite":
+            with engine.begin() as conn:
+                conn.exec_driver_sql("ANALYZE")
+
+        run("before (single-column indexes only)", db, user_ids[0])
+        start = time.perf_counter()
+        create_composites()
+        print(f"\nCreated composite indexes in {time.perf_counter() - start:.1f}s")
+        run("after (composite indexes)", db, user_ids[0])
+    finally:
+        db.query(Process).filter(Process.user_id.in_(user_ids)).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
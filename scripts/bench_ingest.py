@@ -0,0 +1,97 @@
+import os
+import random
+import sys
+import tempfile
+import time
+
+# Benchmark against a throwaway SQLite file unless DATABASE_URL is set explicitly
+if not os.getenv("DATABASE_URL"):
+    _tmp_db = os.path.join(tempfile.mkdtemp(), "bench_ingest.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{_tmp_db}"
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from database import SessionLocal, engine
+from models import Base, Process, User
+import ingest
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+BATCH_SIZE = 1000
+BENCH_USER = "bench_ingest"
+
+STATUSES = ["ANDAMENTO", "ENCERRAMENTO", "DEFERIDO", "INDEFERIDO", "SUSPENSO"]
+TIPOS = ["ALVARÁ DE FUNCIONAMENTO", "BAIXA DE DÉBITOS", "BENEFÍCIOS FISCAIS", "CERTIDÃO NEGATIVA"]
+
+
+def synthetic_records(n, seed=7):
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        is_atrasado = rng.random() < 0.2
+        records.append({
+            "id": f"{i:06d} - 2026",
+            "contribuinte": f"{100000000 + i} - CONTRIBUINTE {i}",
+            "data_abertura": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2025",
+            "ano": "2026",
+            "status": rng.choice(STATUSES),
+            "setor_atual": "NUCLEO DE CADASTRO",
+            "tipo_solicitacao": rng.choice(TIPOS),
+            "dias_atraso_pdf": rng.randint(0, 400),
+            "dias_atraso_calc": rng.randint(1, 300) if is_atrasado else 0,
+            "is_atrasado": is_atrasado,
+        })
+    return records
+
+
+def orm_loop(db, records, user_id):
+    """The previous save loop: one ORM object per record, commit per batch."""
+    for i, item in enumerate(records):
+        db.add(Process(user_id=user_id, **item))
+        if (i + 1) % BATCH_SIZE == 0 or (i + 1) == len(records):
+            db.commit()
+
+
+def bulk_path(db, records, user_id):
+    for start in range(0, len(records), BATCH_SIZE):
+        batch = [ingest.process_row(item, user_id) for item in records[start:start + BATCH_SIZE]]
+        ingest.bulk_insert_processes(db, batch)
+        db.commit()
+
+
+def run(name, fn, records, user_id):
+    db = SessionLocal()
+    try:
+        db.query(Process).filter(Process.user_id == user_id).delete()
+        db.commit()
+        start = time.perf_counter()
+        fn(db, records, user_id)
+        elapsed = time.perf_counter() - start
+        count = db.query(Process).filter(Process.user_id == user_id).count()
+        print(f"{name:<10} {count:>8} rows {elapsed:>8.2f}s {count / elapsed:>10.0f} rows/s")
+        db.query(Process).filter(Process.user_id == user_id).delete()
+        db.commit()
+        return elapsed
+    finally:
+        db.close()
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = db.query(User).filter(User.username == BENCH_USER).first()
+    if not user:
+        user = User(username=BENCH_USER, hashed_password="-", is_active=False)
+        db.add(user)
+        db.commit()
+    user_id = user.id
+    db.close()
+
+    records = synthetic_records(ROWS)
+    print(f"Engine: {engine.url.render_as_string(hide_password=True)} ({engine.dialect.name})")
+    orm_t = run("orm", orm_loop, records, user_id)
+    bulk_t = run("bulk", bulk_path, records, user_id)
+    print(f"speedup: {orm_t / bulk_t:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
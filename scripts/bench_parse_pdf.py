@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from process_pdf import parse_pdf, _count_pages
+
+WORKER_COUNTS = [1, 2, 4, 8]
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python bench_parse_pdf.py <file.pdf> [workers,...]", file=sys.stderr)
+        sys.exit(1)
+    pdf_path = sys.argv[1]
+    counts = [int(w) for w in sys.argv[2].split(",")] if len(sys.argv) > 2 else WORKER_COUNTS
+
+    total_pages = _count_pages(pdf_path)
+    print(f"PDF: {pdf_path} ({total_pages} pages, {os.cpu_count()} CPUs)")
+    print(f"{'workers':>8} {'records':>8} {'seconds':>8} {'pages/s':>8}")
+
+    baseline = None
+    for workers in counts:
+        start = time.perf_counter()
+        data = parse_pdf(pdf_path, workers=workers)
+        elapsed = time.perf_counter() - start
+        print(f"{workers:>8} {len(data):>8} {elapsed:>8.2f} {total_pages / elapsed:>8.1f}")
+
+        ids = [d["id"] for d in data]
+        if baseline is None:
+            baseline = ids
+        elif ids != baseline:
+            print(f"  WARNING: output with {workers} workers differs from {counts[0]} worker(s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from process_pdf import (
+    ROW_TOLERANCE, COL_ID_END, COL_CONTRIB_END, COL_DATAS_END, COL_STATUS_END,
+    COL_SETOR_END, COL_TIPO_END, COL_TITULO_END, cluster_rows, assign_columns,
+)
+
+WORDS = 2000
+REPEAT = 20
+
+# Column start positions roughly as observed in Sistema Terra exports
+COLUMN_X = [30, 90, 220, 389, 485.4, 581.7, 680, 780]
+
+
+def legacy_rows(words):
+    """Original quadratic grouping + if/elif column ladder from parse_pdf."""
+    row_groups = []
+    for w in sorted(words, key=lambda w: w["top"]):
+        placed = False
+        for grp in row_groups:
+            if abs(w["top"] - grp[0]) <= ROW_TOLERANCE:
+                grp[1].append(w)
+                placed = True
+                break
+        if not placed:
+            row_groups.append((w["top"], [w]))
+
+    rows = []
+    for _, row_words_unsorted in sorted(row_groups, key=lambda g: g[0]):
+        cols = [[] for _ in range(8)]
+        for w in sorted(row_words_unsorted, key=lambda w: w["x0"]):
+            x = w["x0"]
+            if x < COL_ID_END:
+                cols[0].append(w["text"])
+            elif x < COL_CONTRIB_END:
+                cols[1].append(w["text"])
+            elif x < COL_DATAS_END:
+                cols[2].append(w["text"])
+            elif x < COL_STATUS_END:
+                cols[3].append(w["text"])
+            elif x < COL_SETOR_END:
+                cols[4].append(w["text"])
+            elif x < COL_TIPO_END:
+                cols[5].append(w["text"])
+            elif x < COL_TITULO_END:
+                cols[6].append(w["text"])
+            else:
+                cols[7].append(w["text"])
+        rows.append(cols)
+    return rows
+
+
+def new_rows(words):
+    return [assign_columns(row) for row in cluster_rows(words)]
+
+
+def synthetic_page(n_words, seed=42):
+    """Dense page: rows every ~8.5px with per-word vertical jitter, words spread over all columns."""
+    rng = random.Random(seed)
+    words = []
+    row = 0
+    while len(words) < n_words:
+        top = 40 + row * 8.5
+        for col, x in enumerate(COLUMN_X):
+            for k in range(rng.randint(0, 2)):
+                words.append({
+                    "text": f"r{row}c{col}w{k}",
+                    "top": top + rng.uniform(-1.5, 1.5),
+                    # Exercise the exact boundaries too
+                    "x0": rng.choice([x + k * 20, COL_DATAS_END, COL_STATUS_END]) if rng.random() < 0.02 else x + k * 20,
+                })
+        row += 1
+    rng.shuffle(words)
+    return words[:n_words]
+
+
+def bench(fn, words):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        result = fn(words)
+    return result, (time.perf_counter() - start) / REPEAT
+
+
+def main():
+    words = synthetic_page(WORDS)
+    legacy, legacy_t = bench(legacy_rows, words)
+    new, new_t = bench(new_rows, words)
+
+    print(f"Synthetic page: {len(words)} words, {len(new)} rows")
+    print(f"legacy (quadratic + if/elif): {legacy_t * 1000:8.2f} ms/page")
+    print(f"sweep + bisect              : {new_t * 1000:8.2f} ms/page")
+    print(f"speedup: {legacy_t / new_t:.1f}x")
+
+    if legacy != new:
+        print("ERROR: outputs differ", file=sys.stderr)
+        sys.exit(1)
+    print("Outputs identical.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+# Benchmark against a throwaway SQLite file unless DATABASE_URL is set explicitly
+if not os.getenv("DATABASE_URL"):
+    _tmp_db = os.path.join(tempfile.mkdtemp(), "bench_suggest.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{_tmp_db}"
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from database import SessionLocal, engine
+from models import Base, Process, ProcessSuggestion, User
+import ingest
+import process_search
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+BATCH_SIZE = 10000
+REPEAT = 20
+BENCH_USER = "bench_suggest"
+
+FIRST_NAMES = ["JOÃO", "JOSÉ", "MARIA", "ANA", "ANTÔNIO", "FRANCISCO", "CARLOS", "PAULO", "PEDRO", "LUCAS",
+               "LUÍZA", "MÁRCIA", "JÚLIA", "FERNANDA", "RAFAEL", "CONCEIÇÃO", "SEBASTIÃO", "IRACEMA"]
+LAST_NAMES = ["SILVA", "SANTOS", "OLIVEIRA", "SOUZA", "RODRIGUES", "FERREIRA", "ALVES", "PEREIRA", "LIMA",
+              "GOMES", "COSTA", "RIBEIRO", "MARTINS", "CARVALHO", "ARAÚJO", "MELO", "BARBOSA", "ROCHA"]
+TIPOS = [f"TIPO DE SOLICITAÇÃO {i:02d}" for i in range(40)]
+PREFIXES = {
+    "contribuinte": ["j", "jo", "joao", "joao da s", "maria sil", "conceicao", "x"],
+    "tipo": ["t", "tipo de sol", "tipo de solicitacao 1", "z"],
+}
+
+
+def seed(db, user_id):
+    """ROWS processes of one user; taxpayers repeat across processes, like real uploads."""
+    rng = random.Random(20)
+    names = [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(ROWS // 5)]
+    first_day = date(2023, 1, 1)
+    now = datetime.utcnow()
+    for start in range(0, ROWS, BATCH_SIZE):
+        batch = []
+        for i in range(start, min(start + BATCH_SIZE, ROWS)):
+            opened = first_day + timedelta(days=rng.randint(0, 1000))
+            batch.append(ingest.process_row({
+                "id": f"{i:07d} - {opened.year}",
+                "contribuinte": f"{100000000 + i} - {rng.choice(names)}",
+                "data_abertura": opened.strftime("%d/%m/%Y"),
+                "ano": str(opened.year),
+                "status": "ANDAMENTO",
+                "setor_atual": "NUCLEO DE CADASTRO",
+                "tipo_solicitacao": rng.choice(TIPOS),
+                "dias_atraso_pdf": 0,
+                "dias_atraso_calc": 0,
+                "is_atrasado": False,
+            }, user_id, 0, now))
+        ingest.bulk_insert_processes(db, batch)
+        db.commit()
+
+
+def explain(conn, query):
+    compiled = query.statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    if engine.dialect.name == "postgresql":
+        rows = conn.exec_driver_sql(f"EXPLAIN ANALYZE {compiled}").fetchall()
+        return [r[0] for r in rows]
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").fetchall()
+    return [r[-1] for r in rows]
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = db.query(User).filter(User.username == BENCH_USER).first()
+    if not user:
+        user = User(username=BENCH_USER, hashed_password="-", is_active=False)
+        db.add(user)
+        db.commit()
+
+    try:
+        print(f"Engine: {engine.url.render_as_string(hide_password=True)} ({engine.dialect.name})")
+        db.query(Process).filter(Process.user_id == user.id).delete(synchronize_session=False)
+        db.commit()
+        start = time.perf_counter()
+        seed(db, user.id)
+        print(f"Seeded {ROWS} rows in {time.perf_counter() - start:.1f}s")
+        start = time.perf_counter()
+        ingest.build_dataset_aggregates(db, user.id, 0)
+        db.commit()
+        print(f"Built dataset aggregates in {time.perf_counter() - start:.2f}s")
+        if engine.dialect.name == "sqlite":
+            with engine.begin() as conn:
+                conn.exec_driver_sql("ANALYZE")
+
+        base = db.query(Process).filter(Process.user_id == user.id, Process.dataset_version == 0)
+        for field, prefixes in PREFIXES.items():
+            print(f"\n=== {field} ===   process rows | process_suggestions")
+            for q in prefixes:
+                timings = []
+                for index in (None, (db, user.id, 0)):
+                    start = time.perf_counter()
+                    for _ in range(REPEAT):
+                        result = process_search.suggest(base, field, q, index=index)
+                    timings.append((time.perf_counter() - start) / REPEAT)
+                top = result[0] if result else None
+                print(f"{q!r:<26} {timings[0] * 1000:>8.2f} ms | {timings[1] * 1000:>6.2f} ms  top={top}")
+        sample = db.query(ProcessSuggestion.key, ProcessSuggestion.count).filter(
+            ProcessSuggestion.user_id == user.id, ProcessSuggestion.dataset_version == 0,
+            ProcessSuggestion.field == "contribuinte",
+            ProcessSuggestion.key >= "JOAO", ProcessSuggestion.key < "JOAP",
+        ).order_by(ProcessSuggestion.count.desc()).limit(process_search.SUGGEST_LIMIT)
+        print("\nPlan (contribuinte 'joao'):")
+        with engine.connect() as conn:
+            for line in explain(conn, sample):
+                print(f"    {line}")
+    finally:
+        db.query(Process).filter(Process.user_id == user.id).delete(synchronize_session=False)
+        ingest.delete_dataset_aggregates(db, user.id)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
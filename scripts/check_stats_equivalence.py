@@ -0,0 +1,217 @@
+import calendar
+import os
+import random
+import sys
+import tempfile
+from datetime import date, timedelta
+
+# Always runs against a throwaway SQLite file
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'check_stats.db')}"
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import pandas as pd
+
+from database import SessionLocal, engine
+from models import Base, Process, User
+import ingest
+import process_frame
+import process_query
+import process_search
+import process_stats
+
+DATASETS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+QUERIES_PER_DATASET = 25
+
+STATUSES = ["ANDAMENTO", "ENCERRAMENTO", "DEFERIDO", "INDEFERIDO", "SUSPENSO", "RETORNO", "EM DILIGENCIA"]
+TIPOS = ["ALVARÁ DE FUNCIONAMENTO", "BAIXA DE DÉBITOS", "CERTIDÃO NEGATIVA", "ISENÇÃO DE IPTU",
+         "RESTITUIÇÃO", "REVISÃO DE LANÇAMENTO", "PARCELAMENTO", "ITBI", "OUTROS"]
+NAMES = ["SILVA", "SOUZA", "OLIVEIRA", "PEREIRA", "LIMA", "COSTA"]
+
+
+def pandas_stats(df, search=None, type_filter=None, status_filter=None,
+                 start_date=None, end_date=None, only_delayed=False):
+    """The previous /stats implementation (pandas over the whole dataset)."""
+    if df.empty:
+        return {
+            "total": 0, "encerrados": 0, "andamento": 0, "atrasados": 0,
+            "by_month": [], "by_type": [], "by_type_delayed": [],
+            "by_type_closed_top": [], "by_type_closed_bottom": [],
+            "all_statuses": [], "all_types": [], "available_months": []
+        }
+    df = df.copy()
+    df['dt'] = pd.to_datetime(df['data_abertura_date'])
+
+    all_statuses = sorted(df['status'].dropna().unique().tolist())
+    all_types = sorted(df['tipo_solicitacao'].dropna().unique().tolist())
+    available_months = sorted(df['month_year'].dropna().unique().tolist())
+
+    if search:
+        # Accent-insensitive since the search index (process_search.py)
+        term = process_search.normalize_term(search)
+        fold = lambda col: df[col].astype(str).map(process_search.normalize_term)
+        df = df[
+            fold('id').str.contains(term, regex=False) |
+            fold('contribuinte').str.contains(term, regex=False) |
+            fold('tipo_solicitacao').str.contains(term, regex=False)
+        ]
+    if type_filter:
+        df = df[df['tipo_solicitacao'].isin(type_filter.split(','))]
+    if status_filter:
+        df = df[df['status'].isin(status_filter.split(','))]
+    if start_date:
+        df = df[df['dt'] >= pd.to_datetime(start_date)]
+    if end_date:
+        df = df[df['dt'] <= pd.to_datetime(end_date)]
+    if only_delayed:
+        df = df[df['is_atrasado'] == True]
+
+    closed_mask = df['status'].str.contains('ENCERRAMENTO|DEFERIDO|INDEFERIDO', na=False, case=False)
+    evolution_data = []
+    if not df.empty:
+        evolution = df.groupby('month_year').agg(
+            total=('id', 'count'),
+            encerrados=('status', lambda x: x.str.contains('ENCERRAMENTO|DEFERIDO|INDEFERIDO', na=False, case=False).sum()),
+            andamento=('status', lambda x: (x == 'ANDAMENTO').sum()),
+            atrasados=('is_atrasado', 'sum')
+        ).reset_index().sort_values('month_year')
+        evolution_data = evolution.to_dict('records')
+
+    closed_df = df[closed_mask]
+    delayed_df = df[df['is_atrasado'] == True]
+    return {
+        "total": len(df),
+        "encerrados": int(closed_mask.sum()),
+        "andamento": int((df['status'] == 'ANDAMENTO').sum()),
+        "atrasados": int((df['is_atrasado'] == True).sum()),
+        "by_month": [{k: (int(v) if k != 'month_year' else v) for k, v in r.items()} for r in evolution_data],
+        # Full counts: the top-10 cut is checked against these (ties may be ordered differently)
+        "by_type": df['tipo_solicitacao'].value_counts().to_dict(),
+        "by_type_delayed": delayed_df['tipo_solicitacao'].value_counts().to_dict(),
+        "by_type_closed": closed_df['tipo_solicitacao'].value_counts().to_dict(),
+        "all_statuses": all_statuses,
+        "all_types": all_types,
+        "available_months": available_months,
+    }
+
+
+def same_ranking(ranked, full_counts, ascending=False):
+    """`ranked` is a valid top-10 of `full_counts` (equal counts may appear in any order)."""
+    expected = sorted(full_counts.values(), reverse=not ascending)[:process_stats.TOP_N]
+    return ([r["count"] for r in ranked] == expected
+            and all(full_counts.get(r["type"]) == r["count"] for r in ranked))
+
+
+def compare(sql, ref):
+    errors = []
+    for key in ("total", "encerrados", "andamento", "atrasados", "by_month",
+                "all_statuses", "all_types", "available_months"):
+        if sql[key] != ref[key]:
+            errors.append(key)
+    if not same_ranking(sql["by_type"], ref["by_type"]):
+        errors.append("by_type")
+    if not same_ranking(sql["by_type_delayed"], ref["by_type_delayed"]):
+        errors.append("by_type_delayed")
+    if not same_ranking(sql["by_type_closed_top"], ref["by_type_closed"]):
+        errors.append("by_type_closed_top")
+    if not same_ranking(sql["by_type_closed_bottom"], ref["by_type_closed"], ascending=True):
+        errors.append("by_type_closed_bottom")
+    return errors
+
+
+def random_dataset(rng, n):
+    first_day = date(2024, 1, 1)
+    records = []
+    for i in range(n):
+        opened = first_day + timedelta(days=rng.randint(0, 500))
+        data_abertura = opened.strftime("%d/%m/%Y")
+        if rng.random() < 0.03:
+            data_abertura = rng.choice(["", "31/02/2025"])  # rows without a valid date
+        is_atrasado = rng.random() < 0.25
+        records.append({
+            "id": f"{i:06d} - {opened.year}",
+            "contribuinte": f"{rng.randint(10**8, 10**9)} - {rng.choice(NAMES)} {i}",
+            "data_abertura": data_abertura,
+            "ano": str(opened.year),
+            "status": rng.choice(STATUSES),
+            "setor_atual": "NUCLEO DE CADASTRO",
+            "tipo_solicitacao": rng.choice(TIPOS[:rng.randint(3, len(TIPOS))]),
+            "dias_atraso_pdf": rng.randint(0, 400),
+            "dias_atraso_calc": rng.randint(1, 300) if is_atrasado else 0,
+            "is_atrasado": is_atrasado,
+        })
+    return records
+
+
+def random_filters(rng):
+    filters = {}
+    if rng.random() < 0.3:
+        filters["search"] = rng.choice(NAMES + ["alvará", "alvara", "2025", "00012", "débitos", "certidao", "ao", "ç"]).lower()
+    if rng.random() < 0.3:
+        filters["type_filter"] = ",".join(rng.sample(TIPOS, rng.randint(1, 3)))
+    if rng.random() < 0.3:
+        filters["status_filter"] = ",".join(rng.sample(STATUSES, rng.randint(1, 3)))
+    if rng.random() < 0.3:
+        # Whole months: answered from the stats cube
+        first, last = sorted(rng.sample(range(18), 2))
+        if rng.random() < 0.8:
+            filters["start_date"] = date(2024 + first // 12, first % 12 + 1, 1).isoformat()
+        year, month = 2024 + last // 12, last % 12 + 1
+        filters["end_date"] = date(year, month, calendar.monthrange(year, month)[1]).isoformat()
+    elif rng.random() < 0.4:
+        start = date(2024, 1, 1) + timedelta(days=rng.randint(0, 400))
+        filters["start_date"] = start.isoformat()
+        if rng.random() < 0.7:
+            filters["end_date"] = (start + timedelta(days=rng.randint(0, 200))).isoformat()
+    if rng.random() < 0.3:
+        filters["only_delayed"] = True
+    return filters
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        process_search.ensure_search_index(conn)
+    db = SessionLocal()
+    user = User(username="check_stats", hashed_password="-", is_active=False)
+    db.add(user)
+    db.commit()
+
+    failures = 0
+    checks = 0
+    for seed in range(DATASETS):
+        rng = random.Random(seed)
+        db.query(Process).filter(Process.user_id == user.id).delete()
+        rows = [ingest.process_row(r, user.id) for r in random_dataset(rng, rng.randint(0, 3000))]
+        ingest.bulk_insert_processes(db, rows)
+        ingest.build_dataset_aggregates(db, user.id, 0)
+        db.commit()
+
+        base = db.query(Process).filter(Process.user_id == user.id, Process.dataset_version == 0)
+        df = pd.read_sql(base.statement, db.bind)
+        frame = process_frame.load_processes(base, db.bind)
+        for _ in range(QUERIES_PER_DATASET):
+            filters = random_filters(rng)
+            spec = process_query.FilterSpec(**filters)
+            ref = pandas_stats(df, **filters)
+            # Row path, then the stats cube (which falls back to rows for other filters)
+            for path, cube in (("rows", None), ("cube", (db, user.id, 0))):
+                errors = compare(process_stats.compute_stats(base, spec, cube=cube), ref)
+                checks += 1
+                if errors:
+                    failures += 1
+                    print(f"MISMATCH {path} dataset={seed} rows={len(rows)} filters={filters}: {', '.join(errors)}")
+            # The pandas mask (AI report) selects the same rows as the SQL predicates
+            sql_ids = {r.id for r in spec.apply(base).with_entities(Process.id)}
+            checks += 1
+            if set(frame.loc[spec.mask(frame), "id"]) != sql_ids:
+                failures += 1
+                print(f"MISMATCH mask dataset={seed} rows={len(rows)} filters={filters}")
+
+    db.close()
+    print(f"{checks} comparisons on {DATASETS} random datasets, {failures} mismatches")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import random
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+# Measure against a throwaway SQLite file unless DATABASE_URL is set explicitly
+if not os.getenv("DATABASE_URL"):
+    _tmp_db = os.path.join(tempfile.mkdtemp(), "report_frame_memory.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{_tmp_db}"
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import pandas as pd
+
+from database import SessionLocal, engine
+from models import Base, Process, User
+from ai_agent import summarize_data
+import ingest
+import process_frame
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+BATCH_SIZE = 10000
+BENCH_USER = "report_frame_memory"
+
+STATUSES = ["ANDAMENTO", "ENCERRAMENTO", "DEFERIDO", "INDEFERIDO", "CANCELADO", "RETORNO"]
+SETORES = [f"NUCLEO {i:02d}" for i in range(25)]
+TIPOS = [f"TIPO DE SOLICITAÇÃO {i:02d}" for i in range(40)]
+
+
+def seed(db, user_id):
+    rng = random.Random(24)
+    first_day = date(2020, 1, 1)
+    now = datetime.utcnow()
+    for start in range(0, ROWS, BATCH_SIZE):
+        batch = []
+        for i in range(start, min(start + BATCH_SIZE, ROWS)):
+            opened = first_day + timedelta(days=rng.randint(0, 2500))
+            status = rng.choice(STATUSES)
+            delayed = status == "ANDAMENTO" and rng.random() < 0.5
+            batch.append(ingest.process_row({
+                "id": f"{i:07d} - {opened.year}",
+                "contribuinte": f"{100000000 + i} - CONTRIBUINTE {rng.randint(0, ROWS // 5)}",
+                "data_abertura": opened.strftime("%d/%m/%Y"),
+                "ano": str(opened.year),
+                "status": status,
+                "setor_atual": rng.choice(SETORES),
+                "tipo_solicitacao": rng.choice(TIPOS),
+                "dias_atraso_pdf": rng.randint(0, 2000),
+                "dias_atraso_calc": rng.randint(31, 2500) if delayed else 0,
+                "is_atrasado": delayed,
+            }, user_id, 0, now))
+        ingest.bulk_insert_processes(db, batch)
+        db.commit()
+
+
+def legacy_frame(query, bind):
+    """What the endpoints loaded before process_frame: every column, default dtypes."""
+    df = pd.read_sql(query.statement, bind)
+    df["dt"] = pd.to_datetime(df["data_abertura_date"])
+    return df
+
+
+def per_row(df):
+    usage = df.memory_usage(index=False, deep=True)
+    return {col: usage[col] / len(df) for col in df.columns}
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    user = db.query(User).filter(User.username == BENCH_USER).first()
+    if not user:
+        user = User(username=BENCH_USER, hashed_password="-", is_active=False)
+        db.add(user)
+        db.commit()
+
+    try:
+        db.query(Process).filter(Process.user_id == user.id).delete(synchronize_session=False)
+        db.commit()
+        seed(db, user.id)
+        query = db.query(Process).filter(Process.user_id == user.id, Process.dataset_version == 0)
+
+        before = legacy_frame(query, db.bind)
+        after = process_frame.load_processes(query, db.bind)
+        before_cols, after_cols = per_row(before), per_row(after)
+
+        print(f"Engine: {engine.url.render_as_string(hide_password=True)} ({engine.dialect.name}), {ROWS} rows")
+        print(f"{'column':<20} | {'before':>16} | {'after':>16} | bytes/row")
+        for col in sorted(set(before_cols) | set(after_cols), key=lambda c: -before_cols.get(c, 0)):
+            b = f"{before[col].dtype} {before_cols[col]:.1f}" if col in before_cols else "-"
+            a = f"{after[col].dtype} {after_cols[col]:.1f}" if col in after_cols else "-"
+            print(f"{col:<20} | {b:>16} | {a:>16}")
+        total_before, total_after = sum(before_cols.values()), sum(after_cols.values())
+        print(f"{'total':<20} | {total_before:>16.1f} | {total_after:>16.1f} | "
+              f"{100 * (1 - total_after / total_before):.0f}% smaller")
+
+        # The AI report summary must not change with the dtypes
+        for name, frame in (("before", before), ("after", after)):
+            frame = frame[frame["status"].isin(["ANDAMENTO", "RETORNO"])].sort_values("dt", ascending=False)
+            summary = summarize_data(frame)
+            if name == "before":
+                expected = summary
+        print(f"\nsummarize_data identical on a filtered frame: {summary == expected}")
+    finally:
+        db.query(Process).filter(Process.user_id == user.id).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()